@@ -0,0 +1,43 @@
+"""
+The registry of the supported search areas. The areas are listed in a json file (areas.json, in the project's root) of
+the form:
+{
+    <area name>: {
+        "box": [West, South, East, North],  # The bounding box of the area (see OsmDataCollector).
+        "corner": [lat, lon],  # The top left coordinates of the area's elevation tile.
+        "tile": <tile name>  # The name of the area's elevation (hgt) file, for example: "N48E008".
+    },
+    ...
+}
+Both OsmDbGenerator and UserRelated/Main read the registry, so adding an area is a change of this file only.
+"""
+
+import json
+import os
+
+PROJECT_DIR_PATH = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_PATH = os.path.join(PROJECT_DIR_PATH, 'areas.json')
+AREAS_DIR_NAME = 'areas_databases'
+AREA_FIELDS = ['box', 'corner', 'tile']
+
+
+def load_areas(path=REGISTRY_PATH) -> dict:
+    """
+    Reads the areas registry.
+    :param path: the path of the registry file.
+    :return: a dictionary of the form {area name: {'box': [...], 'corner': [...], 'tile': ...}}
+    """
+    with open(path, 'r') as f:
+        areas = json.load(f)
+    for area_name, area in areas.items():
+        missing = [field for field in AREA_FIELDS if field not in area]
+        if missing:
+            raise ValueError('area ' + area_name + ' in ' + path + ' is missing: ' + ', '.join(missing))
+    return areas
+
+
+def get_area_db_path(area_name: str) -> str:
+    """
+    :return: the absolute path of the json data base of the given area (see OsmDbGenerator).
+    """
+    return os.path.join(PROJECT_DIR_PATH, AREAS_DIR_NAME, area_name, area_name + '_db.json')
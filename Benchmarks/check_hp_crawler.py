@@ -0,0 +1,101 @@
+"""
+Checks HpCrawler's http backend end to end, without the network: crawls a synthetic HikingProject website (see
+synthetic.SyntheticHpServer) into a temporary directory, and checks the crawling progress and the saved tracks against
+the website's trails: the login, the paginated trail lists, the stats and features of the trail pages and the gpx
+downloads.
+
+Usage (from the repository root): python -m Benchmarks.check_hp_crawler [--seed SEED]
+The exit code is 1 if any of the checks fails.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import numpy as np
+from Benchmarks import synthetic
+
+BOX = [8.3, 48.5, 8.4, 48.6]  # [West, South, East, North]
+TRAILS = {'Spain': 7, 'Nevada': 4}  # The number of trails of every country of the synthetic website.
+PAGE_SIZE = 3  # The number of trails in every part of a country's trail list.
+EMAIL = 'crawler@example.com'
+PASSWORD = 'synthetic-password'
+DEFAULT_SEED = 0
+
+
+def check_hp_crawler(seed=DEFAULT_SEED) -> list:
+    """
+    Crawls a synthetic website with HpCrawler(backend='http').
+    :return: the failed checks (an empty list if all of them passed).
+    """
+    site = synthetic.make_hp_site(np.random.default_rng(seed), BOX, TRAILS)
+    server = synthetic.SyntheticHpServer(site, EMAIL, PASSWORD, PAGE_SIZE)
+    # (read when HpBackends is imported, so it's imported after they are set)
+    os.environ.update(server.start())
+    os.environ.update({'HP_EMAIL': EMAIL, 'HP_PASSWORD': PASSWORD})
+    import slopeMap as sm
+    from CrawlJournal import CrawlJournal
+    from HpTrackStore import HpTrackStore
+    from hpcrawler import HpCrawler, process_track_file
+
+    failures = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            gpx_dir, tracks_dir = os.path.join(work_dir, 'gpx'), os.path.join(work_dir, 'tracks')
+            seen_path = os.path.join(work_dir, 'seen.json')
+            HpCrawler(list(site), gpx_dir, tracks_dir, seen_path, backend='http', workers=2, processes=2,
+                      rate=None).crawl()
+
+            if server.logins != len(site):
+                failures.append('logged in %d times, instead of once per country' % server.logins)
+            seen = CrawlJournal(seen_path).state
+            track_store = HpTrackStore(tracks_dir)
+            stored_tracks = {}
+            for len_tag in {os.path.splitext(file_name)[0] for file_name in os.listdir(tracks_dir)}:
+                stored_tracks.update(track_store.load(len_tag))
+
+            for country, trails in site.items():
+                if seen.get(country) != HpCrawler.done_tag:
+                    failures.append(country + ' is not marked as done: ' + repr(seen.get(country)))
+                progress = CrawlJournal(os.path.join(gpx_dir, country, 'progress.json')).state
+                if len(progress) != len(trails):
+                    failures.append('%s: %d progress entries, for %d trails' % (country, len(progress), len(trails)))
+                for j, trail in enumerate(trails):
+                    expected = [trail['slug'] + '.gpx', trail['difficulty'], trail['length'], trail['shape'],
+                                HpCrawler.check_list(trail['features'])]
+                    if progress.get(str(j)) != expected:
+                        failures.append('%s %d: progress %r, expected %r' % (country, j, progress.get(str(j)), expected))
+                    gpx_path = os.path.join(gpx_dir, country, str(j) + '.gpx')
+                    if not os.path.exists(gpx_path):
+                        failures.append('%s %d: the gpx file was not downloaded' % (country, j))
+                        continue
+                    with open(gpx_path, 'r', encoding='utf8') as f:
+                        if f.read() != trail['gpx']:
+                            failures.append('%s %d: the gpx file differs from the website\'s' % (country, j))
+                    track_name = country + '_' + str(j)
+                    track_data = process_track_file(gpx_path, track_name, trail['difficulty'])
+                    if track_data is None:  # too short: its data is collected, but it's not kept as a track.
+                        if track_name in stored_tracks:
+                            failures.append(track_name + ' is shorter than %s km, but was stored' % sm.TICK)
+                    elif stored_tracks.get(track_name) != track_data[1][track_name]:
+                        failures.append(track_name + ' was not stored as processed')
+            expected_tracks = sum(len(trails) - 1 for trails in site.values())  # (the last trails are too short)
+            if len(stored_tracks) != expected_tracks:
+                failures.append('%d tracks were stored, instead of %d' % (len(stored_tracks), expected_tracks))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return failures
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Crawls a synthetic HikingProject website with the http backend, '
+                                                     'and checks the crawled data.')
+    arg_parser.add_argument("--seed", help="the seed of the synthetic website.", type=int, default=DEFAULT_SEED)
+    command_line_args = arg_parser.parse_args()
+    check_failures = check_hp_crawler(command_line_args.seed)
+    for failure in check_failures:
+        print('FAILED: ' + failure)
+    if not check_failures:
+        print('all of the checks passed: %d countries, %d trails' % (len(TRAILS), sum(TRAILS.values())))
+    sys.exit(1 if check_failures else 0)
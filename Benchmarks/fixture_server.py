@@ -0,0 +1,155 @@
+"""
+A local stand-in for the OpenStreetMap API, the Overpass API and The Hiking Project's website, serving recorded
+responses (fixtures), so the whole pipeline can be run (and benchmarked) repeatably without the network.
+
+The server routes requests by their path prefix (see ROUTES): /osm/... stands for the OSM API, /overpass/... for the
+Overpass API and /hp/... for The Hiking Project (see HpBackends.HttpBackend). Every fixture is saved in the fixtures
+directory under a hash of the request (method, path and body): <key>.bin holds the response's content, and the optional
+<key>.json its headers ({"headers": {"Set-Cookie": ..., "Content-Disposition": ...}}).
+In record mode, requests that have no fixture yet are forwarded to the real server (with their cookies), and the
+responses are saved.
+In replay mode (the default), requests that have no fixture get a 404 response.
+
+Usage (from the repository root):
+    python -m Benchmarks.fixture_server FIXTURES_DIR [--port PORT] [--record]
+and point the pipeline at it through the environment (see OsmDataCollector), for example:
+    OSM_API_URL=http://localhost:8765/osm/api/0.6/ OVERPASS_URL=http://localhost:8765/overpass/api/interpreter
+    HP_URL=http://localhost:8765/hp/
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+ROUTES = {'/osm/': 'https://api.openstreetmap.org/', '/overpass/': 'https://overpass-api.de/',
+          '/hp/': 'https://www.hikingproject.com/'}
+FORWARDED_HEADERS = ['Cookie', 'Content-Type']  # The request headers forwarded to the real servers in record mode.
+RECORDED_HEADERS = ['Set-Cookie', 'Content-Disposition', 'Content-Type']  # The response headers that are replayed.
+REQUEST_TIMEOUT = 180
+
+
+def get_fixture_key(method: str, path: str, body: bytes) -> str:
+    """
+    :return: the key the response to the given request is saved under.
+    """
+    return hashlib.sha256(method.encode('utf8') + b' ' + path.encode('utf8') + b'\n' + body).hexdigest()
+
+
+def get_environment(port: int) -> dict:
+    """
+    :return: the environment variables that point the pipeline at a fixture server listening on the given port.
+    """
+    base_url = 'http://localhost:' + str(port)
+    return {'OSM_API_URL': base_url + '/osm/api/0.6/', 'OVERPASS_URL': base_url + '/overpass/api/interpreter',
+            'HP_URL': base_url + '/hp/'}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Answers requests from the fixtures directory of its server (and records the missing ones in record mode).
+    """
+
+    def do_GET(self):
+        self._answer(b'')
+
+    def do_POST(self):
+        self._answer(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+    def _answer(self, body: bytes):
+        key = get_fixture_key(self.command, self.path, body)
+        content_path = os.path.join(self.server.fixtures_dir, key + '.bin')
+        if not os.path.exists(content_path):
+            if not self.server.record:
+                self.send_error(404, 'no fixture for ' + self.command + ' ' + self.path)
+                return
+            try:
+                self._record(key, body)
+            except Exception as e:
+                self.send_error(502, repr(e))
+                return
+
+        with open(content_path, 'rb') as f:
+            content = f.read()
+        headers = {}
+        meta_path = os.path.join(self.server.fixtures_dir, key + '.json')
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                headers = json.load(f).get('headers', {})
+        self.server.served += 1
+        self.send_response(200)
+        for header, values in headers.items():
+            for value in values:
+                self.send_header(header, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _record(self, key: str, body: bytes):
+        """
+        Forwards the request to the real server, and saves its response as a fixture.
+        """
+        for prefix, upstream in ROUTES.items():
+            if self.path.startswith(prefix):
+                url = upstream + self.path[len(prefix):]
+                break
+        else:
+            raise ValueError('unknown route: ' + self.path)
+        request = urllib.request.Request(url, data=body if self.command == 'POST' else None,
+                                         headers={header: self.headers[header] for header in FORWARDED_HEADERS
+                                                  if self.headers[header] is not None})
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            content = response.read()
+            headers = {header: response.headers.get_all(header) for header in RECORDED_HEADERS
+                       if response.headers.get_all(header)}
+        with open(os.path.join(self.server.fixtures_dir, key + '.bin'), 'wb') as f:
+            f.write(content)
+        with open(os.path.join(self.server.fixtures_dir, key + '.json'), 'w') as f:
+            json.dump({'method': self.command, 'path': self.path, 'url': url, 'headers': headers}, f)
+
+    def log_message(self, format, *args):
+        pass  # The pipeline makes many requests, they are not printed one by one.
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    An http server answering requests from a fixtures directory.
+    """
+
+    def __init__(self, fixtures_dir: str, port=DEFAULT_PORT, record=False):
+        """
+        :param fixtures_dir: the directory the fixtures are saved in.
+        :param port: the port to listen on (0 picks a free port).
+        :param record: if True, requests that have no fixture are forwarded to the real servers and recorded.
+        """
+        os.makedirs(fixtures_dir, exist_ok=True)
+        super().__init__(('localhost', port), FixtureHandler)
+        self.fixtures_dir = fixtures_dir
+        self.record = record
+        self.served = 0
+
+    def start(self) -> dict:
+        """
+        Starts serving in a background thread.
+        :return: the environment variables that point the pipeline at this server (see get_environment).
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return get_environment(self.server_address[1])
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Serves recorded OSM, Overpass and HikingProject responses.')
+    arg_parser.add_argument("fixtures_dir", help="the directory the fixtures are saved in.")
+    arg_parser.add_argument("--port", help="the port to listen on.", type=int, default=DEFAULT_PORT)
+    arg_parser.add_argument("--record", help="record the requests that have no fixture from the real servers.",
+                            action='store_true')
+    command_line_args = arg_parser.parse_args()
+    server = FixtureServer(command_line_args.fixtures_dir, command_line_args.port, command_line_args.record)
+    for variable, value in get_environment(server.server_address[1]).items():
+        print(variable + '=' + value)
+    server.serve_forever()
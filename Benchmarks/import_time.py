@@ -0,0 +1,80 @@
+"""
+Measures how long it takes to import the modules of the pipeline, each in a fresh interpreter, and checks the results
+against a time budget. It also checks that importing a module doesn't load any of the heavy optional dependencies, which
+should only be imported at their point of use.
+
+Usage (from the repository root): python -m Benchmarks.import_time
+The exit code is 1 if any module is over its budget, or loads a heavy dependency.
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MODULES_PATHS = [REPO_ROOT, os.path.join(REPO_ROOT, 'UserRelated')]
+RUNS = 5  # The number of fresh interpreters each module is imported in.
+HEAVY_MODULES = ['matplotlib', 'folium', 'sklearn', 'selenium', 'overpy', 'wget']
+
+# The import time budget of each module (milliseconds, median over RUNS interpreters):
+IMPORT_BUDGETS = {
+    'slopeMap': 400,
+    'OsmTrack': 800,
+    'EvaluateDifficulty': 800,
+    'OsmDataCollector': 900,
+    'OsmDbGenerator': 900,
+    'hpcrawler': 900,
+    'Main': 900,
+}
+
+CHILD_SCRIPT = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'heavy': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str) -> dict:
+    """
+    Imports the given module in RUNS fresh interpreters.
+    :param module: the name of the module to import.
+    :return: a dictionary of the form {'ms': median import time, 'heavy': [heavy modules loaded by the import]}
+    """
+    script = CHILD_SCRIPT.format(paths=MODULES_PATHS, module=module, heavy=HEAVY_MODULES)
+    times = []
+    heavy = set()
+    for _ in range(RUNS):
+        output = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, capture_output=True, text=True,
+                                check=True).stdout
+        run_result = json.loads(output.strip().splitlines()[-1])
+        times.append(run_result['ms'])
+        heavy.update(run_result['heavy'])
+    return {'ms': statistics.median(times), 'heavy': sorted(heavy)}
+
+
+def check_import_budgets(budgets=None) -> dict:
+    """
+    Measures the import time of every module in the budgets.
+    :param budgets: {module name: budget in milliseconds} (IMPORT_BUDGETS by default).
+    :return: {module name: {'ms': ..., 'budget': ..., 'heavy': [...], 'ok': bool}}
+    """
+    budgets = IMPORT_BUDGETS if budgets is None else budgets
+    results = {}
+    for module, budget in budgets.items():
+        measured = measure_import(module)
+        results[module] = {'ms': measured['ms'], 'budget': budget, 'heavy': measured['heavy'],
+                           'ok': measured['ms'] <= budget and not measured['heavy']}
+    return results
+
+
+if __name__ == '__main__':
+    import_results = check_import_budgets()
+    for name, res in import_results.items():
+        print(name.ljust(20), '%8.1f ms / %d ms' % (res['ms'], res['budget']),
+              'OK' if res['ok'] else 'FAILED', ('heavy imports: ' + str(res['heavy'])) if res['heavy'] else '')
+    sys.exit(0 if all(res['ok'] for res in import_results.values()) else 1)
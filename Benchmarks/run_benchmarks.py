@@ -0,0 +1,388 @@
+"""
+Times the hot paths of the pipeline on synthetic inputs (see Benchmarks/synthetic), and an end-to-end build of a
+synthetic area, without the network:
+    osm_track_init: creating an OsmTrack out of a gps segment.
+    osm_track_is_close: matching interest points to a track (OsmTrack.is_close).
+    get_k_best: finding the most similar HikingProject tracks (DifficultyEvaluator.get_k_best).
+    compute_slope: computing the slopes of a track (slopeMap.compute_slope).
+    proximity_raster: tagging tracks with the interest points near them by proximity rasters (see ProximityRaster),
+                      including computing the rasters. Also records the time of the exact matching, and how well the
+                      rasters agree with it (the precision and recall of the tags they give).
+    proximity_raster_country: the same, for tracks spread over a country-scale area. Also records the peak memory of
+                              the tagging, the number of tiles whose rasters were computed, and the memory a single
+                              grid per tag over the whole area would take.
+    main_query: answering requests in UserRelated/Main (loading the area, indexing its tracks and querying them).
+    main_query_tiled: answering the same kind of requests in a country-scale area with the tiled backend (see
+                      TiledAreaDb), which loads only the tiles the requests' limits intersect.
+    area_build: building a whole area with OsmDbGenerator, from a synthetic OSM server, elevation tile and
+                HikingProject corpus (including the downloader's rate limit).
+Every benchmark is run several times, and its median time is saved in a json results file:
+{"scale": ..., "seed": ..., "python": ..., "results": {<benchmark>: {"seconds": median, "runs": [...]}}}
+The results can be compared with a baseline results file (of the same scale, saved earlier with --update-baseline):
+a benchmark fails if it's slower than its baseline by more than the tolerance.
+
+Usage (from the repository root):
+    python -m Benchmarks.run_benchmarks [--scale small|medium|large] [--only NAME ...] [--output PATH]
+                                        [--baseline PATH [--update-baseline]] [--tolerance 0.25]
+The exit code is 1 if any benchmark is slower than its baseline.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from Benchmarks import synthetic
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [path for path in [REPO_ROOT, os.path.join(REPO_ROOT, 'UserRelated')] if path not in sys.path]
+
+BOX = [8.3, 48.5, 8.4, 48.6]  # [West, South, East, North], inside the tile of CORNER.
+COUNTRY_BOX = [6, 47.3, 15, 55]  # A country-scale area, for the tiled backend.
+CORNER = [48, 8]
+AREA_NAME = 'synthetic'
+TILE_NAME = 'SYNTHETIC'
+DEFAULT_SEED = 0
+DEFAULT_TOLERANCE = 0.25  # A benchmark may be up to 25% slower than its baseline.
+K_NEIGHBORS = 25
+
+# The sizes of the synthetic inputs:
+SCALES = {
+    'small': {'track_points': 500, 'interest_points': 200, 'hp_tracks': 200, 'area_tracks': 2000, 'queries': 50,
+              'pages': 2, 'traces_per_page': 5, 'repeat': 3},
+    'medium': {'track_points': 2000, 'interest_points': 1000, 'hp_tracks': 1000, 'area_tracks': 20000,
+               'queries': 200, 'pages': 4, 'traces_per_page': 10, 'repeat': 3},
+    'large': {'track_points': 10000, 'interest_points': 5000, 'hp_tracks': 5000, 'area_tracks': 100000,
+              'queries': 1000, 'pages': 10, 'traces_per_page': 20, 'repeat': 3},
+}
+
+
+def time_runs(run, repeat: int, setup=None) -> dict:
+    """
+    :param run: the function to time.
+    :param repeat: the number of times to run it.
+    :param setup: a function called before every run (not timed).
+    :return: {'seconds': the median time of a run, 'runs': [the times of all of the runs]}
+    """
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):  # the pipeline's progress prints.
+            start = time.perf_counter()
+            run()
+            runs.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(runs), 'runs': runs}
+
+
+def bench_osm_track_init(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    from OsmTrack import OsmTrack
+    segment = synthetic.make_segment(synthetic.random_walk(rng, scale['track_points'], BOX))
+    return time_runs(lambda: OsmTrack(segment, 'synthetic'), scale['repeat'])
+
+
+def bench_osm_track_is_close(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    from OsmTrack import OsmTrack
+    from OsmDataCollector import InterestPoint
+    track = OsmTrack(synthetic.make_segment(synthetic.random_walk(rng, scale['track_points'], BOX)), 'synthetic')
+    boundaries = track.boundaries
+    points = [InterestPoint(node['lat'], node['lon']) for node in synthetic.make_interest_points(
+        rng, [boundaries['west'], boundaries['south'], boundaries['east'], boundaries['north']],
+        scale['interest_points'])]
+    return time_runs(lambda: [track.is_close(point) for point in points], scale['repeat'])
+
+
+def match_by_rasters(tracks: list, collector, rasters_dir: str) -> list:
+    """
+    Tags the tracks by the proximity rasters of the collector's interest points (computing the rasters of the tiles the
+    tracks are in, into rasters_dir), or by the exact matching if rasters_dir is None.
+    :return: the tags of every track.
+    """
+    from ProximityRaster import AreaRasters
+    if rasters_dir is not None and os.path.exists(rasters_dir):
+        shutil.rmtree(rasters_dir)  # every run computes the rasters.
+    collector.proximity_rasters = None if rasters_dir is None else \
+        AreaRasters(rasters_dir, collector.interest_points_dict)
+    for track in tracks:
+        track.interest_points = set()
+        collector._match_interest_points(track)
+    return [set(track.interest_points) for track in tracks]
+
+
+def compare_matching(tracks: list, collector, rasters_dir: str, repeat: int) -> dict:
+    """
+    :return: the times of the matching by the rasters (see match_by_rasters), the time of the exact matching, and the
+    precision and recall of the tags the rasters give (compared with the exact matching's).
+    """
+    exact = time_runs(lambda: match_by_rasters(tracks, collector, None), repeat)
+    result = time_runs(lambda: match_by_rasters(tracks, collector, rasters_dir), repeat)
+    exact_tags = match_by_rasters(tracks, collector, None)
+    raster_tags = match_by_rasters(tracks, collector, rasters_dir)
+    both = sum(len(exact & raster) for exact, raster in zip(exact_tags, raster_tags))
+    result['exact_seconds'] = exact['seconds']
+    result['precision'] = both / max(sum(len(tags) for tags in raster_tags), 1)
+    result['recall'] = both / max(sum(len(tags) for tags in exact_tags), 1)
+    return result
+
+
+def bench_proximity_raster(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    from OsmTrack import OsmTrack
+    from OsmDataCollector import OsmDataCollector
+
+    tracks = [OsmTrack(synthetic.make_segment(synthetic.random_walk(rng, scale['track_points'], BOX)), i)
+              for i in range(scale['traces_per_page'] * scale['pages'])]
+    collector = OsmDataCollector(BOX, stream=True)  # (nothing is collected, only its matching is used)
+    collector.interest_points_dict = OsmDataCollector.split_interest_points(
+        synthetic.make_interest_points(rng, BOX, scale['interest_points']))
+    return compare_matching(tracks, collector, os.path.join(work_dir, 'proximity'), scale['repeat'])
+
+
+def bench_proximity_raster_country(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    import tracemalloc
+    from OsmTrack import OsmTrack
+    from OsmDataCollector import OsmDataCollector
+    from ProximityRaster import ProximityRaster
+
+    # A hundredth of the interest points per square degree of proximity_raster:
+    interest_points = int(scale['interest_points'] * (COUNTRY_BOX[2] - COUNTRY_BOX[0]) *
+                          (COUNTRY_BOX[3] - COUNTRY_BOX[1]) / ((BOX[2] - BOX[0]) * (BOX[3] - BOX[1])) / 100)
+    tracks = []
+    for i in range(scale['traces_per_page'] * scale['pages']):  # every track inside a box as large as BOX.
+        west = rng.uniform(COUNTRY_BOX[0], COUNTRY_BOX[2] - (BOX[2] - BOX[0]))
+        south = rng.uniform(COUNTRY_BOX[1], COUNTRY_BOX[3] - (BOX[3] - BOX[1]))
+        tracks.append(OsmTrack(synthetic.make_segment(synthetic.random_walk(
+            rng, scale['track_points'], [west, south, west + BOX[2] - BOX[0], south + BOX[3] - BOX[1]])), i))
+    collector = OsmDataCollector(COUNTRY_BOX, stream=True)  # (nothing is collected, only its matching is used)
+    collector.interest_points_dict = OsmDataCollector.split_interest_points(
+        synthetic.make_interest_points(rng, COUNTRY_BOX, interest_points))
+    rasters_dir = os.path.join(work_dir, 'proximity')
+    result = compare_matching(tracks, collector, rasters_dir, scale['repeat'])
+
+    tracemalloc.start()
+    match_by_rasters(tracks, collector, rasters_dir)
+    result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    result['tiles'] = len(os.listdir(rasters_dir))
+    # The memory a single grid per tag over the whole area would take:
+    shape = ProximityRaster.get_grid(COUNTRY_BOX)[4]
+    result['whole_area_grids_mb'] = shape[0] * shape[1] * len(collector.interest_points_dict) / 2 ** 20
+    return result
+
+
+def bench_get_k_best(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    from EvaluateDifficulty import DifficultyEvaluator
+    # shingles of 2 slopes, as the area builds use (see OsmDbGenerator.SHING_ELEM_NUM):
+    shingles = [set(rng.integers(0, 20, 60) * 100 + rng.integers(0, 20, 60)) for _ in range(scale['hp_tracks'] + 1)]
+    return time_runs(lambda: DifficultyEvaluator.get_k_best(shingles[0], shingles[1:], K_NEIGHBORS), scale['repeat'])
+
+
+def bench_compute_slope(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    import slopeMap as sm
+    points = synthetic.random_walk(rng, scale['track_points'], BOX)
+    elevations = synthetic.terrain_elevation(points[:, 0], points[:, 1])
+    length = float(sm.compute_step_kms(points).sum())
+    return time_runs(lambda: sm.compute_slope(points, elevations, length), scale['repeat'])
+
+
+def make_query_requests(scale: dict, rng: np.random.Generator, box: list) -> list:
+    """
+    :return: the requests of the main_query benchmarks: random preferences, in random 0.05 x 0.05 degrees limits.
+    """
+    requests = []
+    for i in range(scale['queries']):
+        south, west = rng.uniform(box[1], box[3] - 0.05), rng.uniform(box[0], box[2] - 0.05)
+        request = {'id': i, 'search_area': AREA_NAME, 'north_lim': south + 0.05, 'south_lim': south,
+                   'east_lim': west + 0.05, 'west_lim': west, 'length': int(rng.integers(1, 4)),
+                   'difficulty': int(rng.integers(1, 5)), 'shape': int(rng.integers(1, 3))}
+        for field in ['waterfall', 'birding', 'river', 'cave', 'lake', 'spring', 'geo', 'historic']:
+            request[field] = int(rng.random() < 0.2)
+        requests.append(request)
+    return requests
+
+
+def bench_main_query(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    import Main
+    db_path = os.path.join(work_dir, AREA_NAME + '_db.json')
+    synthetic.write_area_db(db_path, rng, BOX, scale['area_tracks'])
+    Main.areas_paths[AREA_NAME] = db_path
+    requests = make_query_requests(scale, rng, BOX)
+    # The area is loaded (and indexed) again on every run, as a new process answering requests would:
+    return time_runs(lambda: [Main.answer_request(request) for request in requests], scale['repeat'],
+                     setup=Main._area_indexes.clear)
+
+
+def bench_main_query_tiled(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    import Main
+    from TiledAreaDb import TILES_DIR_NAME
+    db_path = os.path.join(work_dir, AREA_NAME + '_db.json')
+    # A ten thousandth of the tracks per square degree of main_query:
+    tracks = int(scale['area_tracks'] * (COUNTRY_BOX[2] - COUNTRY_BOX[0]) * (COUNTRY_BOX[3] - COUNTRY_BOX[1]) /
+                 ((BOX[2] - BOX[0]) * (BOX[3] - BOX[1])) / 10000)
+    synthetic.write_area_db(db_path, rng, COUNTRY_BOX, tracks)
+    synthetic.write_tiled_area_db(os.path.join(work_dir, TILES_DIR_NAME), db_path)
+    Main.areas_paths[AREA_NAME] = db_path
+    requests = make_query_requests(scale, rng, COUNTRY_BOX)
+
+    def clear():
+        Main._area_indexes.clear()
+        Main._tiled_dbs.clear()
+    return time_runs(lambda: [Main.answer_request(request, backend='tiled') for request in requests], scale['repeat'],
+                     setup=clear)
+
+
+def bench_area_build(scale: dict, rng: np.random.Generator, work_dir: str) -> dict:
+    import OsmDataCollector
+    import OsmDbGenerator
+    from DownloadCache import CACHE_DIR_PATH
+    from EvaluateDifficulty import DifficultyEvaluator
+
+    pages = [synthetic.make_traces_page(rng, BOX, scale['traces_per_page'], scale['track_points'])
+             for _ in range(scale['pages'])]
+    server = SyntheticOsmServerContext(pages, synthetic.make_interest_points(rng, BOX, scale['interest_points']))
+    # The build's paths are relative (to the working directory):
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        tile_path = OsmDbGenerator.TILES_PATH + TILE_NAME + '.hgt'
+        if os.path.dirname(tile_path):
+            os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        synthetic.write_hgt(tile_path, CORNER)
+        synthetic.write_hp_corpus(DifficultyEvaluator.pts_dir_path, rng, BOX, scale['hp_tracks'])
+        generator = OsmDbGenerator.OsmDbGenerator('json', {AREA_NAME: {'box': BOX, 'corner': CORNER,
+                                                                       'tile': TILE_NAME}})
+
+        def clear():
+            # every run builds the area from scratch: nothing downloaded, and no shingles computed yet.
+            for path in [CACHE_DIR_PATH, OsmDbGenerator.TRACES_DIR_PATH + AREA_NAME,
+                         DifficultyEvaluator.shingles_dir_path]:
+                if os.path.exists(path):
+                    shutil.rmtree(path)
+
+        def build():
+            report = generator.create_osm_db(rebuild=True)
+            if report[AREA_NAME]['status'] != 'ok':
+                raise RuntimeError('the synthetic area failed to build: ' + report[AREA_NAME]['error'])
+
+        with server:
+            # (read when the urls are created, so they can be pointed at the server after the import)
+            OsmDataCollector.OSM_API_URL = server.environment['OSM_API_URL']
+            OsmDataCollector.OVERPASS_URL = server.environment['OVERPASS_URL']
+            return time_runs(build, scale['repeat'], setup=clear)
+    finally:
+        os.chdir(previous_dir)
+
+
+class SyntheticOsmServerContext:
+    """
+    Runs a SyntheticOsmServer for the duration of a with block.
+    """
+
+    def __init__(self, pages: list, nodes: list):
+        self.server = synthetic.SyntheticOsmServer(pages, nodes)
+        self.environment = {}
+
+    def __enter__(self):
+        self.environment = self.server.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+BENCHMARKS = {
+    'osm_track_init': bench_osm_track_init,
+    'osm_track_is_close': bench_osm_track_is_close,
+    'proximity_raster': bench_proximity_raster,
+    'proximity_raster_country': bench_proximity_raster_country,
+    'get_k_best': bench_get_k_best,
+    'compute_slope': bench_compute_slope,
+    'main_query': bench_main_query,
+    'main_query_tiled': bench_main_query_tiled,
+    'area_build': bench_area_build,
+}
+
+
+def run_benchmarks(scale_name='small', names=None, seed=DEFAULT_SEED, repeat=None) -> dict:
+    """
+    Runs the benchmarks, each on its own synthetic inputs (generated from the seed, so they are the same in every run).
+    :param scale_name: one of SCALES.
+    :param names: the benchmarks to run (all of BENCHMARKS by default).
+    :param repeat: the number of runs of every benchmark (the scale's by default).
+    :return: the results (see the module's documentation).
+    """
+    scale = dict(SCALES[scale_name])
+    if repeat is not None:
+        scale['repeat'] = repeat
+    results = {}
+    for name in (names if names else BENCHMARKS):
+        work_dir = tempfile.mkdtemp(prefix='bench_' + name + '_')
+        try:
+            results[name] = BENCHMARKS[name](scale, np.random.default_rng(seed), work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        print(name.ljust(20), '%10.4f s' % results[name]['seconds'])
+    return {'scale': scale_name, 'seed': seed, 'python': platform.python_version(), 'results': results}
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance=DEFAULT_TOLERANCE) -> dict:
+    """
+    :return: {benchmark: {'seconds': ..., 'baseline': ..., 'ratio': seconds / baseline, 'ok': bool}} for every
+    benchmark that has a baseline.
+    """
+    if baseline['scale'] != results['scale']:
+        raise ValueError('the baseline is of scale ' + baseline['scale'] + ', not ' + results['scale'])
+    comparison = {}
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        baseline_seconds = baseline['results'][name]['seconds']
+        ratio = result['seconds'] / baseline_seconds if baseline_seconds > 0 else 1.0
+        comparison[name] = {'seconds': result['seconds'], 'baseline': baseline_seconds, 'ratio': ratio,
+                            'ok': ratio <= 1 + tolerance}
+    return comparison
+
+
+def save_json(dictionary: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(dictionary, f, indent=4)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Times the hot paths of the pipeline on synthetic data.')
+    arg_parser.add_argument("--scale", help="the size of the synthetic inputs.", choices=SCALES, default='small')
+    arg_parser.add_argument("--only", help="run only these benchmarks.", nargs='+', choices=BENCHMARKS)
+    arg_parser.add_argument("--repeat", help="the number of runs of every benchmark.", type=int)
+    arg_parser.add_argument("--seed", help="the seed of the synthetic inputs.", type=int, default=DEFAULT_SEED)
+    arg_parser.add_argument("--output", help="the path of the results file.", default='benchmark_results.json')
+    arg_parser.add_argument("--baseline", help="compare the results with this baseline results file.")
+    arg_parser.add_argument("--update-baseline", help="save the results as the baseline instead of comparing them.",
+                            action='store_true')
+    arg_parser.add_argument("--tolerance", help="how much slower than the baseline a benchmark may be (0.25 is 25%%).",
+                            type=float, default=DEFAULT_TOLERANCE)
+    command_line_args = arg_parser.parse_args()
+
+    benchmark_results = run_benchmarks(command_line_args.scale, command_line_args.only, command_line_args.seed,
+                                       command_line_args.repeat)
+    save_json(benchmark_results, command_line_args.output)
+    if command_line_args.baseline is None:
+        sys.exit(0)
+    if command_line_args.update_baseline or not os.path.exists(command_line_args.baseline):
+        save_json(benchmark_results, command_line_args.baseline)
+        print('baseline saved to', command_line_args.baseline)
+        sys.exit(0)
+
+    with open(command_line_args.baseline, 'r') as baseline_file:
+        baseline_comparison = compare_with_baseline(benchmark_results, json.load(baseline_file),
+                                                    command_line_args.tolerance)
+    for bench_name, comp in baseline_comparison.items():
+        print(bench_name.ljust(20), '%10.4f s / %10.4f s (x%.2f)' % (comp['seconds'], comp['baseline'], comp['ratio']),
+              'OK' if comp['ok'] else 'SLOWER')
+    sys.exit(0 if all(comp['ok'] for comp in baseline_comparison.values()) else 1)
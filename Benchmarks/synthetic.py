@@ -0,0 +1,377 @@
+"""
+Generates synthetic inputs for the benchmarks, at any scale and without the network:
+ (1) gps traces: random walks inside a bounding box, as gpx track segments or as OSM gps-traces pages.
+ (2) elevation tiles: .hgt files of a smooth synthetic terrain (see terrain_elevation).
+ (3) a HikingProject corpus: tracks with elevations and difficulty labels, saved with HpTrackStore.
+ (4) an area data base: the json the pipeline builds for a search area (see OsmDbGenerator), for the query path.
+ (5) a stand-in OSM and Overpass server (SyntheticOsmServer), answering the pipeline's requests with synthetic traces
+     pages and interest points, so a whole area can be built on the local machine.
+ (6) a stand-in HikingProject website (SyntheticHpServer): a homepage, the paginated trail lists of countries, trail
+     pages, a login form and gpx downloads, so HpCrawler's http backend can crawl it (see Benchmarks/check_hp_crawler).
+All of the generators take a numpy random generator, so the same seed always gives the same inputs.
+"""
+
+import datetime
+import html
+import json
+import math
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+STEP_METERS = 10  # The distance between consecutive gps points of a synthetic trace.
+SPEED_KMH = 4  # The walking speed of the synthetic traces.
+METERS_PER_DEGREE = 111320
+HGT_DIM = 1201  # The number of rows (and columns) of a synthetic elevation tile (a 3 arc-second tile).
+DIFFICULTIES = ['Easy', 'Intermediate', 'Difficult', 'Very Difficult']  # The values of TrackDifficulty.
+ATTRIBUTES = ['River/Creek', 'Waterfall', 'Birding', 'Cave', 'Lake', 'Spring', 'Geological Significance',
+              'Historical Significance']  # The values of PointTag.
+HP_SHAPES = ['Loop', 'Out and Back', 'Point to Point']  # The shapes the trail pages of HikingProject show.
+HP_FEATURES = ['River/Creek', 'Waterfall', 'Birding', 'Cave', 'Lake', 'Views', 'Wildflowers', 'Geological Significance',
+               'Historical Significance']  # The features the trail pages of HikingProject show.
+HP_SITE_URL = 'https://www.hikingproject.com/'  # The links of the synthetic pages are absolute, like the website's.
+# The osm tags of the synthetic interest points (see OsmDataCollector.INTEREST_POINTS_PREDICATES):
+INTEREST_POINTS_TAGS = [{'historic': 'ruins'}, {'waterway': 'waterfall'}, {'natural': 'water'},
+                        {'leisure': 'bird_hide'}, {'natural': 'cave_entrance'}, {'geological': 'outcrop'},
+                        {'waterway': 'river'}, {'natural': 'spring'}]
+START_TIME = datetime.datetime(2020, 6, 1, 8, 0, 0)
+LOGIN_PATH = 'auth/login/email'  # The address of the login form (see HpBackends.LOGIN_PATH).
+
+
+def terrain_elevation(lat, lon):
+    """
+    :return: the elevation (meters) of the synthetic terrain at the given coordinates (floats or np arrays): a few
+    hills and valleys, with slopes like the ones of a real mountain area.
+    """
+    return 600 + 250 * np.sin(lat * 40) * np.cos(lon * 30) + 120 * np.sin(lat * 170 + lon * 90)
+
+
+def _fold(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """
+    :return: the values, reflected back into [low, high] every time they cross one of its edges.
+    """
+    size = high - low
+    offsets = np.mod(values - low, 2 * size)
+    return low + size - np.abs(offsets - size)
+
+
+def random_walk(rng: np.random.Generator, n_points: int, box: list) -> np.ndarray:
+    """
+    A walk of STEP_METERS steps with a slowly turning heading, that stays inside the given box (it turns back at the
+    box's edges).
+    :param n_points: the number of points of the walk.
+    :param box: [West, South, East, North]
+    :return: a np array of shape (n_points, 2): (lat, lon).
+    """
+    west, south, east, north = box
+    start_lat, start_lon = rng.uniform(south, north), rng.uniform(west, east)
+    headings = rng.uniform(0, 2 * math.pi) + np.cumsum(rng.normal(0, 0.15, n_points - 1))
+    d_lat = STEP_METERS * np.cos(headings) / METERS_PER_DEGREE
+    d_lon = STEP_METERS * np.sin(headings) / (METERS_PER_DEGREE * math.cos(math.radians(start_lat)))
+    lat = _fold(start_lat + np.concatenate([[0], np.cumsum(d_lat)]), south, north)
+    lon = _fold(start_lon + np.concatenate([[0], np.cumsum(d_lon)]), west, east)
+    return np.column_stack([lat, lon])
+
+
+def make_segment(points: np.ndarray):
+    """
+    :param points: a np array of shape (n, 2): (lat, lon).
+    :return: a gpxpy segment of the points, timed as a walk at SPEED_KMH.
+    """
+    import gpxpy.gpx
+    seconds_per_step = STEP_METERS / (SPEED_KMH / 3.6)
+    segment = gpxpy.gpx.GPXTrackSegment()
+    for i, (lat, lon) in enumerate(points):
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(lat, lon, time=START_TIME + datetime.timedelta(
+            seconds=i * seconds_per_step)))
+    return segment
+
+
+def make_traces_page(rng: np.random.Generator, box: list, traces: int, points_per_trace: int) -> str:
+    """
+    :return: a gps-traces page, as OSM returns it (see OsmDataCollector), holding the given number of traces.
+    """
+    seconds_per_step = STEP_METERS / (SPEED_KMH / 3.6)
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.0" creator="synthetic" '
+             'xmlns="http://www.topografix.com/GPX/1/0">\n']
+    for _ in range(traces):
+        parts.append('<trk><trkseg>\n')
+        for i, (lat, lon) in enumerate(random_walk(rng, points_per_trace, box)):
+            time = START_TIME + datetime.timedelta(seconds=i * seconds_per_step)
+            parts.append('<trkpt lat="%.7f" lon="%.7f"><time>%s</time></trkpt>\n' %
+                         (lat, lon, time.strftime('%Y-%m-%dT%H:%M:%SZ')))
+        parts.append('</trkseg></trk>\n')
+    parts.append('</gpx>\n')
+    return ''.join(parts)
+
+
+def make_interest_points(rng: np.random.Generator, box: list, count: int) -> list:
+    """
+    :return: a list of osm nodes inside the box, as Overpass returns them: {'type': 'node', 'id', 'lat', 'lon', 'tags'}
+    """
+    west, south, east, north = box
+    return [{'type': 'node', 'id': i, 'lat': float(rng.uniform(south, north)), 'lon': float(rng.uniform(west, east)),
+             'tags': INTEREST_POINTS_TAGS[i % len(INTEREST_POINTS_TAGS)]} for i in range(count)]
+
+
+def write_hgt(path: str, corner: list, dim=HGT_DIM):
+    """
+    Writes an elevation tile of the synthetic terrain, in the format of the srtm files (see slopeMap.make_elev_map).
+    :param corner: the coordinates [lat, lon] of the tile's corner.
+    """
+    lat, lon = np.meshgrid(corner[0] + np.arange(dim) / dim, corner[1] + np.arange(dim) / dim, indexing='ij')
+    terrain_elevation(lat, lon).astype('>i2').tofile(path)
+
+
+def write_hp_corpus(tracks_dir: str, rng: np.random.Generator, box: list, tracks: int, max_km=30):
+    """
+    Saves a synthetic HikingProject corpus (see hpcrawler.process_track_file), with tracks of every length up to max_km.
+    """
+    import GeometryCodec as gc
+    import slopeMap as sm
+    from HpTrackStore import HpTrackStore
+    store = HpTrackStore(tracks_dir, compact_every=tracks + 1)
+    for i in range(tracks):
+        points = random_walk(rng, max(int(rng.uniform(1, max_km) * 1000 / STEP_METERS), 2), box)
+        elevations = terrain_elevation(points[:, 0], points[:, 1])
+        track_len = float(sm.compute_step_kms(points).sum())
+        points_code = gc.encode_text(points, [gc.COORDINATE_EXPONENT, gc.COORDINATE_EXPONENT])
+        elev_code = gc.encode_text(elevations, [gc.ELEVATION_EXPONENT])
+        store.append(sm.get_length_tag(track_len), {'Synthetic_' + str(i): [points_code, elev_code, track_len,
+                                                                            DIFFICULTIES[i % len(DIFFICULTIES)]]})
+    store.compact_all()
+
+
+def write_area_db(path: str, rng: np.random.Generator, box: list, tracks: int, track_degrees=0.02):
+    """
+    Writes a synthetic area data base (the json part of it, see OsmDbGenerator) with tracks spread over the box.
+    """
+    west, south, east, north = box
+    tracks_dict = {}
+    for i in range(tracks):
+        lat, lon = rng.uniform(south, north - track_degrees), rng.uniform(west, east - track_degrees)
+        attributes = list(rng.choice(ATTRIBUTES, size=rng.integers(0, 3), replace=False)) + \
+            [DIFFICULTIES[rng.integers(len(DIFFICULTIES))], ['loop', 'not loop'][rng.integers(2)],
+             ['short', 'medium', 'long'][rng.integers(3)]]
+        tracks_dict['track' + str(i)] = {'attributes': attributes, 'duplicates': 0,
+                                         'boundaries': {'north': lat + track_degrees, 'south': lat,
+                                                        'east': lon + track_degrees, 'west': lon}}
+    with open(path, 'w') as f:
+        json.dump({'tracks': tracks_dict}, f)
+
+
+def write_tiled_area_db(dir_path: str, db_path: str):
+    """
+    Writes the tracks of a synthetic area data base (see write_area_db) into a tiled data base (see TiledAreaDb), with
+    the diagonal of its boundaries as the gps points of every track.
+    """
+    import pandas as pd
+    from TiledAreaDb import TiledAreaDb
+    with open(db_path, 'r') as f:
+        tracks_dict = json.load(f)['tracks']
+    with TiledAreaDb(dir_path) as area_db:
+        for track_id, track_data in tracks_dict.items():
+            boundaries = track_data['boundaries']
+            area_db.add_track(track_id, track_data, pd.DataFrame(
+                {'lat': [boundaries['south'], boundaries['north']], 'lon': [boundaries['west'], boundaries['east']],
+                 'time': [START_TIME, START_TIME + datetime.timedelta(hours=1)]}))
+
+
+def make_hp_gpx(points: np.ndarray) -> str:
+    """
+    :param points: a np array of shape (n, 2): (lat, lon).
+    :return: a gpx file of a HikingProject trail, with the elevations of the synthetic terrain.
+    """
+    elevations = terrain_elevation(points[:, 0], points[:, 1])
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<gpx version="1.1" creator="synthetic" '
+             'xmlns="http://www.topografix.com/GPX/1/1">\n<trk><trkseg>\n']
+    parts += ['<trkpt lat="%.7f" lon="%.7f"><ele>%.1f</ele></trkpt>\n' % (lat, lon, elevation)
+              for (lat, lon), elevation in zip(points, elevations)]
+    parts.append('</trkseg></trk>\n</gpx>\n')
+    return ''.join(parts)
+
+
+def make_hp_site(rng: np.random.Generator, box: list, trails: dict, max_km=10) -> dict:
+    """
+    Generates the trails of a synthetic HikingProject website (see SyntheticHpServer). The last trail of every country
+    is shorter than slopeMap.TICK, so the crawler collects its data but doesn't keep it as a track.
+    :param trails: the number of trails of every country: {country name: number of trails}
+    :return: {country name: [{'id', 'slug', 'difficulty', 'length', 'shape', 'features', 'gpx'}, ...]}
+    """
+    site = {}
+    trail_id = 7000000
+    for country, trails_num in trails.items():
+        site[country] = []
+        for i in range(trails_num):
+            n_points = 5 if i == trails_num - 1 else int(rng.uniform(1, max_km) * 1000 / STEP_METERS)
+            features = [str(feature) for feature in rng.choice(HP_FEATURES, size=rng.integers(0, 4), replace=False)]
+            site[country].append({'id': trail_id, 'slug': country.lower() + '-trail-' + str(i),
+                                  'difficulty': DIFFICULTIES[rng.integers(len(DIFFICULTIES))],
+                                  'length': '%.1f' % rng.uniform(1, max_km), 'shape': HP_SHAPES[i % len(HP_SHAPES)],
+                                  'features': features, 'gpx': make_hp_gpx(random_walk(rng, n_points, box))})
+            trail_id += 1
+    return site
+
+
+class SyntheticOsmHandler(BaseHTTPRequestHandler):
+    """
+    Answers the gps-traces requests with the pages of its server (an empty page after the last one), and the Overpass
+    queries with all of its server's interest points (OsmDataCollector keeps the ones of every tag).
+    """
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+        page = int(query.get('page', ['0'])[0])
+        pages = self.server.pages
+        self._send(pages[page] if page < len(pages) else '<?xml version="1.0"?>\n<gpx version="1.0"></gpx>\n')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._send(json.dumps({'elements': self.server.nodes}))
+
+    def _send(self, content: str):
+        content = content.encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SyntheticOsmServer(ThreadingHTTPServer):
+    """
+    A local stand-in for the OSM and Overpass APIs, serving synthetic data.
+    """
+
+    def __init__(self, pages: list, nodes: list, port=0):
+        """
+        :param pages: the gps-traces pages (see make_traces_page).
+        :param nodes: the interest points (see make_interest_points).
+        :param port: the port to listen on (0 picks a free port).
+        """
+        super().__init__(('localhost', port), SyntheticOsmHandler)
+        self.pages = pages
+        self.nodes = nodes
+
+    def start(self) -> dict:
+        """
+        Starts serving in a background thread.
+        :return: the environment variables that point the pipeline at this server (see fixture_server).
+        """
+        from Benchmarks.fixture_server import get_environment
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return get_environment(self.server_address[1])
+
+
+class SyntheticHpHandler(BaseHTTPRequestHandler):
+    """
+    Answers the requests of HpBackends.HttpBackend like HikingProject's website, under the /hp/ prefix of the fixture
+    server's routes (see fixture_server.ROUTES). The gpx files are only downloaded by logged in sessions.
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        path = url.path[len('/hp'):] if url.path.startswith('/hp/') else None
+        query = urllib.parse.parse_qs(url.query)
+        parts = path.strip('/').split('/') if path is not None else []
+        if path == '/':
+            self._send_page(''.join('<a href="%sdirectory/%d/%s" title="%s">%s</a>\n' %
+                                    (HP_SITE_URL, i, html.escape(country.lower()), html.escape(country),
+                                     html.escape(country)) for i, country in enumerate(self.server.site)))
+        elif path == '/' + LOGIN_PATH:
+            self._send_page('<form method="post"><input type="hidden" name="_token" value="%s">'
+                            '<input type="email" name="email" placeholder="Log in with email">'
+                            '<input type="password" name="pass" placeholder="Password"></form>' % self.server.token)
+        elif len(parts) == 3 and parts[0] == 'directory' and parts[1].isdigit():
+            self._send_trail_rows(int(parts[1]), 0)
+        elif len(parts) == 3 and parts[:2] == ['ajax', 'directory'] and parts[2].isdigit():
+            self._send_trail_rows(int(parts[2]), int(query.get('start', ['0'])[0]))
+        elif len(parts) == 3 and parts[:2] == ['trail', 'gpx'] and int(parts[2]) in self.server.trails:
+            if self.headers.get('Cookie') != 'hp_session=' + self.server.session:
+                self._send(403, b'')
+                return
+            trail = self.server.trails[int(parts[2])]
+            self._send(200, trail['gpx'].encode('utf8'),
+                       {'Content-Disposition': 'attachment; filename="' + trail['slug'] + '.gpx"'})
+        elif len(parts) == 3 and parts[0] == 'trail' and parts[1].isdigit() and int(parts[1]) in self.server.trails:
+            trail = self.server.trails[int(parts[1])]
+            features = '<span class="font-body pl-half">\n%s\n</span>' % html.escape(' · '.join(trail['features'])) \
+                if trail['features'] else ''
+            self._send_page('<h1>%s</h1>\n<div class="stat-block mx-1 pb-2">\n<span>Length</span>\n<span>%s km</span>\n'
+                            '<span>%s</span>\n<span>%s</span>\n</div>\n%s\n<a href="%strail/gpx/%d">\n GPX File\n</a>'
+                            % (trail['slug'], trail['length'], trail['shape'], trail['difficulty'], features,
+                               HP_SITE_URL, trail['id']))
+        else:
+            self._send(404, b'')
+
+    def do_POST(self):
+        form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf8'))
+        if self.path != '/hp/' + LOGIN_PATH or form.get('_token') != [self.server.token] or \
+                form.get('email') != [self.server.email] or form.get('pass') != [self.server.password]:
+            self._send(401, b'')
+            return
+        self.server.logins += 1
+        self._send_page('<p>Welcome back</p>', {'Set-Cookie': 'hp_session=' + self.server.session + '; Path=/'})
+
+    def _send_trail_rows(self, country_index: int, start: int):
+        """
+        Sends a part of the trail list of a country: the rows of SyntheticHpServer.page_size trails from the given one,
+        and the "load more" button, which holds the address of the next part (none after the last part).
+        """
+        trails = list(self.server.site.values())[country_index]
+        rows = ''.join('<tr class="trail-row" data-href="%strail/%d/%s"><td>%s</td></tr>\n' %
+                       (HP_SITE_URL, trail['id'], trail['slug'], trail['slug'])
+                       for trail in trails[start:start + self.server.page_size])
+        end = start + self.server.page_size
+        data_url = ' data-url="/ajax/directory/%d?start=%d"' % (country_index, end) if end < len(trails) else ''
+        self._send_page('<table>\n%s</table>\n<button id="load-more-trails"%s>Load More</button>' % (rows, data_url))
+
+    def _send_page(self, body: str, headers=None):
+        self._send(200, ('<!DOCTYPE html>\n<html><body>\n' + body + '\n</body></html>\n').encode('utf8'), headers)
+
+    def _send(self, status: int, content: bytes, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SyntheticHpServer(ThreadingHTTPServer):
+    """
+    A local stand-in for HikingProject's website, serving synthetic trails.
+    """
+
+    def __init__(self, site: dict, email: str, password: str, page_size=3, port=0):
+        """
+        :param site: the trails of the website (see make_hp_site).
+        :param email: the email the login form accepts.
+        :param password: the password the login form accepts.
+        :param page_size: the number of trails in every part of a country's trail list.
+        :param port: the port to listen on (0 picks a free port).
+        """
+        super().__init__(('localhost', port), SyntheticHpHandler)
+        self.site = site
+        self.trails = {trail['id']: trail for trails in site.values() for trail in trails}
+        self.email = email
+        self.password = password
+        self.page_size = page_size
+        self.token = 'synthetic-token'
+        self.session = 'synthetic-session'
+        self.logins = 0
+
+    def start(self) -> dict:
+        """
+        Starts serving in a background thread.
+        :return: the environment variables that point the pipeline at this server (see fixture_server).
+        """
+        from Benchmarks.fixture_server import get_environment
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return get_environment(self.server_address[1])
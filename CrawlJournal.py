@@ -0,0 +1,110 @@
+"""
+A json dictionary (for example the crawler's seen.json or a country's progress.json) that is updated through an
+append-only journal instead of being rewritten on every change. The dictionary is kept in two files:
+ (1) <path>: a snapshot of the dictionary (the same format the file had before the journal was added).
+ (2) <path>.journal: the changes made since the snapshot, one json line per change:
+     {"op": "set", "key": k, "value": v} - sets a key.
+     {"op": "advance", "key": k, "index": i} - sets the first item of the list at a key (the crawler's next track index).
+Every change appends one short line, so its cost doesn't depend on the size of the dictionary. Every SNAPSHOT_EVERY
+changes the snapshot is replaced (atomically) and the journal is emptied. On opening, the snapshot is loaded and the
+journal is replayed on top of it. A partly written line (a crash in the middle of an append) is ignored.
+"""
+
+import json
+import os
+
+SNAPSHOT_EVERY = 100  # The number of changes between snapshots.
+JOURNAL_SUFFIX = '.journal'
+
+
+class CrawlJournal:
+    """
+    A dictionary saved as a snapshot and a journal of changes.
+    """
+
+    def __init__(self, path: str, snapshot_every=SNAPSHOT_EVERY):
+        """
+        :param path: the path of the snapshot file (the journal is saved next to it).
+        :param snapshot_every: the number of changes between snapshots.
+        """
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.snapshot_every = snapshot_every
+        self.state = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.state = json.load(f)
+        self._changes = 0  # The number of changes in the journal.
+        self._needs_newline = False  # True if the journal ends with a partly written line.
+        self._replay()
+
+    def _replay(self):
+        """
+        Applies the changes in the journal to self.state.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'r') as f:
+            for line in f:
+                self._needs_newline = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:  # a line that was only partly written.
+                    continue
+                self._apply(record)
+                self._changes += 1
+
+    def _apply(self, record: dict):
+        if record['op'] == 'set':
+            self.state[record['key']] = record['value']
+        elif record['op'] == 'advance':
+            self.state[record['key']][0] = record['index']
+
+    def _append(self, record: dict):
+        """
+        Applies a change, and appends it to the journal (taking a snapshot if it's time to).
+        """
+        self._apply(record)
+        with open(self.journal_path, 'a') as f:
+            f.write(('\n' if self._needs_newline else '') + json.dumps(record) + '\n')
+        self._needs_newline = False
+        self._changes += 1
+        if self._changes >= self.snapshot_every:
+            self.snapshot()
+
+    def __contains__(self, key):
+        return key in self.state
+
+    def __getitem__(self, key):
+        return self.state[key]
+
+    def set(self, key, value):
+        """
+        Sets the value of a key.
+        """
+        self._append({'op': 'set', 'key': key, 'value': value})
+
+    def advance(self, key, index):
+        """
+        Sets the first item of the list at the given key, for example: the index of the next track of a country in
+        seen.json ([index, urls]), without writing the rest of the list again.
+        """
+        self._append({'op': 'advance', 'key': key, 'index': index})
+
+    def snapshot(self):
+        """
+        Saves the whole dictionary to the snapshot file (replacing it only once the new one is complete), and empties the
+        journal.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=4)
+        os.replace(tmp_path, self.path)
+        # If the run stops here, the journal is replayed on top of the new snapshot, which changes nothing.
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._changes = 0
+        self._needs_newline = False
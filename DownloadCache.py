@@ -0,0 +1,119 @@
+"""
+A persistent on-disk cache for the data downloaded from OpenStreetMap (gps-traces pages and Overpass query results).
+Every response is saved under a key that is a hash of what identifies it: its kind (for example 'trackpoints' or
+'overpass'), the bounding box and the page index or query. The cache directory holds, for every key:
+ (1) <key>.bin: the content of the response.
+ (2) <key>.json: when, and from which url, it was downloaded.
+Entries older than the cache's ttl are downloaded again. In offline mode the network is never used: every request must
+be answered from the cache (regardless of the age of the entry), or an OfflineCacheMiss is raised.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.request
+
+CACHE_DIR_PATH = 'files\\cache'
+DEFAULT_TTL = 7 * 24 * 60 * 60  # (seconds) a week.
+REQUEST_TIMEOUT = 180  # (seconds) Overpass queries over a large box may take a while.
+USER_AGENT = 'NeedleProject'
+
+
+class OfflineCacheMiss(Exception):
+    """
+    Raised in offline mode, when a request is not in the cache.
+    """
+    pass
+
+
+def fetch_url(url: str, data: bytes = None) -> bytes:
+    """
+    Downloads the content of the given url.
+    :param data: if given, it's sent as the body of a POST request.
+    :return: the content of the response.
+    """
+    request = urllib.request.Request(url, data=data, headers={'User-Agent': USER_AGENT})
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        return response.read()
+
+
+class DownloadCache:
+    """
+    A content cache of downloads, keyed by (kind, bounding box, request).
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR_PATH, ttl=DEFAULT_TTL, offline=False):
+        """
+        :param cache_dir: the directory the cached responses are saved in.
+        :param ttl: (seconds) cached responses older than that are downloaded again. None means they never expire.
+        :param offline: if True, the network is never used.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(kind: str, box, request) -> str:
+        """
+        :param kind: the kind of the request, for example 'trackpoints'.
+        :param box: the bounding box of the request: [West, South, East, North].
+        :param request: what identifies the request inside the box (a page index, a query string...).
+        :return: the cache key of the request.
+        """
+        identity = json.dumps([kind, [float(limit) for limit in box], request])
+        return hashlib.sha256(identity.encode('utf8')).hexdigest()
+
+    def _get_paths(self, key: str) -> tuple:
+        """
+        :return: the paths of the content file and the metadata file of the given key.
+        """
+        return os.path.join(self.cache_dir, key + '.bin'), os.path.join(self.cache_dir, key + '.json')
+
+    def _is_fresh(self, meta_path: str) -> bool:
+        """
+        :return: True if the entry whose metadata is saved in the given path didn't expire yet.
+        """
+        if self.offline or self.ttl is None:
+            return True
+        with open(meta_path, 'r') as f:
+            return time.time() - json.load(f)['time'] <= self.ttl
+
+    def get(self, kind: str, box, request, url: str, data: bytes = None, fetch=fetch_url) -> bytes:
+        """
+        Returns the content of a request, from the cache if it holds a fresh copy of it and from the network otherwise.
+        :param kind, box, request: identify the request (see get_key).
+        :param url: the url the content is downloaded from.
+        :param data: the body of the request, if it's a POST request.
+        :param fetch: the function downloading the content: fetch(url, data) -> bytes (for example Downloader.fetch).
+        :return: the content of the response.
+        """
+        key = self.get_key(kind, box, request)
+        content_path, meta_path = self._get_paths(key)
+        if os.path.exists(content_path) and os.path.exists(meta_path) and self._is_fresh(meta_path):
+            self.hits += 1
+            with open(content_path, 'rb') as f:
+                return f.read()
+        if self.offline:
+            raise OfflineCacheMiss(kind + ' ' + json.dumps(request) + ' is not in the cache (' + self.cache_dir + ')')
+
+        self.misses += 1
+        content = fetch(url, data)
+        self._save(content_path, content, 'wb')
+        self._save(meta_path, json.dumps({'kind': kind, 'url': url, 'time': time.time()}), 'w')
+        return content
+
+    @staticmethod
+    def _save(path: str, content, mode: str):
+        """
+        Saves the content to the given path, replacing the previous file only once the new one is complete (so
+        concurrent downloads never read half written entries).
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp'
+        with open(tmp_path, mode) as f:
+            f.write(content)
+        os.replace(tmp_path, path)
@@ -0,0 +1,123 @@
+"""
+A concurrent http downloader for the OSM APIs: all of the requests share one pooled session (connections are reused
+instead of opened per request), at most <workers> requests are in flight at a time, and the requests rate is kept under
+the API's limit by a token bucket. Failed requests (connection errors, 429 and 5xx responses) are retried with an
+exponential backoff, respecting the server's Retry-After header when there is one.
+"""
+
+import threading
+import time
+
+DOWNLOAD_WORKERS = 4  # The number of requests in flight at a time.
+REQUESTS_PER_SECOND = 2.0  # The average requests rate allowed by the rate limiter.
+REQUESTS_BURST = 4  # The number of requests that may be sent at once after an idle period.
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 2.0  # The wait before the first retry, doubled on every retry.
+REQUEST_TIMEOUT = 180  # (seconds) Overpass queries over a large box may take a while.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+USER_AGENT = 'NeedleProject'
+
+
+class RateLimiter:
+    """
+    A thread safe token bucket: tokens are added at a constant rate (up to burst tokens), and every request takes one.
+    """
+
+    def __init__(self, rate=REQUESTS_PER_SECOND, burst=REQUESTS_BURST):
+        """
+        :param rate: the number of tokens added per second (None means no limit).
+        :param burst: the maximal number of tokens in the bucket.
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, waiting until there is one.
+        """
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Downloader:
+    """
+    Downloads urls through a pooled session, with bounded concurrency, rate limiting and retries.
+    """
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, rate=REQUESTS_PER_SECOND, retries=MAX_RETRIES,
+                 backoff=BACKOFF_SECONDS):
+        """
+        :param workers: the maximal number of concurrent requests (the size of the connections pool).
+        :param rate: the average number of requests per second (None means no limit).
+        :param retries: the number of times a failed request is retried.
+        :param backoff: (seconds) the wait before the first retry, doubled on every retry.
+        """
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limiter = RateLimiter(rate)
+        self._session = None  # Created on the first request.
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        """
+        :return: the shared session, creating it if needed.
+        """
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                self._session = requests.Session()
+                self._session.headers['User-Agent'] = USER_AGENT
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                self._session.mount('http://', adapter)
+                self._session.mount('https://', adapter)
+            return self._session
+
+    def fetch(self, url: str, data: bytes = None) -> bytes:
+        """
+        Downloads the content of the given url, retrying failed requests.
+        :param data: if given, it's sent as the body of a POST request.
+        :return: the content of the response.
+        """
+        import requests
+        session = self._get_session()
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire()
+            wait = self.backoff * 2 ** attempt
+            try:
+                if data is None:
+                    response = session.get(url, timeout=REQUEST_TIMEOUT)
+                else:
+                    response = session.post(url, data=data, timeout=REQUEST_TIMEOUT)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.content
+                error = requests.HTTPError(str(response.status_code) + ' for url: ' + url, response=response)
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    wait = max(wait, int(retry_after))
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt < self.retries:
+                print("request failed (" + str(error) + "), retrying in " + str(wait) + " seconds")
+                time.sleep(wait)
+        raise error
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,73 @@
+"""
+Detects near-duplicate gps traces (for example, many recordings of the same popular trail). Every trace is represented
+by the set of grid cells (about 100m x 100m) it visits, and two traces are near-duplicates if the Jaccard similarity of
+their cells sets is at least the detector's threshold. Candidate pairs are found with MinHash LSH, so adding a trace
+costs about the same no matter how many traces were added before.
+"""
+
+import numpy as np
+
+GRID_CELL_DEGREES = 0.001  # The side of a grid cell (about 110m of latitude).
+DUPLICATE_THRESH = 0.8  # The minimal Jaccard similarity of the cells of near-duplicate traces.
+NUM_PERM = 64  # The number of permutations of the MinHash signatures.
+
+
+def get_grid_cells(coordinates: np.ndarray, cell_degrees=GRID_CELL_DEGREES) -> set:
+    """
+    :param coordinates: a np array of shape (n, 2) holding the coordinates (lat, lon) of a trace.
+    :param cell_degrees: the side of a grid cell, in degrees.
+    :return: the set of the grid cells the trace visits, as strings: "<row>,<column>".
+    """
+    cells = np.unique(np.floor(np.asarray(coordinates, dtype=np.float64) / cell_degrees).astype(np.int64), axis=0)
+    return {str(row) + ',' + str(column) for row, column in cells}
+
+
+class DuplicateDetector:
+    """
+    Clusters near-duplicate traces. The first trace of every cluster is its representative, and the following traces
+    are compared to the representatives only (so clusters don't drift away from their representative).
+    """
+
+    def __init__(self, thresh=DUPLICATE_THRESH, num_perm=NUM_PERM, cell_degrees=GRID_CELL_DEGREES):
+        """
+        :param thresh: the minimal Jaccard similarity of the cells of near-duplicate traces.
+        :param num_perm: the number of permutations of the MinHash signatures.
+        :param cell_degrees: the side of a grid cell, in degrees.
+        """
+        self.thresh = thresh
+        self.num_perm = num_perm
+        self.cell_degrees = cell_degrees
+        from datasketch import MinHashLSH  # imported here, so modules using DuplicateDetector don't pay for it.
+        self._lsh = MinHashLSH(threshold=thresh, num_perm=num_perm)
+        self._cells = {}  # The cells of every representative.
+        self.clusters = {}  # Maps the id of every representative to the ids of its cluster (the representative first).
+
+    def add(self, trace_id, coordinates: np.ndarray):
+        """
+        Adds a trace, either to the cluster of its most similar representative or as the representative of a new
+        cluster.
+        :param trace_id: the id of the trace.
+        :param coordinates: a np array of shape (n, 2) holding the coordinates (lat, lon) of the trace.
+        :return: the id of the representative of the trace's cluster.
+        """
+        from datasketch import MinHash
+        cells = get_grid_cells(coordinates, self.cell_degrees)
+        min_hash = MinHash(num_perm=self.num_perm)
+        for cell in cells:
+            min_hash.update(cell.encode('utf8'))
+
+        # The LSH candidates are verified with their exact similarity:
+        best_id, best_similarity = None, self.thresh
+        for candidate_id in self._lsh.query(min_hash):
+            candidate_cells = self._cells[candidate_id]
+            similarity = len(cells & candidate_cells) / len(cells | candidate_cells)
+            if similarity >= best_similarity:
+                best_id, best_similarity = candidate_id, similarity
+
+        if best_id is not None:
+            self.clusters[best_id].append(trace_id)
+            return best_id
+        self._lsh.insert(trace_id, min_hash)
+        self._cells[trace_id] = cells
+        self.clusters[trace_id] = [trace_id]
+        return trace_id
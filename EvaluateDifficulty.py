@@ -1,9 +1,13 @@
 import slopeMap as sm
+import GeometryCodec as gc
+import numpy as np
 import pandas as pd
 import OsmTrack
 import os
 import json
 import TrackDifficulty as td
+from HpTrackStore import HpTrackStore
+from Instrumentation import BuildProfiler
 
 
 class DifficultyEvaluator:
@@ -12,16 +16,18 @@ class DifficultyEvaluator:
     shingles_dir_path = 'hp\\shingles'
     seen_path = 'hp\\seen.json'
 
-    def __init__(self, area_fname, area_topleft, shingle_length):
+    def __init__(self, area_fname, area_topleft, shingle_length, profiler=None):
         """
         ctor
         :param area_fname: path to hgt file relevant to tested area
         :param area_topleft: list of length 2 with top left coordiantes of area file (at area_fname)
+        :param profiler: the BuildProfiler the elevation sampling is recorded in (see Instrumentation)
         """
         self._area_fname = area_fname
         self._area_topleft = area_topleft
         self._shingle_length = shingle_length
         self._shingle_db = {}  # we're going to query shingles a lot in a run and we want to compute shingles once
+        self._profiler = profiler if profiler is not None else BuildProfiler()
 
     def get_shingles(self, points: pd.DataFrame) -> set:
         """
@@ -30,7 +36,8 @@ class DifficultyEvaluator:
         :return: a set of the slope-shingles appearing in the track.
         """
         pts = points.to_numpy()
-        elev = sm.compute_track_elevation(self._area_fname, self._area_topleft, pts)
+        with self._profiler.stage('elevation_sampling', items=len(pts)):
+            elev = sm.compute_track_elevation(self._area_fname, self._area_topleft, pts)
         path_length = sm.compute_track_km(pts)[-1]
         slopes = sm.compute_slope(pts, elev, path_length)
         return self.shingle_slopes(slopes, self._shingle_length)
@@ -70,6 +77,18 @@ class DifficultyEvaluator:
             result.append(int((slope // 10) + 9))
         return result
 
+    @staticmethod
+    def decode_hp_track(track_repr: list):
+        """
+        reads the points and elevations of an hp track representation: [points, elevations, length, difficulty].
+        the points and elevations are either encoded strings (see GeometryCodec) or nested lists (older data).
+        :return: 2-dim np array of the track's points: (lat, lon), np array of the elevations at the points.
+        """
+        points, elevations = track_repr[0], track_repr[1]
+        if isinstance(points, str):
+            return gc.decode_text(points), gc.decode_text(elevations).ravel()
+        return np.asarray(points, dtype=float), np.asarray(elevations, dtype=float)
+
     @staticmethod
     def _calc_hp_slopes(dictionary: dict):
         """
@@ -78,7 +97,8 @@ class DifficultyEvaluator:
         """
         res = {}
         for key in dictionary.keys():
-            slope = sm.compute_slope(dictionary[key][0], dictionary[key][1], dictionary[key][2])
+            points, elevations = DifficultyEvaluator.decode_hp_track(dictionary[key])
+            slope = sm.compute_slope(points, elevations, dictionary[key][2])
             res[key] = [slope, dictionary[key][-1]]
         return res
 
@@ -87,13 +107,7 @@ class DifficultyEvaluator:
         """
         collects tracks from hp dataset which match the length of a given path
         """
-        path = os.path.join(DifficultyEvaluator.pts_dir_path, str(sm.get_length_tag(length)) + '.json')
-        dictionary = {}
-
-        if os.path.exists(path):
-            with open(path, "r") as f:
-                file = f.read()
-            dictionary = json.loads(file)
+        dictionary = HpTrackStore(DifficultyEvaluator.pts_dir_path).load(sm.get_length_tag(length))
         return DifficultyEvaluator._calc_hp_slopes(dictionary)
 
     def get_hp_shingled_tracks(self, path_length):
@@ -134,8 +148,11 @@ class DifficultyEvaluator:
         self._shingle_db[db_key] = res
         if not os.path.exists(DifficultyEvaluator.shingles_dir_path):
             os.makedirs(DifficultyEvaluator.shingles_dir_path)
-        with open(path, 'w') as f:
+        # Areas may be built concurrently, so the file is replaced only once it's complete:
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
             json.dump(res_json, f, indent=4)
+        os.replace(tmp_path, path)
         return res
 
     def pred_difficulty_known_heights(self, track: pd.DataFrame, k: int):
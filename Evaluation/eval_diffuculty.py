@@ -1,4 +1,3 @@
-from sklearn import metrics
 from Evaluation import eval_util
 from EvaluateDifficulty import DifficultyEvaluator
 from TrackDifficulty import TrackDifficulty
@@ -31,6 +30,7 @@ def eval_difficulty(shingle_length=2):
     """
     Evaluates the ability of the model to classify the tracks by difficulty.
     """
+    from sklearn import metrics
     exp_data = eval_util.get_exp_dataframe('difficulty')
 
     tracks = []
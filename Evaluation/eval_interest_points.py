@@ -2,18 +2,14 @@ import math
 import os
 import time
 
-import folium
-import overpy
 import pandas as pd
 import json
-from sklearn.metrics import precision_score, recall_score, accuracy_score
 from Evaluation import eval_util
 from PointTag import PointTag
 import glob
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits import mplot3d
 import OsmDataCollector
+from geopy.distance import geodesic
 
 RATIO_MAX = 10  # the experiment's max ratio value
 THRESH_MAX = 20  # the experiment's max thresh value
@@ -31,6 +27,7 @@ def get_interest_points(box: list, node_tag: str) -> pd.DataFrame:
     https://towardsdatascience.com/loading-data-from-openstreetmap-with-python-and-the-overpass-api-513882a27fd0
     :return: a pandas df (lat, lon) containing the
     """
+    import overpy
     overpass_api = overpy.Overpass()
     while True:
         try:
@@ -44,6 +41,34 @@ def get_interest_points(box: list, node_tag: str) -> pd.DataFrame:
     return pd.DataFrame([{'lat': p.lat, 'lon': p.lon} for p in r.nodes])
 
 
+def get_min_distances(tracks: list, tracks_candidates: list, sample_ratios: list) -> np.ndarray:
+    """
+    Computes, for every track, the minimal distance between its sampled points and its candidates, at every sampling
+    ratio, with a single pass of distance computations: the distances between all of the points of a track and its
+    candidates are computed once, and every sampling ratio takes the minimum over its sampled points (the same points
+    OsmTrack.is_close samples).
+    :param tracks: a list of OsmTrack objects
+    :param tracks_candidates: a panda's df list holding the candidates corresponding to the tracks in <tracks>
+    :param sample_ratios: the sampling ratios (see OsmTrack.is_close).
+    :return: a np array of shape (len(sample_ratios), len(tracks)) holding the minimal distances in meters (inf for a
+    track that has no candidate inside its boundaries, as is_close ignores the candidates outside of them).
+    """
+    min_distances = np.full((len(sample_ratios), len(tracks)), math.inf)
+    for track_idx, track in enumerate(tracks):
+        candidates = [[point.lat, point.lon] for idx, point in tracks_candidates[track_idx].iterrows()
+                      if track.in_boundaries(point)]
+        if not candidates:
+            continue
+        track_points = track.gps_points[['lat', 'lon']].to_numpy()[:-1]  # is_close never samples the last point.
+        distances = np.array([[geodesic(track_point, candidate).m for candidate in candidates]
+                              for track_point in track_points]).reshape(len(track_points), len(candidates))
+        for ratio_idx, ratio in enumerate(sample_ratios):
+            sampled = distances[::track.get_sample_step(ratio)]
+            if sampled.size:
+                min_distances[ratio_idx, track_idx] = sampled.min()
+    return min_distances
+
+
 def get_model_predictions(tracks: list, tracks_candidates: list, closeness_thresh=200, sample_ratio=1 / 10) -> list:
     """
     Gets the predictions of the models for the given tracks with the given number of neighbors.
@@ -56,14 +81,8 @@ def get_model_predictions(tracks: list, tracks_candidates: list, closeness_thres
     closeness_thresh to any of the track's points.
     :return: a list of the predicted results for the existence of an interest point near the given tracks.
     """
-    predictions = [0]*len(tracks)
-    for track_idx, track in enumerate(tracks):
-        candidate_points = tracks_candidates[track_idx]
-        for idx, point in candidate_points.iterrows():
-            if track.is_close(point, closeness_thresh, sample_ratio):
-                predictions[track_idx] = 1
-                break
-    return predictions
+    min_distances = get_min_distances(tracks, tracks_candidates, [sample_ratio])[0]
+    return (min_distances < closeness_thresh).astype(int).tolist()
 
 
 def adjust_data(exp_data: pd.DataFrame, feature: PointTag):
@@ -86,31 +105,54 @@ def adjust_data(exp_data: pd.DataFrame, feature: PointTag):
     exp_data.update(feature_tags_df)
 
 
-def get_exp_results(exp_data: pd.DataFrame, tracks: list, tracks_candidates: list) -> dict:
+def get_scores(real: np.ndarray, predictions: np.ndarray) -> dict:
+    """
+    Computes the accuracy, precision and recall of many predictions at once (a precision or recall with a zero
+    denominator is 0, as in sklearn).
+    :param real: a np array of shape (n,) holding the real tags (0 or 1).
+    :param predictions: a boolean np array of shape (..., n), each row holding the predictions of one experiment.
+    :return: a dictionary of the form {'accuracy': np array, 'precision': np array, 'recall': np array}, each of the
+    shape of predictions without its last axis.
+    """
+    real = real.astype(bool)
+    true_positives = (predictions & real).sum(axis=-1)
+    predicted_positives = predictions.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted_positives > 0, true_positives / predicted_positives, 0.0)
+        recall = np.where(real.sum() > 0, true_positives / real.sum(), 0.0)
+    return {'accuracy': (predictions == real).mean(axis=-1), 'precision': precision, 'recall': recall}
+
+
+def get_exp_results(exp_data: pd.DataFrame, tracks: list, tracks_candidates: list, sample_ratios=None,
+                    thresholds=None) -> dict:
     """
     Gets the accuracy, precision and recall of the algorithm for different values of 'sampling ratio' (=
     we sample 1/sample_ratio of the track points to determine if a candidate
     interest point belongs to it.)
+    The minimal distances of the tracks are computed once per sampling ratio (see get_min_distances), and all of the
+    thresholds are applied to them at once, so finer grids cost little more than the distances pass.
     :param exp_data: a df (gpx, real) where 'gpx' containing paths of track gpx files, and 'real'
     containing a list of the interest  points the corresponding tracks contain.
     :param tracks: a list of OsmTrack objects
     :param tracks_candidates: a panda's df list holding the candidates corresponding to the tracks in <tracks>
+    :param sample_ratios: the sampling ratios tested (1, 1/2, ..., 1/RATIO_MAX by default).
+    :param thresholds: the closeness thresholds tested, in meters (0, THRESH_STEP, ..., THRESH_MAX by default).
     :return: a dictionary of the form {'accuracy': [], 'precision': [], 'recall': []} containing the values
-    of accuracy, precision and recall for different sampling ratios and accuracy threshold values.
+    of accuracy, precision and recall for different sampling ratios and accuracy threshold values (ordered by the
+    sampling ratio, and then by the threshold).
     """
-    results = {'accuracy': [], 'precision': [], 'recall': []}
-    real = exp_data['real'].values.tolist()
-
-    for ratio in range(1, RATIO_MAX + 1):
-        print("\tratio: ", 1/ratio)
-        for thresh in range(0, THRESH_MAX + 1, THRESH_STEP):
-            print("\t\tthresh: ", thresh)
+    if sample_ratios is None:
+        sample_ratios = [1 / ratio for ratio in range(1, RATIO_MAX + 1)]
+    if thresholds is None:
+        thresholds = range(0, THRESH_MAX + 1, THRESH_STEP)
+    real = np.array(exp_data['real'].values.tolist(), dtype=int)
 
-            predictions = get_model_predictions(tracks, tracks_candidates, thresh, sample_ratio=(1/ratio))
-            results['accuracy'].append(accuracy_score(real, predictions))
-            results['precision'].append(precision_score(real, predictions))
-            results['recall'].append(recall_score(real, predictions))
-    return results
+    print("\t computing distances...")
+    min_distances = get_min_distances(tracks, tracks_candidates, sample_ratios)
+    # predictions[i, j, k]: the prediction for track k with the i-th sampling ratio and the j-th threshold.
+    predictions = min_distances[:, np.newaxis, :] < np.asarray(thresholds, dtype=float)[np.newaxis, :, np.newaxis]
+    scores = get_scores(real, predictions)
+    return {quality: values.ravel().tolist() for quality, values in scores.items()}
 
 
 def get_candidates(area_path, tested_feature, tracks) -> list:
@@ -158,7 +200,8 @@ def eval_interest_points(tested_feature: PointTag) -> dict:
     """
     print("setup...")
 
-    area_path = 'interest_points_eval\\nz'
+    # The tracks (and so their candidates) depend on the feature, so every feature keeps its own candidates:
+    area_path = os.path.join('interest_points_eval\\nz', tested_feature.name.lower())
     exp_data = eval_util.get_exp_dataframe('features')
     adjust_data(exp_data, tested_feature)
     exp_data = exp_data[(exp_data['real'] == 1) | (exp_data['real'] == 0)]
@@ -188,6 +231,8 @@ def visualize_experiment_results(experiment_res: dict, quality: str):
     :param experiment_res: the interest points experiment results
     :param quality: the quality we want to plot (from {'recall', 'precision', 'accuracy'})
     """
+    import matplotlib.pyplot as plt
+    from mpl_toolkits import mplot3d  # registers the 3d projection.
     qualities = {'recall', 'precision', 'accuracy'}
     assert(quality in qualities)
 
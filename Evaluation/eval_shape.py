@@ -1,6 +1,5 @@
 from Evaluation import eval_util
 from TrackShape import TrackShape
-from sklearn import metrics
 
 
 def get_model_predictions(tracks: list, thresh=100) -> list:
@@ -20,11 +19,12 @@ def eval_shape():
     """
     Evaluates the ability of the model to predict the track shape.
     """
+    from sklearn import metrics
     exp_data = eval_util.get_exp_dataframe('shape')
     exp_data = exp_data.replace('point to point', TrackShape.CURVE.value)
     exp_data = exp_data.replace('point to point Very', TrackShape.CURVE.value)
     exp_data = exp_data.replace('out and back', TrackShape.CURVE.value)
-    tracks = [eval_util.convert_to_osm(exp_data.gpx[i], i) for i in range(len(exp_data))]
+    tracks = [eval_util.convert_to_osm(exp_data.gpx.iloc[i], i) for i in range(len(exp_data))]
     results = {'accuracy': [], 'precision': [], 'recall': []}
 
     for thresh in range(1, 125):
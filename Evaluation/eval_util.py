@@ -1,14 +1,20 @@
 """
 A utility module supplies functions that can be used for any classifier evaluation.
+The evaluation gpx files are parsed once: the parsed tracks are kept in a binary cache (TRACKS_CACHE_PATH) under the
+hash of their file's content, so every experiment (and every later run) reads them from the cache.
 """
+import hashlib
+import os
+import pickle
 import gpxpy.gpx
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from OsmTrack import OsmTrack
+from CrawlJournal import CrawlJournal
 
 EVAL_DATA_PATH = 'EvalData\\hp\\gpx\\New Zealand\\progress.json'
 GPX_REL_PATH = 'EvalData\\hp\\gpx\\New Zealand\\'
+TRACKS_CACHE_PATH = 'EvalData\\cache'
 
 
 def get_exp_dataframe(attr_name: str) -> pd.DataFrame:
@@ -28,7 +34,8 @@ def get_exp_dataframe(attr_name: str) -> pd.DataFrame:
     :return: pandas df (gpx, real, predicted)
     """
     assert attr_name in {'difficulty', 'length', 'shape', 'features'}
-    eval_data = pd.read_json(EVAL_DATA_PATH)
+    # The progress file may have changes journaled after its last snapshot (see CrawlJournal):
+    eval_data = pd.DataFrame(CrawlJournal(EVAL_DATA_PATH).state)
     eval_data = eval_data.transpose()
     eval_data.columns = ['gpx', 'difficulty', 'length', 'shape', 'features']
     eval_data = eval_data[['gpx', attr_name]]
@@ -41,6 +48,33 @@ def get_exp_dataframe(attr_name: str) -> pd.DataFrame:
     return eval_data
 
 
+def load_segment(gpx_path: str):
+    """
+    Reads the (first) gps segment of a gpx file, from the tracks cache if the file was parsed before.
+    :param gpx_path: the relative path of the gpx file, for example: 'hp\\gpx\\Philippines\\0.gpx'
+    :return: the gpxpy segment.
+    """
+    with open(gpx_path, 'rb') as f:
+        content = f.read()
+    cache_path = os.path.join(TRACKS_CACHE_PATH, hashlib.sha1(content).hexdigest() + '.pkl')
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                return pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, AttributeError):  # written by another version, parsed again.
+            pass
+
+    segment = gpxpy.parse(content.decode('utf8')).tracks[0].segments[0]
+    if not os.path.exists(TRACKS_CACHE_PATH):
+        os.makedirs(TRACKS_CACHE_PATH, exist_ok=True)
+    # Experiments may run concurrently, so the file is replaced only once it's complete:
+    tmp_path = cache_path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(segment, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return segment
+
+
 def convert_to_osm(gpx_path: str, idx: int) -> OsmTrack:
     """
     Converts the gpx in gpx_path into an OsmTrack object.
@@ -48,9 +82,7 @@ def convert_to_osm(gpx_path: str, idx: int) -> OsmTrack:
     :param idx: the index of the track to be created.
     :return: the OsmTrack object created out of the gpx in the given path.
     """
-    file = open(gpx_path, 'r', encoding="utf8")
-    gpx = gpxpy.parse(file)
-    return OsmTrack(gpx.tracks[0].segments[0], idx)
+    return OsmTrack(load_segment(gpx_path), idx)
 
 
 def read_track_to_df(gpx_path: str) -> pd.DataFrame:
@@ -59,9 +91,7 @@ def read_track_to_df(gpx_path: str) -> pd.DataFrame:
     :param gpx_path: a relative path to a GPX file.
     :return: a pandas df as described.
     """
-    file = open(gpx_path, 'r', encoding="utf8")
-    gpx = gpxpy.parse(file)
-    track_pts = gpx.tracks[0].segments[0].points
+    track_pts = load_segment(gpx_path).points
     track_df = pd.DataFrame([
         {'lat': p.latitude,
          'lon': p.longitude,
@@ -80,6 +110,7 @@ def plot_results(eval_results: dict, title: str, xlabel: str):
     :param xlabel: the label of axis x, the parameter against which the model was tested (for example, the
     loop-threshold when evaluating the ability of the model to recognize loops.)
     """
+    import matplotlib.pyplot as plt
     plt.figure(title)
     plt.title(title)
     plt.xlabel(xlabel)
@@ -2,18 +2,37 @@
 This module contains code for presenting some interesting stuff out model achieves on interactive maps.
 """
 import os
-import folium
 import math
+import numpy as np
 
 from geopy.distance import geodesic
 
 from Evaluation.eval_interest_points import get_candidates
+from GeometryStore import choose_tolerance, meters_per_pixel
+from OsmTrack import OsmTrack
 from PointTag import PointTag
 from TrackShape import TrackShape
 from OsmDataCollector import OsmDataCollector
+import slopeMap as sm
 
 
-def visualize_loop_detection(search_area):
+def get_map_coordinates(track: OsmTrack, pixel_meters: float, full_res=False) -> np.ndarray:
+    """
+    Returns the coordinates of the track to draw on a map, simplified to the coarsest level that looks the same as the
+    full track in the map's resolution.
+    :param track: an OsmTrack object.
+    :param pixel_meters: the ground distance covered by one pixel of the map (see GeometryStore.meters_per_pixel).
+    :param full_res: if True, all of the track's points are returned.
+    :return: a np array of shape (n, 2) holding the coordinates (lat, lon) to draw.
+    """
+    coordinates = track.gps_points[['lat', 'lon']].to_numpy()
+    if full_res:
+        return coordinates
+    return coordinates[sm.simplify_track(coordinates, choose_tolerance(pixel_meters))]
+
+
+def visualize_loop_detection(search_area, full_res=False):
+    import folium
     osm_collector = OsmDataCollector(search_area['box'], speed_limit=math.inf)
     loop_colors = ['red', 'orange', 'darkred', 'lightred']
     not_loop_colors = ['blue', 'purple']
@@ -21,22 +40,23 @@ def visualize_loop_detection(search_area):
     location_x = (search_area['box'][1] + search_area['box'][3]) / 2
     location_y = (search_area['box'][0] + search_area['box'][2]) / 2
     output_map = folium.Map(location=[location_x, location_y], zoom_start=13)
+    pixel_meters = meters_per_pixel(location_x, 13)
 
     # Present the similar tracks on the map:
-    for track in osm_collector.tracks:
-        points = [(row[0], row[1]) for row in track.gps_points.values]
+    for track_idx, track in enumerate(osm_collector.tracks):
+        points = get_map_coordinates(track, pixel_meters, full_res).tolist()
 
         if track.deduce_track_shape(thresh=100) is TrackShape.LOOP:
-            folium.PolyLine(points, color=loop_colors[track.id % len(loop_colors)], opacity=0.5).add_to(
+            folium.PolyLine(points, color=loop_colors[track_idx % len(loop_colors)], opacity=0.5).add_to(
                 output_map)
         else:
-            folium.PolyLine(points, color=not_loop_colors[track.id % len(not_loop_colors)], opacity=0.5).add_to(
+            folium.PolyLine(points, color=not_loop_colors[track_idx % len(not_loop_colors)], opacity=0.5).add_to(
                 output_map)
 
     output_map.save('loop_detection.html')
 
 
-def visualize_interest_points_recognition(search_area: dict, tag: PointTag):
+def visualize_interest_points_recognition(search_area: dict, tag: PointTag, full_res=False):
     """
     Creates an interactive map of the search_area, that presents interest point of PointTag tag
     (an water drop pin) and tracks (trail and a information pin holding the track's index).
@@ -47,7 +67,9 @@ def visualize_interest_points_recognition(search_area: dict, tag: PointTag):
     :param search_area: a dictionary of the form {area_name: area data} containing the data of
     :param tag : PointTag
     the area we want to visualize.
+    :param full_res: if True, the tracks are drawn with all of their points.
     """
+    import folium
     area_path = os.path.join('InterestPointsData', tag.value)
     osm_collector = OsmDataCollector(search_area['box'], speed_limit=math.inf)
     tracks = osm_collector.tracks
@@ -55,17 +77,19 @@ def visualize_interest_points_recognition(search_area: dict, tag: PointTag):
     location_x = (search_area['box'][1] + search_area['box'][3]) / 2
     location_y = (search_area['box'][0] + search_area['box'][2]) / 2
     output_map = folium.Map(location=[location_x, location_y], zoom_start=13)
+    pixel_meters = meters_per_pixel(location_x, 13)
     colors = ['cadetblue', 'darkpurple', 'purple', 'green', 'darkgreen', 'darkred', 'lightred', 'red',
               'orange', 'blue', 'lightblue', 'darkblue', 'pink', 'lightgray', 'lightgreen']
 
     markers = {}
     for track_idx, track in enumerate(tracks):
-        track_color = colors[track.id % len(colors)]
+        track_color = colors[track_idx % len(colors)]
 
         # Present track on map, and pin it by idx:
-        folium.PolyLine(track.gps_points.to_numpy()[:, :2], color=track_color, opacity=1).add_to(output_map)
+        points = get_map_coordinates(track, pixel_meters, full_res)
+        folium.PolyLine(points, color=track_color, opacity=1).add_to(output_map)
         folium.Marker(
-            location=[track.gps_points.to_numpy()[:, :2][-1][0], track.gps_points.to_numpy()[:, :2][-1][1]],
+            location=[points[-1][0], points[-1][1]],
             popup='track ' + str(track_idx),
             icon=folium.Icon(color=track_color, icon='info-sign')
         ).add_to(output_map)
@@ -96,12 +120,14 @@ def visualize_interest_points_recognition(search_area: dict, tag: PointTag):
     output_map.save('interest_points_vis.html')
 
 
-def visualize_pedestrians_recognition(search_area: dict):
+def visualize_pedestrians_recognition(search_area: dict, full_res=False):
     """
     Creates an interactive map where tracks who's average velocity is smaller then 5 km per hour
     are painted in blue. The rest of the tracks are painted in red.
     :param search_area: a dictionary of the form {area_name: area data} containing the data of the area we visualize.
+    :param full_res: if True, the tracks are drawn with all of their points.
     """
+    import folium
     osm_collector = OsmDataCollector(search_area['box'], speed_limit=math.inf)
     fast_colors = ['red', 'darkred', 'lightred']
     slow_colors = ['blue', 'darkblue']
@@ -110,16 +136,17 @@ def visualize_pedestrians_recognition(search_area: dict):
     location_x = (search_area['box'][1] + search_area['box'][3]) / 2
     location_y = (search_area['box'][0] + search_area['box'][2]) / 2
     output_map = folium.Map(location=[location_x, location_y], zoom_start=14)
+    pixel_meters = meters_per_pixel(location_x, 14)
 
     # Present the similar tracks on the map:
-    for track in osm_collector.tracks:
-        points = [(row[0], row[1]) for row in track.gps_points.values]
+    for track_idx, track in enumerate(osm_collector.tracks):
+        points = get_map_coordinates(track, pixel_meters, full_res).tolist()
 
         if track.avg_velocity <= 5:
-            folium.PolyLine(points, color=slow_colors[track.id % len(slow_colors)],
+            folium.PolyLine(points, color=slow_colors[track_idx % len(slow_colors)],
                             opacity=0.5).add_to(output_map)
         else:
-            folium.PolyLine(points, color=fast_colors[track.id % len(fast_colors)],
+            folium.PolyLine(points, color=fast_colors[track_idx % len(fast_colors)],
                             opacity=0.5).add_to(output_map)
 
     output_map.save('pedestrian_detection.html')
@@ -0,0 +1,103 @@
+"""
+Runs all of the evaluation experiments in one go: the shape experiment, the difficulty experiment and the interest
+points experiment of every PointTag. The experiments run concurrently, in a pool of worker processes, after the
+evaluation tracks were parsed (in parallel) into the tracks cache (see eval_util), so no experiment parses a gpx file.
+The results of all of the experiments are written to a single report:
+{
+    "seconds": <the duration of the whole run>,
+    "experiments": {
+        <experiment name>: {"status": "ok", "seconds": t, "results": {"accuracy": [...], "precision": [...],
+                                                                      "recall": [...]}}
+                        or {"status": "failed", "error": message, "traceback": ..., "seconds": t},
+        ...
+    }
+}
+A failure in one experiment doesn't stop the others.
+
+Usage (from the repository root):
+    python -m Evaluation.run_evaluation [--only NAME ...] [--workers N] [--report PATH]
+"""
+
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Evaluation import eval_util, eval_shape, eval_diffuculty, eval_interest_points
+from PointTag import PointTag
+
+REPORT_PATH = 'EvalData\\evaluation_report.json'
+CHUNK_SIZE = 16  # The number of gpx files parsed by a worker at a time.
+
+# The experiments: {name: (function, arguments)}
+EXPERIMENTS = {'shape': (eval_shape.eval_shape, ()), 'difficulty': (eval_diffuculty.eval_difficulty, ())}
+EXPERIMENTS.update({'interest_points_' + tag.name.lower(): (eval_interest_points.eval_interest_points, (tag,))
+                    for tag in PointTag})
+
+
+def run_experiment(name: str) -> dict:
+    """
+    Runs a single experiment, and reports how it went.
+    :return: the experiment's entry in the report (see the module's documentation).
+    """
+    start = time.time()
+    function, arguments = EXPERIMENTS[name]
+    try:
+        results = function(*arguments)
+    except Exception as e:  # reported, so the other experiments still run.
+        print(name + " failed: " + repr(e))
+        return {'status': 'failed', 'error': repr(e), 'traceback': traceback.format_exc(),
+                'seconds': time.time() - start}
+    return {'status': 'ok', 'seconds': time.time() - start,
+            'results': {quality: [float(value) for value in values] for quality, values in results.items()}}
+
+
+def cache_tracks(executor: ProcessPoolExecutor):
+    """
+    Parses all of the evaluation gpx files into the tracks cache (see eval_util.load_segment).
+    """
+    gpx_paths = eval_util.get_exp_dataframe('shape')['gpx'].tolist()
+    print("caching " + str(len(gpx_paths)) + " tracks...")
+    for _ in executor.map(eval_util.load_segment, gpx_paths, chunksize=CHUNK_SIZE):
+        pass
+
+
+def run_evaluation(names=None, workers=os.cpu_count(), report_path=REPORT_PATH) -> dict:
+    """
+    Runs the experiments concurrently, and writes their results to the report.
+    :param names: the experiments to run (all of EXPERIMENTS by default).
+    :param workers: the number of worker processes.
+    :param report_path: the path of the report file.
+    :return: the report.
+    """
+    start = time.time()
+    names = list(names) if names else list(EXPERIMENTS)
+    report = {'experiments': {}}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        cache_tracks(executor)
+        futures = {executor.submit(run_experiment, name): name for name in names}
+        for future in as_completed(futures):
+            report['experiments'][futures[future]] = future.result()
+            print(futures[future] + ": " + report['experiments'][futures[future]]['status'])
+    report['experiments'] = {name: report['experiments'][name] for name in names}  # in a fixed order.
+    report['seconds'] = time.time() - start
+
+    tmp_path = report_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    os.replace(tmp_path, report_path)
+    failed = [name for name in names if report['experiments'][name]['status'] != 'ok']
+    print(str(len(names) - len(failed)) + " experiments done, " + str(len(failed)) + " failed" +
+          (": " + ", ".join(failed) if failed else ""))
+    return report
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Runs all of the evaluation experiments concurrently.')
+    arg_parser.add_argument("--only", help="run only these experiments.", nargs='+', choices=EXPERIMENTS)
+    arg_parser.add_argument("--workers", help="the number of experiments run concurrently.", type=int,
+                            default=os.cpu_count())
+    arg_parser.add_argument("--report", help="the path of the report file.", default=REPORT_PATH)
+    command_line_args = arg_parser.parse_args()
+    run_evaluation(command_line_args.only, command_line_args.workers, command_line_args.report)
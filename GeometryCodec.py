@@ -0,0 +1,149 @@
+"""
+A compact binary codec for track geometry (a float array of shape (n, columns), for example lat, lon, time).
+Each column is converted to fixed point integers (value * 10 ** exponent, for example 1e-7 degrees for coordinates),
+consecutive points are delta encoded, and the zig-zagged deltas are stored as varints. Since consecutive gps points are
+close to each other, most deltas take 1-3 bytes instead of the 8 bytes of a float (or the ~10 characters of a decimal
+text). Encoding and decoding are vectorized with numpy.
+
+Format: MAGIC, then the varints: n, columns, and for every column: its zig-zagged exponent and a nan flag, followed by
+the packed nan mask of the column if the flag is set. Then all of the deltas, column after column, as varints.
+"""
+
+import base64
+import numpy as np
+
+MAGIC = b'GC1'
+COORDINATE_EXPONENT = 7  # Coordinates are kept in 1e-7 degrees (about 1 cm).
+TIME_EXPONENT = 0  # Times are kept in whole seconds.
+ELEVATION_EXPONENT = 1  # Elevations are kept in decimeters.
+MAX_VARINT_BYTES = 10  # A 64 bit value takes at most 10 groups of 7 bits.
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    """
+    Maps signed integers to unsigned ones, keeping small magnitudes small: 0, -1, 1, -2, 2... -> 0, 1, 2, 3, 4...
+    """
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values: np.ndarray) -> np.ndarray:
+    """
+    The inverse of _zigzag.
+    """
+    values = values.astype(np.uint64)
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -((values & np.uint64(1)).astype(np.int64))
+
+
+def _encode_varints(values: np.ndarray) -> bytes:
+    """
+    :param values: a np array of unsigned integers.
+    :return: the values as varints: 7 bits per byte, the high bit of every byte but the last of a value is set.
+    """
+    values = values.astype(np.uint64)
+    byte_counts = np.ones(len(values), dtype=np.int64)
+    for group in range(1, MAX_VARINT_BYTES):
+        byte_counts += (values >> np.uint64(7 * group)) > 0
+    starts = np.cumsum(byte_counts) - byte_counts
+    out = np.empty(int(byte_counts.sum()), dtype=np.uint8)
+    for group in range(MAX_VARINT_BYTES):
+        in_group = byte_counts > group
+        if not in_group.any():
+            break
+        bits = (values[in_group] >> np.uint64(7 * group)) & np.uint64(0x7f)
+        more = np.where(byte_counts[in_group] - 1 > group, 0x80, 0).astype(np.uint64)
+        out[starts[in_group] + group] = (bits | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def _decode_varints(buffer: np.ndarray, count: int) -> tuple:
+    """
+    :param buffer: a np uint8 array starting with <count> varints.
+    :param count: the number of varints to decode.
+    :return: (np uint64 array of the values, the number of bytes they took)
+    """
+    if count == 0:
+        return np.empty(0, dtype=np.uint64), 0
+    ends = np.flatnonzero(buffer[:count * MAX_VARINT_BYTES] < 0x80)[:count]  # The last byte of every varint.
+    if len(ends) < count:
+        raise ValueError('truncated geometry data')
+    used = int(ends[-1]) + 1
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts + 1
+    position = np.arange(used) - np.repeat(starts, lengths)  # The index of every byte inside its varint.
+    parts = (buffer[:used] & 0x7f).astype(np.uint64) << (7 * position).astype(np.uint64)
+    return np.add.reduceat(parts, starts), used
+
+
+def encode(values, exponents) -> bytes:
+    """
+    Encodes a track's geometry.
+    :param values: a float array of shape (n, columns), for example: (lat, lon, time). nan values are allowed.
+    :param exponents: a list holding the precision of every column: values are kept in units of 10 ** -exponent.
+    :return: the encoded bytes.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    num_points, num_columns = values.shape
+    assert len(exponents) == num_columns
+
+    header = [MAGIC, _encode_varints(np.array([num_points, num_columns]))]
+    deltas = []
+    for column, exponent in enumerate(exponents):
+        nan_mask = np.isnan(values[:, column])
+        header.append(_encode_varints(np.concatenate([_zigzag(np.array([exponent])),
+                                                      np.array([int(nan_mask.any())], dtype=np.uint64)])))
+        if nan_mask.any():
+            header.append(np.packbits(nan_mask).tobytes())
+        fixed = np.round(np.where(nan_mask, 0, values[:, column]) * 10.0 ** exponent).astype(np.int64)
+        deltas.append(np.diff(fixed, prepend=np.int64(0)))
+    return b''.join(header) + _encode_varints(_zigzag(np.concatenate(deltas) if deltas else np.empty(0)))
+
+
+def decode(data: bytes) -> np.ndarray:
+    """
+    Decodes a track's geometry.
+    :param data: bytes created by encode.
+    :return: a float np array of shape (n, columns).
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not an encoded geometry')
+    buffer = np.frombuffer(data, dtype=np.uint8, offset=len(MAGIC))
+    (num_points, num_columns), offset = _decode_varints(buffer, 2)
+    num_points, num_columns = int(num_points), int(num_columns)
+
+    exponents = []
+    nan_masks = []
+    for _ in range(num_columns):
+        (exponent, has_nan), used = _decode_varints(buffer[offset:], 2)
+        offset += used
+        exponents.append(int(_unzigzag(np.array([exponent]))[0]))
+        if has_nan:
+            mask_bytes = (num_points + 7) // 8
+            nan_masks.append(np.unpackbits(buffer[offset:offset + mask_bytes])[:num_points].astype(bool))
+            offset += mask_bytes
+        else:
+            nan_masks.append(None)
+
+    deltas, _ = _decode_varints(buffer[offset:], num_points * num_columns)
+    fixed = np.cumsum(_unzigzag(deltas).reshape(num_columns, num_points), axis=1)
+    values = fixed.T / (10.0 ** np.array(exponents, dtype=np.float64))
+    for column, nan_mask in enumerate(nan_masks):
+        if nan_mask is not None:
+            values[nan_mask, column] = np.nan
+    return values
+
+
+def encode_text(values, exponents) -> str:
+    """
+    Like encode, but returns an ascii string that can be kept in json files.
+    """
+    return base64.b64encode(encode(values, exponents)).decode('ascii')
+
+
+def decode_text(text: str) -> np.ndarray:
+    """
+    Decodes a string created by encode_text.
+    """
+    return decode(base64.b64decode(text))
@@ -0,0 +1,189 @@
+"""
+This module keeps the gps points of all the tracks of an area in a single packed file, instead of one csv file per
+track. The points of all of the tracks are concatenated into one binary file of floats (lat, lon, time), and a small
+index maps every track id to the rows of its points in that file. Reading a track is a slice of a memory-mapped array.
+
+Besides the full resolution points, the store keeps simplified versions of every track (see
+slopeMap.simplify_track), so maps can be drawn with as many points as their zoom level can actually show.
+"""
+
+import json
+import math
+import os
+import numpy as np
+import pandas as pd
+import slopeMap as sm
+
+POINTS_FILE_NAME = 'geometry.bin'
+INDEX_FILE_NAME = 'geometry_index.json'
+COLUMNS = ['lat', 'lon', 'time']  # time is kept as seconds since the epoch (nan if unknown).
+DTYPE = np.dtype('<f8')
+FULL_RES = 0  # The tolerance of the full resolution level.
+SIMPLIFY_TOLERANCES = [5, 20, 80]  # The tolerances (meters) of the simplified levels kept for each track.
+EQUATOR_METERS_PER_PIXEL = 156543.03  # The ground resolution of a web-map tile pixel at zoom 0.
+MAP_SIZE_PIXELS = 1024  # The (approximate) size of the output maps.
+
+
+def gps_points_to_array(gps_points: pd.DataFrame) -> np.ndarray:
+    """
+    Converts the gps points of a track into the rows kept in the store.
+    :param gps_points: a pandas df (lat, lon, time) as created by OsmTrack.
+    :return: a float np array of shape (n, 3): (lat, lon, seconds since the epoch).
+    """
+    times = pd.to_datetime(gps_points['time'], utc=True)
+    seconds = (times - pd.Timestamp(0, tz='UTC')).dt.total_seconds()
+    return np.column_stack([gps_points['lat'].to_numpy(dtype=DTYPE),
+                            gps_points['lon'].to_numpy(dtype=DTYPE),
+                            seconds.to_numpy(dtype=DTYPE)])
+
+
+def meters_per_pixel(lat: float, zoom: int) -> float:
+    """
+    :param lat: the latitude at the center of the map.
+    :param zoom: the zoom level of the map.
+    :return: the ground distance (meters) covered by one pixel of the map.
+    """
+    return EQUATOR_METERS_PER_PIXEL * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def zoom_for_box(north: float, south: float, east: float, west: float, min_zoom=1, max_zoom=18) -> int:
+    """
+    :return: the largest zoom level in which the given bounding box fits inside a map of MAP_SIZE_PIXELS pixels.
+    """
+    mid_lat = (north + south) / 2
+    box_meters = max(north - south, (east - west) * math.cos(math.radians(mid_lat))) * math.pi / 180 * sm.EARTH_RADIUS
+    if box_meters <= 0:
+        return max_zoom
+    zoom = int(math.log2(EQUATOR_METERS_PER_PIXEL * math.cos(math.radians(mid_lat)) * MAP_SIZE_PIXELS / box_meters))
+    return min(max(zoom, min_zoom), max_zoom)
+
+
+def choose_tolerance(pixel_meters: float, tolerances=None) -> float:
+    """
+    Chooses the coarsest simplification level whose error can't be seen on the map: the largest tolerance that is
+    still smaller than a single pixel.
+    :param pixel_meters: the ground distance covered by one pixel of the map (see meters_per_pixel).
+    :param tolerances: the available tolerances (SIMPLIFY_TOLERANCES by default).
+    :return: the chosen tolerance (FULL_RES if no simplified level is fine enough).
+    """
+    tolerances = SIMPLIFY_TOLERANCES if tolerances is None else tolerances
+    fitting = [tol for tol in tolerances if tol <= pixel_meters]
+    return max(fitting) if fitting else FULL_RES
+
+
+class GeometryStoreWriter:
+    """
+    Writes the gps points of tracks into the packed geometry files of an area directory. Tracks are appended to the
+    files already in the directory (if any), so a store can be extended without rewriting it.
+    """
+
+    def __init__(self, dir_path: str, tolerances=None):
+        """
+        :param dir_path: the directory of the area database the geometry files are kept in.
+        :param tolerances: the tolerances (meters) of the simplified levels (SIMPLIFY_TOLERANCES by default).
+        """
+        self._points_path = os.path.join(dir_path, POINTS_FILE_NAME)
+        self._index_path = os.path.join(dir_path, INDEX_FILE_NAME)
+        self._tolerances = SIMPLIFY_TOLERANCES if tolerances is None else tolerances
+        self._index = {}  # Maps a track id to {tolerance: [first row, last row + 1]}.
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r') as f:
+                index = json.load(f)
+            self._index = index['tracks']
+            self._tolerances = index['tolerances']
+        self._rows = os.path.getsize(self._points_path) // (DTYPE.itemsize * len(COLUMNS)) \
+            if os.path.exists(self._points_path) else 0
+        self._points_file = open(self._points_path, 'ab')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_rows(self, rows: np.ndarray) -> list:
+        """
+        Appends rows to the points file.
+        :return: the range of the rows in the file: [first row, last row + 1].
+        """
+        self._points_file.write(rows.astype(DTYPE).tobytes())
+        rows_range = [self._rows, self._rows + len(rows)]
+        self._rows += len(rows)
+        return rows_range
+
+    def add(self, track_id, gps_points: pd.DataFrame):
+        """
+        Appends the gps points of a track, and its simplified versions, to the store.
+        :param track_id: the id of the track.
+        :param gps_points: a pandas df (lat, lon, time) containing the gps points of the track.
+        """
+        rows = gps_points_to_array(gps_points)
+        levels = {str(FULL_RES): self._write_rows(rows)}
+        for tolerance in self._tolerances:
+            levels[str(tolerance)] = self._write_rows(rows[sm.simplify_track(rows[:, :2], tolerance)])
+        self._index[str(track_id)] = levels
+
+    def close(self):
+        """
+        Flushes the points file and writes the index (replacing the index file only once it's complete).
+        """
+        self._points_file.close()
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'columns': COLUMNS, 'tolerances': self._tolerances, 'tracks': self._index}, f)
+        os.replace(tmp_path, self._index_path)
+
+
+class GeometryStore:
+    """
+    Reads the packed geometry files of an area directory.
+    """
+
+    def __init__(self, dir_path: str):
+        """
+        :param dir_path: the directory of the area database the geometry files are kept in.
+        """
+        with open(os.path.join(dir_path, INDEX_FILE_NAME), 'r') as f:
+            index = json.load(f)
+        self._index = index['tracks']
+        self.tolerances = index['tolerances']
+        points_path = os.path.join(dir_path, POINTS_FILE_NAME)
+        if os.path.getsize(points_path) == 0:  # np.memmap can't map an empty file.
+            self._points = np.empty((0, len(COLUMNS)), dtype=DTYPE)
+        else:
+            self._points = np.memmap(points_path, dtype=DTYPE, mode='r').reshape(-1, len(COLUMNS))
+
+    def close(self):
+        """
+        Releases the points file.
+        """
+        self._points = np.empty((0, len(COLUMNS)), dtype=DTYPE)
+
+    def __contains__(self, track_id) -> bool:
+        return str(track_id) in self._index
+
+    def get_points(self, track_id, tolerance=FULL_RES) -> np.ndarray:
+        """
+        Returns the gps points of the track with the given id.
+        :param track_id: the id of the track.
+        :param tolerance: the simplification level to read (FULL_RES, or one of self.tolerances).
+        :return: a read-only np array of shape (n, 3) holding the track's points: (lat, lon, time).
+        """
+        start, end = self._index[str(track_id)][str(tolerance)]
+        return self._points[start:end]
+
+    def get_coordinates(self, track_id, tolerance=FULL_RES) -> np.ndarray:
+        """
+        Returns the coordinates of the track with the given id.
+        :param track_id: the id of the track.
+        :param tolerance: the simplification level to read (FULL_RES, or one of self.tolerances).
+        :return: a read-only np array of shape (n, 2) holding the track's coordinates: (lat, lon).
+        """
+        return self.get_points(track_id, tolerance)[:, :2]
+
+    def choose_tolerance(self, pixel_meters: float) -> float:
+        """
+        :param pixel_meters: the ground distance covered by one pixel of the map (see meters_per_pixel).
+        :return: the coarsest level of this store that looks the same as the full resolution track on the map.
+        """
+        return choose_tolerance(pixel_meters, self.tolerances)
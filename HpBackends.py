@@ -0,0 +1,357 @@
+"""
+The fetch backends of HpCrawler: the ways the crawler gets pages and gpx files from "The Hiking Project"'s website.
+Every backend offers the same methods:
+    log_in(): logs into the website.
+    trail_urls(country): returns the urls of the trail pages of a country.
+    get_track(url, gpx_path): returns the data of a trail page: (difficulty, length, shape, [features]) and the name
+                              the website gives the trail's gpx file, downloading it to gpx_path if it isn't there yet.
+    close(): releases the backend's resources.
+ (1) HttpBackend: a lightweight backend, using a pooled http session (logged in once) and python's html parser. It's
+     safe to use from several threads, so a country's tracks can be crawled by concurrent workers (with a rate limit).
+ (2) SeleniumBackend: drives a Firefox window, one page at a time. It's the fallback, if the website's pages change in
+     a way only a browser handles.
+The website's address is read from the HP_URL environment variable, so the http backend can be pointed at a local
+stand-in server (see Benchmarks/fixture_server).
+"""
+
+import os
+import re
+import threading
+import urllib.parse
+from html.parser import HTMLParser
+from Downloader import RateLimiter
+
+SITE_URL = 'https://www.hikingproject.com/'  # The links in the website's pages are absolute: they start with it.
+HP_URL = os.environ.get('HP_URL', SITE_URL)
+HP_EMAIL = os.environ.get('HP_EMAIL')  # The login details of the website, required by log_in.
+HP_PASSWORD = os.environ.get('HP_PASSWORD')
+LOGIN_PATH = 'auth/login/email'
+REQUESTS_PER_SECOND = 1.0  # Per backend, that is, per crawled country.
+REQUEST_TIMEOUT = 60
+USER_AGENT = 'NeedleProject'
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+
+def get_login_details() -> tuple:
+    """
+    :return: the (email, password) the backends log in with, from the HP_EMAIL and HP_PASSWORD environment variables.
+    """
+    if not HP_EMAIL or not HP_PASSWORD:
+        raise ValueError('the HP_EMAIL and HP_PASSWORD environment variables must be set to log in')
+    return HP_EMAIL, HP_PASSWORD
+
+
+def parse_stats(text: str) -> tuple:
+    """
+    parses the stats block of a trail page, for example: "Length 5.2 km Loop Difficulty Intermediate".
+    :returns: track_dif: string representation of enum of class TrackDifficulty
+              track_length: string representation of track length in km
+              track_shape: string representation of the track's shape
+    """
+    txt = text.split()
+    track_length = txt[1]
+    track_shape = txt[3:]
+    track_shape = track_shape[:-1]
+    if track_shape[-1] == 'Very':  # if track difficulty is very difficult need to correct
+        track_shape = track_shape[:-1]
+        track_dif = txt[-2] + " " + txt[-1]
+    else:
+        track_dif = txt[-1]
+    return track_dif, track_length, " ".join(track_shape)
+
+
+def parse_features(text: str) -> list:
+    """
+    :param text: the features line of a trail page, for example: "Birding · River/Creek · Views"
+    :return: a list of the features strings.
+    """
+    return text.split(" · ")
+
+
+class PageParser(HTMLParser):
+    """
+    Parses an html page into a flat list of its elements: (tag, attributes dict, text), where text is all of the text
+    inside the element (including its sub elements).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.elements = []
+        self._open = []  # The indices of the elements that are open, innermost last.
+
+    def handle_starttag(self, tag, attrs):
+        self.elements.append([tag, dict(attrs), ''])
+        if tag not in VOID_TAGS:
+            self._open.append(len(self.elements) - 1)
+
+    def handle_endtag(self, tag):
+        for depth in range(len(self._open) - 1, -1, -1):  # closes the innermost open element with this tag.
+            if self.elements[self._open[depth]][0] == tag:
+                del self._open[depth:]
+                break
+
+    def handle_data(self, data):
+        for index in self._open:
+            self.elements[index][2] += data
+
+    def find_all(self, tag: str, **attrs) -> list:
+        """
+        :param attrs: attribute values the elements must have (class_ stands for class).
+        :return: the elements with the given tag and attributes: [(attributes, text), ...]
+        """
+        attrs = {key.rstrip('_'): value for key, value in attrs.items()}
+        return [(element_attrs, text) for element_tag, element_attrs, text in self.elements
+                if element_tag == tag and all(element_attrs.get(key) == value for key, value in attrs.items())]
+
+    def find_link(self, text: str):
+        """
+        :return: the href of the first link whose (stripped) text is the given text, or None if there is none.
+        """
+        for attrs, link_text in self.find_all('a'):
+            if ' '.join(link_text.split()) == text:
+                return attrs.get('href')
+        return None
+
+
+def parse_page(html: str) -> PageParser:
+    parser = PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+class HttpBackend:
+    """
+    Crawls the website with plain http requests through a pooled, logged in session.
+    """
+    concurrent = True  # Safe to use from several worker threads.
+
+    def __init__(self, download_dir: str, base_url=HP_URL, rate=REQUESTS_PER_SECOND, workers=4):
+        """
+        :param download_dir: the directory the gpx files are downloaded to.
+        :param base_url: the website's address.
+        :param rate: the average number of requests per second.
+        :param workers: the number of threads using the backend (the size of the connections pool).
+        """
+        import requests
+        self._download_dir = download_dir
+        self._base_url = base_url
+        self._rate_limiter = RateLimiter(rate)
+        self._session = requests.Session()
+        self._session.headers['User-Agent'] = USER_AGENT
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _url(self, url: str) -> str:
+        """
+        :return: the absolute url of a link of the website, addressed through self._base_url.
+        """
+        if url.startswith(SITE_URL):
+            url = url[len(SITE_URL):]
+        elif url.startswith('/'):  # relative to the website's root, which may be a sub directory of self._base_url.
+            url = url[1:]
+        return urllib.parse.urljoin(self._base_url, url)
+
+    def _request(self, url: str, data=None):
+        self._rate_limiter.acquire()
+        if data is None:
+            response = self._session.get(self._url(url), timeout=REQUEST_TIMEOUT)
+        else:
+            response = self._session.post(self._url(url), data=data, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    def log_in(self):
+        """
+        logs into the website (the session keeps the login cookies).
+        """
+        email, password = get_login_details()
+        print("-- log in")
+        login_page = parse_page(self._request(LOGIN_PATH).text)
+        form = {attrs['name']: attrs.get('value', '') for attrs, _ in login_page.find_all('input')
+                if attrs.get('type') == 'hidden' and 'name' in attrs}  # the form's tokens.
+        form.update({'email': email, 'pass': password})
+        self._request(LOGIN_PATH, form)
+
+    def trail_urls(self, country: str) -> list:
+        """
+        return a list of urls (strings) for tracks in the given country
+        """
+        print("-- collecting urls")
+        homepage = parse_page(self._request('').text)
+        country_links = homepage.find_all('a', title=country)
+        if not country_links:
+            raise ValueError(country + ' was not found on the homepage')
+        page = parse_page(self._request(country_links[0][0]['href']).text)
+        trail_urls = [attrs['data-href'] for attrs, _ in page.find_all('tr', class_='trail-row')]
+
+        # the rest of the trails are loaded by the "load more" button, which holds the address of the next part:
+        load_more = page.find_all('button', id='load-more-trails')
+        while load_more and load_more[0][0].get('data-url'):
+            page = parse_page(self._request(load_more[0][0]['data-url']).text)
+            trail_urls += [attrs['data-href'] for attrs, _ in page.find_all('tr', class_='trail-row')]
+            load_more = page.find_all('button', id='load-more-trails')
+        return trail_urls
+
+    def get_track(self, url: str, gpx_path: str) -> tuple:
+        """
+        gets the data of a trail page, and downloads its gpx file to gpx_path (if it isn't there yet).
+        :return: (track_dif, track_length, track_shape, features), the name of the gpx file on the website (None if
+        it wasn't downloaded).
+        """
+        page = parse_page(self._request(url).text)
+        track_dif, track_length, track_shape = parse_stats(page.find_all('div', class_='stat-block mx-1 pb-2')[0][1])
+        features_elements = page.find_all('span', class_='font-body pl-half')
+        features = parse_features(' '.join(features_elements[0][1].split())) if features_elements else []
+
+        filename = None
+        if not os.path.exists(gpx_path):
+            response = self._request(page.find_link('GPX File'))
+            disposition = re.findall(r'filename="?([^";]+)"?', response.headers.get('Content-Disposition', ''))
+            filename = disposition[0] if disposition else os.path.basename(urllib.parse.urlparse(response.url).path)
+            tmp_path = gpx_path + '.' + str(threading.get_ident()) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(tmp_path, gpx_path)
+        return (track_dif, track_length, track_shape, features), filename
+
+    def close(self):
+        self._session.close()
+
+
+class SeleniumBackend:
+    """
+    Crawls the website with a Firefox window (one page at a time).
+    """
+    concurrent = False
+
+    def __init__(self, download_dir: str, wait=5):
+        """
+        :param download_dir: the directory the gpx files are downloaded to.
+        :param wait: how long (seconds) the driver waits for elements to appear.
+        """
+        self._download_dir = download_dir
+        self._wait = wait
+        self._driver = self._setup()
+
+    # driver setup and web navigating #
+    def _setup(self):
+        """
+        creates a firefox driver which is capable of downloading files without popups
+        """
+        from selenium import webdriver
+        print("-- setup")
+        profile = webdriver.FirefoxProfile()
+        profile.set_preference('browser.download.folderList', 2)
+        profile.set_preference('browser.download.manager.showWhenStarting', False)
+
+        profile.set_preference('browser.download.dir', os.path.abspath(self._download_dir))
+        profile.set_preference('browser.helperApps.neverAsk.saveToDisk', 'application/octet-stream')
+        driver = webdriver.Firefox(firefox_profile=profile)
+        driver.set_window_size(50, 1000)
+        return driver
+
+    def log_in(self):
+        """
+        logs into "the Hiking Project"'s website
+        """
+        import selenium.common
+        while True:
+            try:
+                self._driver.implicitly_wait(self._wait)
+                self._log_in()
+                break
+            except selenium.common.exceptions.ElementNotInteractableException:  # race condition- driver not ready
+                print("USAGE: Do not minimize the window until logged in.")
+
+    def _log_in(self):
+        email, password = get_login_details()
+        print("-- log in")
+        self._homepage()
+        elem = self._driver.find_element_by_link_text("Sign In")
+        elem.click()
+        elem_email = self._driver.find_element_by_xpath("//input[@placeholder='Log in with email']")
+        elem_email.clear()
+        elem_email.send_keys(email)
+        elem_pw = self._driver.find_element_by_xpath("//input[@placeholder='Password']")
+        elem_pw.clear()
+        elem_pw.send_keys(password)
+        elem = self._driver.find_elements_by_xpath("//button[@class='btn btn-primary btn-lg']")
+        for e in elem:
+            if e.text == "Log In":
+                elem = e
+        elem.click()
+
+    def _homepage(self):
+        """
+        navigates to "the hiking project"'s homepage
+        """
+        self._driver.get(HP_URL)
+
+    def trail_urls(self, country: str) -> list:
+        """
+        return a list of urls (strings) for tracks in the given country
+        """
+        import selenium.common
+        print("-- collecting urls")
+
+        self._homepage()
+        query = "//a[@title='" + country + "']"
+        elem = self._driver.find_element_by_xpath(query)
+        url = elem.get_attribute("href")
+        self._driver.get(url)
+        # driver is not at page with data on paths in <name>
+        # loop makes page show all trails in <name>
+
+        while True:
+            try:
+                show_more = self._driver.find_element_by_xpath("//button[@id='load-more-trails']")
+                show_more.click()
+            except selenium.common.exceptions.NoSuchElementException:
+                break
+        trail_elements = self._driver.find_elements_by_xpath("//tr[@class='trail-row']")
+        trail_urls = []
+        for i in range(len(trail_elements)):
+            trail_urls.append(trail_elements[i].get_attribute("data-href"))
+        return trail_urls
+
+    def get_track(self, url: str, gpx_path: str) -> tuple:
+        """
+        gets the data of a trail page, and downloads its gpx file to gpx_path (if it isn't there yet).
+        :return: (track_dif, track_length, track_shape, features), the name of the gpx file on the website (None if
+        it wasn't downloaded).
+        """
+        self._driver.get(url)
+        e = self._driver.find_elements_by_xpath("//div[@class='stat-block mx-1 pb-2']")[0]
+        track_dif, track_length, track_shape = parse_stats(e.text)
+        try:
+            features_element = self._driver.find_element_by_xpath("//span[@class='font-body pl-half']")
+            features = parse_features(features_element.text)
+        except:  # basically should only fail when a page doesnt have features
+            features = []
+
+        filename = None
+        if not os.path.exists(gpx_path):  # if gpx file hasn't been downloaded before
+            before = os.listdir(self._download_dir)
+            self._driver.find_element_by_link_text("GPX File").click()
+            after = os.listdir(self._download_dir)
+            change = set(after) - set(before)
+            filename = change.pop()
+            dup_file = re.findall(r'.*\(\d+\)\.gpx', filename)
+
+            # handles the case we've just saved dup file, due to connection problems at last connection:
+            # NOTE: does NOT handle the case of multiple dup files saved due to reoccurring connection problems
+            # at the exact same spot (although it's not likely to happen).
+            # it deletes only the file we've saved in this current connection.
+            if dup_file:
+                os.remove(os.path.join(self._download_dir, filename))  # delete duplicate
+                filename = re.sub(r'\(\d+\)\.gpx', '', filename) + ".gpx"  # work with the original one
+            os.rename(os.path.join(self._download_dir, filename), gpx_path)
+        return (track_dif, track_length, track_shape, features), filename
+
+    def close(self):
+        self._driver.quit()
+
+
+BACKENDS = {'http': HttpBackend, 'selenium': SeleniumBackend}
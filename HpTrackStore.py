@@ -0,0 +1,121 @@
+"""
+A log-structured store for the crawled HikingProject tracks, grouped in buckets by their length tag (see slopeMap).
+Every bucket is kept in two files under the store's directory:
+ (1) <len_tag>.log: an append-only log, one json line per saved track: {<track name>: <track representation>}.
+     Saving a track appends a line, so its cost doesn't depend on the size of the bucket.
+ (2) <len_tag>.json: the compacted bucket, a single dict mapping the tracks names to their representations (the same
+     format the buckets were saved in before the log was added).
+Once a log holds COMPACT_EVERY records it is compacted: merged into the bucket's json file (replaced atomically), and
+then deleted. Readers merge the json file with the log, so compaction never changes what they see. A partly written
+last line (a crash in the middle of an append) is ignored.
+"""
+
+import json
+import os
+
+COMPACT_EVERY = 500  # The number of records a log may hold before it's compacted.
+LOG_SUFFIX = '.log'
+COMPACT_SUFFIX = '.json'
+
+
+class HpTrackStore:
+    """
+    Reads and writes the length buckets of the HikingProject tracks.
+    """
+
+    def __init__(self, tracks_dir: str, compact_every=COMPACT_EVERY):
+        """
+        :param tracks_dir: the directory the buckets are saved in.
+        :param compact_every: the number of records a log may hold before it's compacted.
+        """
+        self.tracks_dir = tracks_dir
+        self.compact_every = compact_every
+        self._log_sizes = {}  # The number of records in the log of every bucket this object appended to.
+
+    def _get_paths(self, len_tag) -> tuple:
+        """
+        :return: the paths of the log and of the compacted file of the given bucket.
+        """
+        return os.path.join(self.tracks_dir, str(len_tag) + LOG_SUFFIX), \
+            os.path.join(self.tracks_dir, str(len_tag) + COMPACT_SUFFIX)
+
+    @staticmethod
+    def _read_log(log_path: str) -> list:
+        """
+        :return: the records of the log in the given path (an empty list if there's no such log).
+        """
+        records = []
+        if not os.path.exists(log_path):
+            return records
+        with open(log_path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:  # a line that was only partly written (a crash in the middle of an append).
+                    continue
+        return records
+
+    def load(self, len_tag) -> dict:
+        """
+        :param len_tag: the length tag of the bucket.
+        :return: all of the tracks of the bucket: {<track name>: <track representation>}
+        """
+        log_path, compact_path = self._get_paths(len_tag)
+        tracks = {}
+        if os.path.exists(compact_path):
+            with open(compact_path, 'r') as f:
+                tracks = json.load(f)
+        for record in self._read_log(log_path):
+            tracks.update(record)
+        return tracks
+
+    def append(self, len_tag, track_dict: dict):
+        """
+        Saves tracks to a bucket (compacting its log, if it's full).
+        :param len_tag: the length tag of the bucket.
+        :param track_dict: {<track name>: <track representation>}
+        """
+        if not os.path.exists(self.tracks_dir):
+            os.makedirs(self.tracks_dir)
+        len_tag = str(len_tag)
+        log_path, _ = self._get_paths(len_tag)
+        prefix = ''
+        if len_tag not in self._log_sizes:
+            self._log_sizes[len_tag] = len(self._read_log(log_path))
+            if os.path.exists(log_path) and os.path.getsize(log_path) > 0:
+                with open(log_path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':  # ends with a partly written line, the new record starts a line of its own.
+                        prefix = '\n'
+
+        with open(log_path, 'a') as f:
+            f.write(prefix + json.dumps(track_dict) + '\n')
+        self._log_sizes[len_tag] += 1
+        if self._log_sizes[len_tag] >= self.compact_every:
+            self.compact(len_tag)
+
+    def compact(self, len_tag):
+        """
+        Merges the log of a bucket into its compacted file.
+        """
+        log_path, compact_path = self._get_paths(len_tag)
+        if not os.path.exists(log_path):
+            return
+        tracks = self.load(len_tag)
+        tmp_path = compact_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(tracks, f)
+        os.replace(tmp_path, compact_path)
+        # If the run stops here, the log is merged again by the next compaction, which changes nothing.
+        os.remove(log_path)
+        self._log_sizes[str(len_tag)] = 0
+
+    def compact_all(self):
+        """
+        Compacts the logs of all of the buckets.
+        """
+        if not os.path.exists(self.tracks_dir):
+            return
+        for filename in os.listdir(self.tracks_dir):
+            if filename.endswith(LOG_SUFFIX):
+                self.compact(filename[:-len(LOG_SUFFIX)])
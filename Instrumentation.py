@@ -0,0 +1,138 @@
+"""
+A lightweight instrumentation layer for the data base builds: the build's code marks its stages (downloading, parsing
+the gpx files, computing the tracks metrics...) with BuildProfiler.stage, and the profiler records for every stage:
+ (1) calls: the number of times the stage ran.
+ (2) items: the number of items (pages, segments, tracks...) it handled.
+ (3) wall_seconds and cpu_seconds: the total wall-clock time and cpu time (of this process) it took.
+ (4) peak_memory_mb: the peak of the memory allocated by python during the stage (only with trace_memory, which slows
+     the build down).
+ (5) histogram: the distribution of the durations of its calls (only with histograms, for stages that run per track).
+Stages may be nested (for example the elevation sampling inside the difficulty prediction): the time of a stage
+includes the time of its sub stages. Optionally, every stage is also profiled with cProfile, and the profiles are
+dumped to <profile_dir>/<stage>.prof (they can be read with pstats or snakeviz).
+"""
+
+import cProfile
+import math
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+HISTOGRAM_BINS_MS = [0.1, 1, 10, 100, 1000, 10000]  # The upper limits of the histograms bins (the last is unbounded).
+
+
+class BuildProfiler:
+    """
+    Records the time, cpu time, items count and memory of the stages of a build.
+    """
+
+    def __init__(self, histograms=False, trace_memory=False, profile=False):
+        """
+        :param histograms: if True, the duration of every call of every stage is kept, for the histograms.
+        :param trace_memory: if True, the peak memory of every stage is measured (with tracemalloc).
+        :param profile: if True, every stage is profiled with cProfile (see save_profiles).
+        """
+        self.histograms = histograms
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.stages = {}  # {stage name: its record}
+        self._open = []  # The stages running now, innermost last: [stage name, peak memory of its sub stages]
+
+    def _get_record(self, name: str) -> dict:
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'items': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                 'peak_memory_mb': None, 'durations': [], 'profiler': None}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str, items=0):
+        """
+        Records the code inside the with block as a run of the given stage.
+        :param name: the stage's name.
+        :param items: the number of items the run handles (more can be added with add_items).
+        """
+        record = self._get_record(name)
+        record['items'] += items
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if self._open:  # the enclosing stage's peak so far would be lost by the reset.
+                self._open[-1][1] = max(self._open[-1][1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if self.profile:
+            if self._open:  # only one profiler can run at a time: the enclosing stage's pauses.
+                self.stages[self._open[-1][0]]['profiler'].disable()
+            if record['profiler'] is None:
+                record['profiler'] = cProfile.Profile()
+            record['profiler'].enable()
+        self._open.append([name, 0])
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall_start
+            record['wall_seconds'] += wall
+            record['cpu_seconds'] += time.process_time() - cpu_start
+            record['calls'] += 1
+            if self.histograms:
+                record['durations'].append(wall)
+            _, sub_stages_peak = self._open.pop()
+            if self.profile:
+                record['profiler'].disable()
+                if self._open:
+                    self.stages[self._open[-1][0]]['profiler'].enable()
+            if self.trace_memory:
+                # the sub stages reset the peak, so the stage's peak is the largest of its own before them, theirs, and its
+                # own since:
+                peak = max(tracemalloc.get_traced_memory()[1], sub_stages_peak)
+                record['peak_memory_mb'] = max(record['peak_memory_mb'] or 0, peak / 2 ** 20)
+                if self._open:
+                    self._open[-1][1] = max(self._open[-1][1], peak)
+
+    def add_items(self, name: str, items: int):
+        """
+        Adds items to the count of the given stage.
+        """
+        self._get_record(name)['items'] += items
+
+    @staticmethod
+    def get_histogram(durations: list) -> dict:
+        """
+        :param durations: the durations of the calls of a stage, in seconds.
+        :return: {'bins_ms': the upper limits of the bins, 'counts': the number of calls in every bin (the last bin
+        counts the calls longer than the last limit), 'p50_ms', 'p90_ms', 'max_ms'}
+        """
+        durations_ms = sorted(duration * 1000 for duration in durations)
+        counts = [0] * (len(HISTOGRAM_BINS_MS) + 1)
+        for duration in durations_ms:
+            counts[next((i for i, limit in enumerate(HISTOGRAM_BINS_MS) if duration <= limit),
+                        len(HISTOGRAM_BINS_MS))] += 1
+
+        def percentile(p):
+            return durations_ms[min(int(math.ceil(p * len(durations_ms))) - 1, len(durations_ms) - 1)]
+        return {'bins_ms': HISTOGRAM_BINS_MS, 'counts': counts, 'p50_ms': percentile(0.5),
+                'p90_ms': percentile(0.9), 'max_ms': durations_ms[-1]}
+
+    def report(self) -> dict:
+        """
+        :return: the records of the stages, in the order they first ran: {stage name: {'calls', 'items',
+        'wall_seconds', 'cpu_seconds', 'peak_memory_mb' (if traced), 'histogram' (if kept)}}
+        """
+        report = {}
+        for name, record in self.stages.items():
+            report[name] = {key: record[key] for key in ['calls', 'items', 'wall_seconds', 'cpu_seconds']}
+            if record['peak_memory_mb'] is not None:
+                report[name]['peak_memory_mb'] = record['peak_memory_mb']
+            if record['durations']:
+                report[name]['histogram'] = self.get_histogram(record['durations'])
+        return report
+
+    def save_profiles(self, profile_dir: str):
+        """
+        Dumps the cProfile profile of every stage to <profile_dir>/<stage>.prof
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        for name, record in self.stages.items():
+            if record['profiler'] is not None:
+                record['profiler'].dump_stats(os.path.join(profile_dir, name + '.prof'))
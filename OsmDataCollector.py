@@ -1,14 +1,40 @@
 import os
+import json
+import math
+import hashlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from DownloadCache import DownloadCache
+from Downloader import Downloader
+from DuplicateDetector import DuplicateDetector
+from Instrumentation import BuildProfiler
 from OsmTrack import OsmTrack
 from PointTag import PointTag
+from ProximityRaster import AreaRasters
 import slopeMap as sm
 import gpxpy.gpx
-import wget
-import shutil
-import pandas as pd
-import overpy
+import numpy as np
 
 DIR_PATH = 'files\\traces'
+# The servers the data is downloaded from. They can be pointed at a local stand-in server (see
+# Benchmarks/fixture_server) through the environment:
+OSM_API_URL = os.environ.get('OSM_API_URL', 'https://api.openstreetmap.org/api/0.6/')
+OVERPASS_URL = os.environ.get('OVERPASS_URL', 'https://overpass-api.de/api/interpreter')
+OVERPASS_TILE_DEGREES = 0.5  # Larger boxes are queried tile by tile, so every query stays small enough for Overpass.
+
+# The interest points of every tag are the nodes having an osm key (with a certain value, if it isn't None).
+# For more information: https://wiki.openstreetmap.org/wiki/Map_Features
+INTEREST_POINTS_PREDICATES = [(PointTag.HISTORIC, 'historic', None), (PointTag.WATERFALL, 'waterway', 'waterfall'),
+                              (PointTag.WATER, 'natural', 'water'), (PointTag.BIRDING, 'leisure', 'bird_hide'),
+                              (PointTag.CAVE, 'natural', 'cave_entrance'), (PointTag.GEOLOGIC, 'geological', None),
+                              (PointTag.RIVER, 'waterway', 'river'), (PointTag.SPRING, 'natural', 'spring')]
+
+InterestPoint = namedtuple('InterestPoint', ['lat', 'lon'])
+
+MIN_POINTS = 50  # Segments with fewer gps points are dismissed.
+HAVERSINE_SLACK = 0.99  # The haversine distances may be up to 0.5% longer than the geodesic ones, they are scaled down.
+# The filters of the segments, from the cheapest to the most expensive (see _prefilter):
+FILTER_STAGES = ['private', 'points', 'step_speed', 'full_metrics']
 
 
 class OsmDataCollector:
@@ -18,23 +44,52 @@ class OsmDataCollector:
     (viewpoints, waterways, historic places etc.)
     """
 
-    def __init__(self, bounding_box: list, speed_limit=12, shing_length=1, wanted_files=10):
+    def __init__(self, bounding_box: list, speed_limit=12, shing_length=1, wanted_files=10, traces_dir=DIR_PATH,
+                 refresh=True, known_pages=None, known_track_ids=None, cache=None, downloader=None,
+                 collapse_duplicates=True, profiler=None, stream=False, rasters_dir=None):
         """
         :param bounding_box: A tuple of the form: (West, South, East, North). The bounding box of some area is available
-        :param speed_limit: all tracks who's average speed is above speed_limit would not be collected.
-        :param wanted_files: the number of wanted gpx data files to download from OpenStreetMap.
         in: https://www.openstreetmap.org/#map=12/48.5490/8.3191 (search the desired place, and press "export")
         For example:  [2.3295, 48.8586, 2.3422, 48.8636] is the bounding box representing the area of the Louvre museum.
+        :param speed_limit: all tracks who's average speed is above speed_limit would not be collected.
+        :param wanted_files: the number of wanted gpx data files to download from OpenStreetMap.
+        :param traces_dir: the directory the gpx files are downloaded to.
+        :param refresh: if False, gpx files that were already downloaded to traces_dir are not downloaded again.
+        :param known_pages: a dictionary {page index: hash} of the gpx files processed in a previous run. Pages whose
+        content didn't change since are not parsed again.
+        :param known_track_ids: the ids of the segments processed in a previous run (collected or dismissed). They are
+        skipped, so self.tracks holds only new tracks.
+        :param cache: the DownloadCache the gpx files and the interest points are downloaded through (a cache with the
+        default settings if not given).
+        :param downloader: the Downloader the data is downloaded with (one with the default settings if not given).
+        :param collapse_duplicates: if True, near-duplicate segments are collected as a single track.
+        :param profiler: the BuildProfiler the collection's stages are recorded in (see Instrumentation).
+        :param stream: if True, nothing is collected here: the tracks are collected one at a time by iterating
+        iter_tracks() (and are not kept in self.tracks).
+        :param rasters_dir: if given, the tracks are tagged by proximity rasters of the interest points (see
+        ProximityRaster), which are saved in (and reused from) this directory, instead of by OsmTrack.is_close.
         """
-        self.id = 0
         self.box = bounding_box
         self.speed_limit = speed_limit
         self.shing_length = shing_length
         self.wanted_files_num = wanted_files
-        self.overpass_api = overpy.Overpass()
+        self.traces_dir = traces_dir
+        self.refresh = refresh
+        self.known_pages = known_pages if known_pages is not None else {}
+        self.known_track_ids = set(known_track_ids) if known_track_ids is not None else set()
+        self.cache = cache if cache is not None else DownloadCache()
+        self.downloader = downloader if downloader is not None else Downloader()
+        self.collapse_duplicates = collapse_duplicates
+        self.profiler = profiler if profiler is not None else BuildProfiler()
+        self.rasters_dir = rasters_dir
         self.interest_points_dict = {}  # Contains the interest points coordinates by tag.
-        self.tracks = []  # A list of OsmTrack objects.
-        self._collect_osm_data()
+        self.proximity_rasters = None  # The AreaRasters of the interest points (if rasters_dir is given).
+        self.tracks = []  # A list of OsmTrack objects (empty when streaming).
+        self.pages = {}  # Maps the index of every gpx file of this run to the hash of its content.
+        self.dismissed_track_ids = []  # The ids of the new segments that were not collected (or were collapsed).
+        self.rejections = {stage: 0 for stage in FILTER_STAGES}  # The number of segments every filter dismissed.
+        if not stream:
+            self.tracks = list(self.iter_tracks())
 
     def _create_url(self, file_index: int) -> str:
         """
@@ -43,98 +98,296 @@ class OsmDataCollector:
         :param file_index: The index of file to be retrieved.
         :return: The mentioned http request.
         """
-        url = "https://api.openstreetmap.org/api/0.6/trackpoints?bbox=" \
+        url = OSM_API_URL + "trackpoints?bbox=" \
               + str(self.box[0]) + "," + str(self.box[1]) + "," + str(self.box[2]) + \
               "," + str(self.box[3]) + "&page=" + str(file_index)
         return url
 
+    def _get_page_path(self, file_index: int) -> str:
+        """
+        :return: the path the gpx file with the given index is saved in.
+        """
+        return os.path.join(self.traces_dir, "tracks" + str(file_index) + ".gpx")
+
+    @staticmethod
+    def _get_file_hash(path: str) -> str:
+        """
+        :return: the hash of the content of the file in the given path.
+        """
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _get_gpx_file(self, file_index: int) -> bool:
+        """
+        Downloads one GPX tracks file from OSM (through self.cache), unless it was downloaded before and self.refresh
+        isn't set.
+        :return: True if the file holds any trackpoints.
+        """
+        page_path = self._get_page_path(file_index)
+        if self.refresh or not os.path.exists(page_path):
+            content = self.cache.get('trackpoints', self.box, file_index, self._create_url(file_index),
+                                     fetch=self.downloader.fetch)
+            tmp_path = page_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, page_path)
+        else:
+            with open(page_path, 'rb') as f:
+                content = f.read()
+        return b'<trkpt' in content
+
     def _get_gpx_files(self):
         """
-        Downloads GPX tracks files from OSM.
+        Downloads GPX tracks files from OSM, self.downloader.workers files at a time. OSM returns the traces of the box
+        page after page, so once a page comes back empty there are no more traces: later pages are not downloaded.
+        Pages that are already in the cache are not downloaded again, so an interrupted run resumes where it stopped.
         """
-        if os.path.isdir(DIR_PATH):
-            shutil.rmtree(DIR_PATH)
-        os.makedirs(DIR_PATH)
+        if not os.path.isdir(self.traces_dir):
+            os.makedirs(self.traces_dir)
         print("saving gpx files...")
 
-        for i in range(self.wanted_files_num):
-            url = self._create_url(i)
-            filename = wget.download(url, out=DIR_PATH)
-            os.rename(filename, os.path.join(DIR_PATH, "tracks" + str(i) + ".gpx"))
+        pages_num = self.wanted_files_num  # Lowered to the index of the first empty page, once there is one.
+        next_page = 0
+        errors = {}  # Failures of pages past the first empty page don't matter.
+        with ThreadPoolExecutor(max_workers=self.downloader.workers) as executor:
+            in_flight = {}
+            while in_flight or next_page < pages_num:
+                while next_page < pages_num and len(in_flight) < self.downloader.workers:
+                    in_flight[executor.submit(self._get_gpx_file, next_page)] = next_page
+                    next_page += 1
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page = in_flight.pop(future)
+                    if future.exception() is not None:
+                        errors[page] = future.exception()
+                    elif not future.result():
+                        pages_num = min(pages_num, page)
+        for page in sorted(errors):
+            if page < pages_num:
+                raise errors[page]
 
-    def _collect_filtered_tracks(self):
+        for i in range(pages_num):
+            self.pages[str(i)] = self._get_file_hash(self._get_page_path(i))
+
+    def _prefilter(self, seg, coordinates: np.ndarray):
         """
-        Parses the collected gpx files, and extracts tracks. For each track, the method tests if it's average velocity
-        is lower then 12 km per hour (if so, the track probably describes walking or running), and if its public.
-        Tracks that hold both attributes are saved in self.tracks.
+        Runs the cheap filters of a segment, before its full metrics are computed.
+        step_speed: the average of the speeds of the segment's steps, like OsmTrack.calculate_avg_velocity, but with
+        the haversine distances (vectorized) scaled down by HAVERSINE_SLACK. It's a lower bound of the segment's
+        avg_velocity, so it only dismisses segments the full filter dismisses too.
+        :param seg: a gpxpy segment (public, with at least MIN_POINTS points).
+        :param coordinates: a np array of shape (n, 2) holding the segment's coordinates (lat, lon).
+        :return: the stage that dismissed the segment, or None if it passed all of them.
         """
-        print("saving tracks...")
-        for filename in os.listdir(DIR_PATH):
-            gpx_file = open(os.path.join(DIR_PATH, filename), 'r', encoding="utf8")
+        start = seg.points[0].time
+        seconds = np.array([(p.time - start).total_seconds() if p.time is not None else np.nan for p in seg.points])
+        hours = np.diff(seconds) / 3600
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speeds = np.where(hours > 0, sm.compute_step_kms(coordinates) * HAVERSINE_SLACK / hours, np.nan)
+        if np.isfinite(speeds).any() and np.nanmean(speeds) > self.speed_limit:
+            return 'step_speed'
+        return None
+
+    def _iter_page_segments(self, page: str):
+        """
+        Parses one of the collected gpx files, and goes over its segments.
+        :param page: the index of the gpx file (a key of self.pages).
+        :return: a generator of (location, segment) pairs, where location is (track index, segment index) in the file.
+        """
+        filename = self._get_page_path(int(page))
+        with open(filename, 'r', encoding="utf8") as gpx_file:
             try:
-                gpx = gpxpy.parse(gpx_file)
-                for track in gpx.tracks:
-                    for seg in track.segments:
-                        if seg.points[0].time is None:  # dismisses private segments
-                            continue
-                        if len(seg.points) < 50:
-                            continue
-                        curr_track = OsmTrack(seg, self.id)
-                        self.id += 1
-                        if curr_track.avg_velocity > self.speed_limit or \
-                                curr_track.length < (self.shing_length + 1) * sm.TICK:
-                            continue
-                        self.tracks.append(curr_track)
+                with self.profiler.stage('gpx_parse', items=1):
+                    gpx = gpxpy.parse(gpx_file)
             except gpxpy.gpx.GPXXMLSyntaxException:
                 print('gpx parsing error for' + filename)
+                return
+        for track_index, track in enumerate(gpx.tracks):
+            for segment_index, seg in enumerate(track.segments):
+                yield (track_index, segment_index), seg
 
-    def _get_interest_points(self, node_tag: str) -> pd.DataFrame:
+    def _find_candidates(self):
         """
-        Uses Overpass-API to extract the coordinates of interest points inside self.box.
-        :param node_tag: What kind of interest point should be extracted. For example: "historic".
+        Goes over the collected gpx files (one at a time), and finds the segments that may become tracks: public
+        segments that are new, and that pass the cheap filters (see FILTER_STAGES and _prefilter). Pages that didn't
+        change since the previous run, and segments that were processed before, are skipped.
+        Near-duplicate segments (see DuplicateDetector) are clustered, so only one track is created per cluster.
+        Only the locations of the candidates are kept (the segments themselves are parsed again by iter_tracks), so the
+        memory this takes doesn't grow with the number of points.
+        :return: the clusters of the candidates (lists of ids, in the order they were found), and the locations of the
+        candidates: {page: {(track index, segment index): id}}
+        """
+        seen_ids = set(self.known_track_ids)
+        locations = {}
+        segments_ids = []
+        duplicate_detector = DuplicateDetector()
+        for page, page_hash in self.pages.items():
+            if self.known_pages.get(page) == page_hash:  # nothing new in this page.
+                continue
+            for location, seg in self._iter_page_segments(page):
+                if seg.points[0].time is None:  # dismisses private segments
+                    self.rejections['private'] += 1
+                    continue
+                if len(seg.points) < MIN_POINTS:
+                    self.rejections['points'] += 1
+                    continue
+                track_id = OsmTrack.get_segment_id(seg)
+                if track_id in seen_ids:  # processed in a previous run, or in another page of this run.
+                    continue
+                seen_ids.add(track_id)
+                coordinates = np.array([[p.latitude, p.longitude] for p in seg.points])
+                rejecting_stage = self._prefilter(seg, coordinates)
+                if rejecting_stage is not None:
+                    self.rejections[rejecting_stage] += 1
+                    self.dismissed_track_ids.append(track_id)
+                    continue
+                locations.setdefault(page, {})[location] = track_id
+                segments_ids.append(track_id)
+                if self.collapse_duplicates:
+                    duplicate_detector.add(track_id, coordinates)
+        clusters = list(duplicate_detector.clusters.values()) if self.collapse_duplicates \
+            else [[track_id] for track_id in segments_ids]
+        return clusters, locations
+
+    def iter_tracks(self):
+        """
+        Collects the public gps-tracks in self.box, one at a time: the gpx files and the interest points are downloaded
+        first, and then every track is created, matched with the interest points and yielded on its own, so the caller
+        may save it (and drop it) before the next one is created. The memory the collection takes therefore doesn't
+        grow with the number of tracks.
+        For each candidate segment (see _find_candidates), the method tests if it's average velocity is lower than
+        self.speed_limit (if so, the track probably describes walking or running) and if it's long enough. When a
+        segment fails the test, the next segment of its cluster of near-duplicates is tested instead; the duplicates
+        attribute of the collected track counts the segments of the cluster that come after it.
+        The ids of the dismissed segments (including the collapsed duplicates) are added to self.dismissed_track_ids,
+        and self.rejections counts the segments every stage dismissed.
+        :return: a generator of OsmTrack objects.
+        """
+        with self.profiler.stage('download'):
+            self._get_gpx_files()
+        self.profiler.add_items('download', len(self.pages))
+        self._handle_interest_points()
+
+        print("saving tracks...")
+        clusters, locations = self._find_candidates()
+        clusters_of = {}  # Maps the id of every candidate to its cluster, and its position in the cluster.
+        for cluster in clusters:
+            for position, track_id in enumerate(cluster):
+                clusters_of[track_id] = (cluster, position)
+        collected = set()  # The clusters a track was collected for (by the id of their first segment).
+        tracks_num = 0
+        for page in self.pages:
+            if page not in locations:
+                continue
+            for location, seg in self._iter_page_segments(page):
+                if location not in locations[page]:
+                    continue
+                track_id = locations[page][location]
+                cluster, position = clusters_of[track_id]
+                if cluster[0] in collected:  # collapsed into the track of its cluster.
+                    self.dismissed_track_ids.append(track_id)
+                    continue
+                with self.profiler.stage('track_metrics', items=1):
+                    curr_track = OsmTrack(seg, track_id)
+                if curr_track.avg_velocity > self.speed_limit or \
+                        curr_track.length < (self.shing_length + 1) * sm.TICK:
+                    self.rejections['full_metrics'] += 1
+                    self.dismissed_track_ids.append(track_id)
+                    continue
+                collected.add(cluster[0])
+                curr_track.duplicates = len(cluster) - position - 1
+                self._match_interest_points(curr_track)
+                tracks_num += 1
+                yield curr_track
+        print("dismissed segments by stage: " + json.dumps(self.rejections))
+        print(str(len(clusters_of)) + " new segments, " + str(tracks_num) + " tracks collected")
 
-        For more information:
-        https://wiki.openstreetmap.org/wiki/Map_Features
-        https://towardsdatascience.com/loading-data-from-openstreetmap-with-python-and-the-overpass-api-513882a27fd0
+    def _get_tiles(self) -> list:
+        """
+        Splits self.box into tiles no larger than OVERPASS_TILE_DEGREES on each side.
+        :return: a list of the tiles bounding boxes: [West, South, East, North].
+        """
+        west, south, east, north = self.box
+        lon_steps = max(math.ceil((east - west) / OVERPASS_TILE_DEGREES), 1)
+        lat_steps = max(math.ceil((north - south) / OVERPASS_TILE_DEGREES), 1)
+        lon_limits = np.round(np.linspace(west, east, lon_steps + 1), 7)
+        lat_limits = np.round(np.linspace(south, north, lat_steps + 1), 7)
+        return [[float(lon_limits[i]), float(lat_limits[j]), float(lon_limits[i + 1]), float(lat_limits[j + 1])]
+                for i in range(lon_steps) for j in range(lat_steps)]
 
-        :return: a pandas df (lat, lon) containing the
+    def _get_interest_points(self, tile: list) -> list:
         """
-        print("getting features: " + node_tag)
-        r = self.overpass_api.query("""
-        node(""" + str(self.box[1]) + """,""" + str(self.box[0]) + """,""" + str(self.box[3]) + """,""" +
-                                    str(self.box[2]) + """)[""" + node_tag + """]; out;""")
-        return pd.DataFrame([{'lat': p.lat, 'lon': p.lon} for p in r.nodes])
+        Uses Overpass-API (through self.cache) to extract the interest points of all of the tags inside the given tile,
+        in a single (union) query.
+        For more information: https://wiki.openstreetmap.org/wiki/Overpass_API/Overpass_QL#Union
+        :param tile: a bounding box: [West, South, East, North].
+        :return: a list of the osm nodes, as returned by Overpass: {'id': ..., 'lat': ..., 'lon': ..., 'tags': {...}}
+        """
+        box = "(" + str(tile[1]) + "," + str(tile[0]) + "," + str(tile[3]) + "," + str(tile[2]) + ")"
+        statements = ""
+        for tag, key, value in INTEREST_POINTS_PREDICATES:
+            statements += 'node["' + key + '"' + ('="' + value + '"' if value is not None else '') + ']' + box + ';'
+        query = "[out:json];(" + statements + "); out;"
+        content = self.cache.get('overpass', tile, query, OVERPASS_URL, query.encode('utf8'),
+                                 fetch=self.downloader.fetch)
+        return [element for element in json.loads(content)['elements'] if element['type'] == 'node']
 
-    def _match_interest_points_to_tracks(self, interest_points: pd.DataFrame, tag: PointTag):
+    def _match_interest_points(self, track: OsmTrack):
         """
-        Attaches to each track the interest points that are geographically close to it.
-        :param interest_points: A pandas data frame (lat, lon) containing the coordinates of the interest points.
-        :param tag: an Enum representing the type of the interest point.
+        Attaches to the track the tags of the interest points that are geographically close to it. When there are
+        proximity rasters, the track's points are looked up in them. Otherwise, only the interest points inside the
+        track's boundaries can be close to it (see OsmTrack.is_close), and they are found by a binary search in the
+        points of every tag, which are sorted by their latitude (see _handle_interest_points).
         """
-        for track in self.tracks:
-            for index, point in interest_points.iterrows():
-                if track.is_close(point):
+        if self.proximity_rasters is not None:
+            coordinates = track.gps_points[['lat', 'lon']].to_numpy(dtype=np.float64)
+            with self.profiler.stage('interest_points_matching', items=len(coordinates)):
+                for tag in self.proximity_rasters.get_track_tags(coordinates):
                     track.add_interest_point(tag)
+            return
 
-    def _handle_interest_points(self):
+        for tag, interest_points in self.interest_points_dict.items():
+            first = np.searchsorted(interest_points[:, 0], track.boundaries['south'], side='left')
+            last = np.searchsorted(interest_points[:, 0], track.boundaries['north'], side='right')
+            candidates = interest_points[first:last]
+            candidates = candidates[(track.boundaries['west'] <= candidates[:, 1]) &
+                                    (candidates[:, 1] <= track.boundaries['east'])]
+            with self.profiler.stage('interest_points_matching', items=len(candidates)):
+                for lat, lon in candidates:
+                    if track.is_close(InterestPoint(lat, lon)):
+                        track.add_interest_point(tag)
+                        break  # The track already has this tag.
+
+    @staticmethod
+    def split_interest_points(nodes) -> dict:
         """
-        Gets interest points of all categories, and attaches them to the correct tracks.
+        :param nodes: osm nodes, as returned by Overpass (see _get_interest_points).
+        :return: the coordinates of the nodes by tag: {tag: a np array of shape (n, 2): (lat, lon)}, where the points of
+        every tag are sorted by their latitude.
         """
-        query_list = [""" "historic" """, """ "waterway" = "waterfall" """, """ "natural" = "water" """,
-                      """ "leisure" = "bird_hide" """, """ "natural" = "cave_entrance" """, """ "geological" """,
-                      """ "waterway" = "river" """, """ "natural" = "spring" """]
-        tags = [PointTag.HISTORIC, PointTag.WATERFALL, PointTag.WATER, PointTag.BIRDING, PointTag.CAVE,
-                PointTag.GEOLOGIC, PointTag.RIVER, PointTag.SPRING]
-        for query, tag in zip(query_list, tags):
-            interest_points = self._get_interest_points(query)
-            self.interest_points_dict[tag] = interest_points
-            self._match_interest_points_to_tracks(interest_points, tag)
+        interest_points_dict = {}
+        for tag, key, value in INTEREST_POINTS_PREDICATES:
+            interest_points = np.array([[node['lat'], node['lon']] for node in nodes
+                                        if key in node.get('tags', {}) and
+                                        (value is None or node['tags'][key] == value)], dtype=np.float64).reshape(-1, 2)
+            interest_points_dict[tag] = interest_points[np.argsort(interest_points[:, 0], kind='stable')]
+        return interest_points_dict
 
-    def _collect_osm_data(self):
+    def _handle_interest_points(self):
         """
-        Collects the public gps-tracks in self.box and creates corresponding OsmTracks objects, using additional
-        geographic data collected from the map (interest points).
+        Gets the interest points of all categories, by tag, into self.interest_points_dict. The points of every tag are
+        sorted by their latitude, so the points near a track are found quickly (see _match_interest_points). If
+        self.rasters_dir is given, the tracks are tagged by their proximity rasters, which are computed (or loaded, if
+        they didn't change) tile by tile, as the tracks need them (see AreaRasters).
         """
-        self._get_gpx_files()
-        self._collect_filtered_tracks()
-        self._handle_interest_points()
+        print("getting features...")
+        nodes = {}  # Nodes on the border of two tiles are returned by both.
+        for tile in self._get_tiles():
+            with self.profiler.stage('download', items=1):
+                tile_nodes = self._get_interest_points(tile)
+            for node in tile_nodes:
+                nodes[node['id']] = node
+
+        self.interest_points_dict = self.split_interest_points(nodes.values())
+        if self.rasters_dir is not None:
+            self.proximity_rasters = AreaRasters(self.rasters_dir, self.interest_points_dict, profiler=self.profiler)
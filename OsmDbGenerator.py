@@ -1,19 +1,54 @@
 """
 This class generates a "data base" (a folder) containing all of the data we collected over osm-tracks in the
 supported geographic search areas.
+
+The data base is updated incrementally: a manifest in every area's folder records the gpx pages and the tracks that were
+processed, so a later run processes only new or changed segments and merges them into the existing data base. Every
+backend has its own manifest (see get_manifest_name), so building an area with another backend processes all of its
+tracks again.
+Run with --rebuild to delete the data base and generate it from scratch.
+
+The tracks are saved either in a json file and a geometry store (the default 'json' backend), or in an SQLite data base
+with a spatial index (the 'sqlite' backend, see SqliteAreaDb), or partitioned into spatial tiles that are read only
+when a query's limits intersect them (the 'tiled' backend, for country-scale areas, see TiledAreaDb).
+
+The tracks are tagged with the interest points near them by proximity rasters of the interest points (the default
+'raster' matching, see ProximityRaster), which are kept in the area's folder and reused while the interest points don't
+change, or by the exact distance of every interest point from the track (--matching exact).
+
+The supported areas are read from the areas registry (see AreaRegistry). The areas are built concurrently by a pool of
+worker processes, and the outcome of every area (or the error it failed with) is written to a build report. The report
+also holds the time, cpu time and items count of every stage of every area's build (see Instrumentation), optionally
+with histograms of the per-track durations (--histograms) and the peak memory of the stages (--trace-memory).
+--profile-dir DIR also dumps a cProfile profile of every stage to DIR\\<area>\\<stage>.prof
 """
 
 from OsmDataCollector import OsmDataCollector
+from AreaRegistry import load_areas
+from DownloadCache import DownloadCache
+from Instrumentation import BuildProfiler
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
 import json
+import time
+import traceback
 from EvaluateDifficulty import DifficultyEvaluator
+from GeometryStore import GeometryStoreWriter
+from SqliteAreaDb import SqliteAreaDb, DB_FILE_SUFFIX
+from TiledAreaDb import TiledAreaDb, TILES_DIR_NAME
+from ProximityRaster import RASTERS_DIR_NAME
 import os
 import shutil
 
-COORS_DIR_PATH = '\\tracks_gps_points\\'
 AREAS_DIR_PATH = 'areas_databases\\'
 TILES_PATH = 'supported_areas_tiles\\'
+TRACES_DIR_PATH = 'files\\traces\\'
+MANIFEST_FILE_NAME = 'manifest.json'  # The manifest of the json backend (see get_manifest_name).
+REPORT_FILE_NAME = 'build_report.json'
 SHING_ELEM_NUM = 2
 K_NEIGHBORS = 25
+BACKENDS = ['json', 'sqlite', 'tiled']
+MATCHING = ['raster', 'exact']  # How the tracks are tagged with the interest points near them.
 
 
 class OsmDbGenerator:
@@ -21,53 +56,201 @@ class OsmDbGenerator:
     Generates a JSON file with osm-tracks data for each one of the supported search areas.
     """
 
-    def __init__(self):
+    def __init__(self, backend='json', supported_areas=None, offline=False, histograms=False, trace_memory=False,
+                 profile_dir=None, matching='raster'):
+        """
+        :param backend: how the data base of every area is saved, one of BACKENDS.
+        :param supported_areas: the areas to generate, of the form {area name: {'box': ..., 'corner': ..., 'tile': ...}}
+        (all of the areas in the areas registry by default).
+        :param offline: if True, the osm data is read only from the download cache (see DownloadCache).
+        :param histograms: if True, the build report holds histograms of the durations of the per-track stages.
+        :param trace_memory: if True, the build report holds the peak memory of every stage (slows the build down).
+        :param profile_dir: if given, a cProfile profile of every stage is saved under it (see Instrumentation).
+        :param matching: how the tracks are tagged with the interest points near them, one of MATCHING.
+        """
+        assert backend in BACKENDS and matching in MATCHING
+        self.backend = backend
+        self.offline = offline
+        self.histograms = histograms
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.matching = matching
         # The Coordinated of the bounding boxes of the supported search areas:
-        self.supported_areas = {
-            'baiersbronn': {'box': [8.1584, 48.4688, 8.4797, 48.6291],
-                            'corner': [48, 8],
-                            'tile': 'N48E008'}  # More areas in the future.
-        }
+        self.supported_areas = load_areas() if supported_areas is None else supported_areas
 
     @staticmethod
-    def _create_dir(dir_name: str):
+    def _create_dir(dir_name: str, clear=True):
         """
         Creates a directory with the given name.
+        :param clear: if True, the directory is emptied if it already exists.
         """
-        if os.path.isdir(dir_name):
+        if clear and os.path.isdir(dir_name):
             shutil.rmtree(dir_name)
-        os.makedirs(dir_name)
+        os.makedirs(dir_name, exist_ok=True)
+
+    @staticmethod
+    def _load_json(path: str, default: dict) -> dict:
+        """
+        :return: the dictionary saved in the json file in the given path, or default if there is no such file.
+        """
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _save_json(dictionary: dict, path: str, indent=None):
+        """
+        Saves the dictionary to the given path, replacing the previous file only once the new one is complete.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(dictionary, f, indent=indent)
+        os.replace(tmp_path, path)
+
+    def create_osm_db(self, rebuild=False, workers=1) -> dict:
+        """
+        Creates (or updates) a json with osm tracks data for every supported area.
+        A failure in one area doesn't stop the others: it is recorded in the build report.
+        :param rebuild: if True, the existing data bases are deleted and all of the tracks are processed again.
+        :param workers: the number of areas built concurrently (each in its own process).
+        :return: the build report: {area name: {'status': 'ok', 'new_tracks': n, 'seconds': t, 'stages': {...}} or
+        {'status': 'failed', 'error': message, 'traceback': ..., 'seconds': t, 'stages': {...}}}, where stages is the
+        report of the area's BuildProfiler (see Instrumentation).
+        """
+        self._create_dir(AREAS_DIR_PATH, clear=False)
+
+        report = {}
+        if workers <= 1:
+            for area_name in self.supported_areas:
+                report[area_name] = self._build_area(area_name, rebuild)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(self._build_area, area_name, rebuild): area_name
+                           for area_name in self.supported_areas}
+                for future in as_completed(futures):
+                    report[futures[future]] = future.result()
+
+        self._save_json(report, os.path.join(AREAS_DIR_PATH, REPORT_FILE_NAME), indent=4)
+        failed = [area_name for area_name in report if report[area_name]['status'] != 'ok']
+        print(str(len(report) - len(failed)) + " areas built, " + str(len(failed)) + " failed" +
+              (": " + ", ".join(failed) if failed else ""))
+        return report
+
+    def _build_area(self, area_name: str, rebuild: bool) -> dict:
+        """
+        Creates (or updates) the data base of a single area, and reports how it went.
+        :return: the area's entry in the build report (see create_osm_db).
+        """
+        start = time.time()
+        profiler = BuildProfiler(self.histograms, self.trace_memory, profile=self.profile_dir is not None)
+        try:
+            new_tracks = self._create_area_db(area_name, rebuild, profiler)
+        except Exception as e:  # reported, so the other areas are still built.
+            print(area_name + " failed: " + repr(e))
+            return {'status': 'failed', 'error': repr(e), 'traceback': traceback.format_exc(),
+                    'seconds': time.time() - start, 'stages': profiler.report()}
+        finally:
+            if self.profile_dir is not None:
+                profiler.save_profiles(os.path.join(self.profile_dir, area_name))
+        return {'status': 'ok', 'new_tracks': new_tracks, 'seconds': time.time() - start,
+                'stages': profiler.report()}
+
+    @staticmethod
+    def get_manifest_name(backend: str) -> str:
+        """
+        :param backend: one of BACKENDS.
+        :return: the file name of the manifest of the tracks saved with the given backend: manifest.json for the json
+        backend (as before there were other backends), and manifest.<backend>.json for the others.
+        """
+        return MANIFEST_FILE_NAME if backend == 'json' else 'manifest.' + backend + '.json'
 
-    def create_osm_db(self):
+    def _create_area_db(self, area_name: str, rebuild: bool, profiler: BuildProfiler) -> int:
         """
-        Creates a json with osm tracks data.
+        Creates (or updates) the data base of a single area.
+        :param profiler: the BuildProfiler the stages of the build are recorded in.
+        :return: the number of new tracks added to the area's data base.
         """
-        self._create_dir(AREAS_DIR_PATH)
+        diff_evaluator = DifficultyEvaluator(TILES_PATH + self.supported_areas[area_name]['tile'] + '.hgt',
+                                             self.supported_areas[area_name]['corner'],
+                                             SHING_ELEM_NUM, profiler)
 
-        for area_name in self.supported_areas:
+        area_dir_name = AREAS_DIR_PATH + area_name
+        db_path = area_dir_name + '\\' + area_name + "_db.json"
+        manifest_path = os.path.join(area_dir_name, self.get_manifest_name(self.backend))
+        self._create_dir(area_dir_name, clear=rebuild)
 
-            diff_evaluator = DifficultyEvaluator(TILES_PATH + self.supported_areas[area_name]['tile'] + '.hgt',
-                                                 self.supported_areas[area_name]['corner'],
-                                                 SHING_ELEM_NUM)
+        # What was processed in previous runs (empty when the area is new):
+        manifest = self._load_json(manifest_path, {'pages': {}, 'tracks': [], 'dismissed': []})
 
-            area_dir_name = AREAS_DIR_PATH + area_name
-            area_coor_dir_name = area_dir_name + COORS_DIR_PATH
+        area_osm_data = OsmDataCollector(self.supported_areas[area_name]['box'], shing_length=SHING_ELEM_NUM,
+                                         wanted_files=50, traces_dir=TRACES_DIR_PATH + area_name,
+                                         known_pages=manifest['pages'],
+                                         known_track_ids=manifest['tracks'] + manifest['dismissed'],
+                                         cache=DownloadCache(offline=self.offline), profiler=profiler, stream=True,
+                                         rasters_dir=os.path.join(area_dir_name, RASTERS_DIR_NAME)
+                                         if self.matching == 'raster' else None)
 
-            self._create_dir(area_dir_name)
-            self._create_dir(area_coor_dir_name)
+        # Every track is saved as soon as it's collected (and then dropped), so only one track is held in memory:
+        new_track_ids = []
+        if self.backend != 'json':
+            # sqlite adds all of the new tracks in a single transaction, and tiled saves its tiles on closing:
+            area_db = SqliteAreaDb(os.path.join(area_dir_name, area_name + DB_FILE_SUFFIX)) \
+                if self.backend == 'sqlite' else TiledAreaDb(os.path.join(area_dir_name, TILES_DIR_NAME))
+            with area_db:
+                for track in area_osm_data.iter_tracks():
+                    with profiler.stage('difficulty_knn', items=1):
+                        track.difficulty = diff_evaluator.pred_difficulty(track, K_NEIGHBORS)
+                    with profiler.stage('serialization', items=1):
+                        area_db.add_track(track.id, track.get_dict_repr(), track.gps_points)
+                    new_track_ids.append(track.id)
+        else:
+            tracks_dict = self._load_json(db_path, {'tracks': {}})
+            with GeometryStoreWriter(area_dir_name) as geometry_writer:
+                for track in area_osm_data.iter_tracks():
+                    with profiler.stage('difficulty_knn', items=1):
+                        track.difficulty = diff_evaluator.pred_difficulty(track, K_NEIGHBORS)
+                    with profiler.stage('serialization', items=1):
+                        tracks_dict['tracks'][track.id] = track.get_dict_repr()
+                        geometry_writer.add(track.id, track.gps_points)
+                    new_track_ids.append(track.id)
+            with profiler.stage('serialization'):
+                self._save_json(tracks_dict, db_path, indent=4)
+        print(area_name + ": " + str(len(new_track_ids)) + " new tracks")
 
-            area_osm_data = OsmDataCollector(self.supported_areas[area_name]['box'], shing_length=SHING_ELEM_NUM,
-                                             wanted_files=50)
-            tracks_dict = {'tracks': {}}
-            for track in area_osm_data.tracks:
-                difficulty = diff_evaluator.pred_difficulty(track, K_NEIGHBORS)
-                track.difficulty = difficulty
-                tracks_dict['tracks'][track.id] = track.get_dict_repr()
-                track.gps_points.to_csv(area_coor_dir_name + str(track.id))
-            with open(area_dir_name + '\\' + area_name + "_db.json", "w") as write_file:
-                json.dump(tracks_dict, write_file, indent=4)
+        # The manifest is saved last, so tracks are never marked as processed before they were saved:
+        manifest['pages'].update(area_osm_data.pages)
+        manifest['tracks'] += new_track_ids
+        manifest['dismissed'] += area_osm_data.dismissed_track_ids
+        self._save_json(manifest, manifest_path)
+        return len(new_track_ids)
 
 
 if __name__ == '__main__':
-    OsmDbGenerator = OsmDbGenerator()
-    OsmDbGenerator.create_osm_db()
+    arg_parser = argparse.ArgumentParser(description='Generates (or updates) the osm data base of the supported areas.')
+    arg_parser.add_argument("--rebuild", help="delete the existing data base and generate it from scratch.",
+                            action='store_true')
+    arg_parser.add_argument("--backend", help="how the data base of every area is saved.", choices=BACKENDS,
+                            default='json')
+    arg_parser.add_argument("--workers", help="the number of areas built concurrently.", type=int,
+                            default=os.cpu_count())
+    arg_parser.add_argument("--offline", help="use only osm data that is already in the download cache.",
+                            action='store_true')
+    arg_parser.add_argument("--areas", help="build only these areas (of the areas registry).", nargs='+')
+    arg_parser.add_argument("--histograms", help="report histograms of the durations of the per-track stages.",
+                            action='store_true')
+    arg_parser.add_argument("--trace-memory", help="report the peak memory of every stage (slows the build down).",
+                            action='store_true')
+    arg_parser.add_argument("--profile-dir", help="save a cProfile profile of every stage of every area under this "
+                                                  "directory.")
+    arg_parser.add_argument("--matching", help="how the tracks are tagged with the interest points near them.",
+                            choices=MATCHING, default='raster')
+    command_line_args = arg_parser.parse_args()
+    registry = load_areas()
+    if command_line_args.areas:
+        registry = {area_name: registry[area_name] for area_name in command_line_args.areas}
+    # (not bound to the class' name, so the workers can still unpickle the generator's methods)
+    generator = OsmDbGenerator(command_line_args.backend, registry, command_line_args.offline,
+                               command_line_args.histograms, command_line_args.trace_memory,
+                               command_line_args.profile_dir, command_line_args.matching)
+    generator.create_osm_db(command_line_args.rebuild, command_line_args.workers)
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import math
+import hashlib
 from PointTag import PointTag
 from TrackLength import TrackLength
 from TrackDifficulty import TrackDifficulty
@@ -14,17 +15,34 @@ class OsmTrack:
     """
 
     def __init__(self, segment, track_id):
+        """
+        :param segment: a gpxpy segment. Only its points are kept (in self.gps_points), the segment itself isn't.
+        :param track_id: the id of the track (see get_segment_id).
+        """
         self.MID_LENGTH_THRESH = 5  # Tracks who's length is between 20m to 40m are considered as medium-length track.
         self.LONG_THRESH = 20  # Tracks longer then 40m are considered long.
         self.id = track_id
-        self.segment = segment
         self.interest_points = set()  # Waterways, historic places, etc...
-        self.gps_points = self.extract_gps_points()  # Pandas df (lat, lon, time)
+        self.gps_points = self.extract_gps_points(segment)  # Pandas df (lat, lon, time)
         self.length = self.calculate_length()  # The length of the track (in km)
         self.avg_velocity = self.calculate_avg_velocity()  # The average velocity of the track (in km\h)
         self.shape = self.deduce_track_shape()
         self.boundaries = self.get_track_boundaries()
         self.difficulty = TrackDifficulty.EASY  # Hardcoded for now.
+        self.duplicates = 0  # The number of near-duplicate segments collapsed into this track.
+
+    @staticmethod
+    def get_segment_id(segment) -> str:
+        """
+        Computes a stable id for a gps segment out of its content, so the same segment gets the same id no matter in
+        which file, or in which run, it was collected.
+        :param segment: a gpxpy segment.
+        :return: a hex string, the hash of the segment's points (lat, lon, time).
+        """
+        segment_hash = hashlib.sha1()
+        for p in segment.points:
+            segment_hash.update((repr(p.latitude) + ',' + repr(p.longitude) + ',' + str(p.time) + ';').encode('utf-8'))
+        return segment_hash.hexdigest()[:16]
 
     def add_interest_point(self, point_tag: PointTag):
         """
@@ -82,23 +100,31 @@ class OsmTrack:
             return False
         min_dist = math.inf
         # We preform the check only on part of the points, to fasten the running time:
-        num_of_samples = max(int(self.gps_points.shape[0] * samp_ratio), 1)  # sample at least one point
-        step_size = int(len(self.gps_points) / num_of_samples)
-        sample = self.gps_points[0:-1: step_size]
+        sample = self.gps_points[0:-1: self.get_sample_step(samp_ratio)]
         for idx, track_point in sample.iterrows():
             min_dist = min(min_dist, geodesic([track_point.lat, track_point.lon], [point.lat, point.lon]).m)
         return min_dist < closeness_thresh
 
-    def extract_gps_points(self) -> pd.DataFrame:
+    def get_sample_step(self, samp_ratio=1 / 10) -> int:
+        """
+        :param samp_ratio: the relative part of the track's points sampled (see is_close).
+        :return: the step between the sampled points: is_close checks the points self.gps_points[0:-1:step].
+        """
+        num_of_samples = max(int(self.gps_points.shape[0] * samp_ratio), 1)  # sample at least one point
+        return int(len(self.gps_points) / num_of_samples)
+
+    @staticmethod
+    def extract_gps_points(segment) -> pd.DataFrame:
         """
         Extracts the gps points from a segment and saves them as a pandas df (lat, lon, time)
+        :param segment: a gpxpy segment.
         :return: a data frame (lat, lon, time) containing the gps points of the track.
         """
         gps_points = pd.DataFrame([
             {'lat': p.latitude,
              'lon': p.longitude,
              'time': p.time,
-             } for p in self.segment.points])
+             } for p in segment.points])
         return gps_points
 
     def deduce_track_shape(self, thresh=30) -> TrackShape:
@@ -147,15 +173,18 @@ class OsmTrack:
                                                 'boundaries': {'north': n,
                                                                 'south': s,
                                                                 'west': w,
-                                                                'east': e}
+                                                                'east': e},
+                                                'duplicates': d
                                                 }
 
         where attributes is a list of the enum values representing the properties the track has (only the properties
-        that holds for the current track appear in the list).
+        that holds for the current track appear in the list), and duplicates is the number of near-duplicate segments
+        collapsed into the track.
         """
         dict_repr = {}
         attributes = self.get_attributes_shingles()
 
         dict_repr['attributes'] = list(attributes)
         dict_repr['boundaries'] = self.boundaries
+        dict_repr['duplicates'] = self.duplicates
         return dict_repr
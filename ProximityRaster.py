@@ -0,0 +1,326 @@
+"""
+Proximity rasters of the interest points of an area: for every PointTag, boolean grids over the area (about 25m x 25m
+cells) whose cells are set iff they are within 200m of an interest point of the tag. The grids are computed once, with
+a distance transform, so tagging a track is a lookup of its points in the grids instead of measuring the distance of
+every interest point from the track (see OsmTrack.is_close). The area is split into the tiles of TiledAreaDb, and only
+the grids of the tiles that hold tracks are computed, and a few at a time are kept in memory (see AreaRasters), so a
+country-scale area takes as little memory as a small one.
+
+The cells are measured from their centers, so a point near the edge of the 200m radius may be tagged a little
+differently than by the exact distance (the error is at most about a cell's diagonal). A degree of longitude is
+shorter the farther it is from the equator, so the cells are not equally wide (in meters) across the grid: the
+distances are computed per band of latitudes (BAND_DEGREES high), each with the width of its cells at its middle
+latitude. Benchmarks/run_benchmarks (proximity_raster) measures how often the two agree.
+
+The rasters of an area are saved in its data base directory (<area dir>\\proximity\\<tile key>\\<tag>.npz), along with
+the hash of the interest points they were computed of, so a later build whose interest points didn't change reuses
+them. They can also tag any gps track (in the tiles that were computed), for example one a user uploads:
+    python ProximityRaster.py <area dir> <gpx file>
+"""
+
+import argparse
+import hashlib
+import math
+import os
+from collections import OrderedDict
+import gpxpy
+import numpy as np
+from scipy import ndimage
+from Instrumentation import BuildProfiler
+from PointTag import PointTag
+from TiledAreaDb import TILE_DEGREES, get_tile_key
+
+RASTERS_DIR_NAME = 'proximity'
+CELL_METERS = 25  # The side of a cell.
+DISTANCE_METERS = 200  # A track is tagged by the interest points up to this distance from one of its points.
+METERS_PER_DEGREE = 111320  # The length of a degree of latitude (and of longitude, at the equator).
+BAND_DEGREES = 0.25  # The distances are computed per band of latitudes this high (see ProximityRaster.build).
+CACHED_TILES = 16  # The number of tiles whose rasters AreaRasters keeps in memory.
+
+
+def get_disk_offsets(distance: float, cell_meters: float, cell_width: float) -> tuple:
+    """
+    :param cell_width: the width of a cell (meters).
+    :return: the (rows offsets, columns offsets) of the cells whose centers are within the distance of a cell's center,
+    as np arrays.
+    """
+    rows_radius, columns_radius = math.floor(distance / cell_meters), math.floor(distance / cell_width)
+    row_offsets, column_offsets = np.meshgrid(np.arange(-rows_radius, rows_radius + 1),
+                                              np.arange(-columns_radius, columns_radius + 1), indexing='ij')
+    within = (row_offsets * cell_meters) ** 2 + (column_offsets * cell_width) ** 2 <= distance ** 2
+    return row_offsets[within], column_offsets[within]
+
+
+class ProximityRaster:
+    """
+    A boolean grid over a bounding box, whose cells are set iff they are within some distance of one of a set of
+    points.
+    """
+
+    def __init__(self, mask: np.ndarray, south: float, west: float, lat_step: float, lon_step: float,
+                 distance=DISTANCE_METERS, points_hash=''):
+        """
+        :param mask: a 2-dim bool np array, the cells of the grid: mask[i, j] is the cell whose south west corner is
+        (south + i * lat_step, west + j * lon_step).
+        :param south: the southern boundary of the grid.
+        :param west: the western boundary of the grid.
+        :param lat_step: the height of a cell, in degrees.
+        :param lon_step: the width of a cell, in degrees.
+        :param distance: the distance (meters) the grid was computed for.
+        :param points_hash: the hash of the points the grid was computed of (see get_points_hash).
+        """
+        self.mask = mask
+        self.south = south
+        self.west = west
+        self.lat_step = lat_step
+        self.lon_step = lon_step
+        self.distance = distance
+        self.points_hash = points_hash
+
+    @staticmethod
+    def get_points_hash(box: list, points: np.ndarray, distance=DISTANCE_METERS, cell_meters=CELL_METERS) -> str:
+        """
+        :return: a hex string identifying the raster the given arguments of build make.
+        """
+        points_hash = hashlib.sha1(repr((list(box), distance, cell_meters, BAND_DEGREES)).encode('utf8'))
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        points_hash.update(points[np.lexsort((points[:, 1], points[:, 0]))].tobytes())
+        return points_hash.hexdigest()
+
+    @staticmethod
+    def get_grid(box: list, distance=DISTANCE_METERS, cell_meters=CELL_METERS) -> tuple:
+        """
+        :return: the grid build makes for the given box: (south, west, lat_step, lon_step, shape), where south and west
+        are the boundaries of the grid (the distance around the box), and shape is its (rows, columns).
+        """
+        west, south, east, north = box
+        lat_step = cell_meters / METERS_PER_DEGREE
+        lon_step = cell_meters / (METERS_PER_DEGREE * math.cos(math.radians(max(abs(south), abs(north)))))
+        margin = math.ceil(distance / cell_meters)
+        south, west = south - margin * lat_step, west - margin * lon_step
+        shape = (math.ceil((north - south) / lat_step) + margin + 1, math.ceil((east - west) / lon_step) + margin + 1)
+        return south, west, lat_step, lon_step, shape
+
+    @staticmethod
+    def build(box: list, points: np.ndarray, distance=DISTANCE_METERS, cell_meters=CELL_METERS):
+        """
+        Computes the raster of the given points.
+        :param box: the bounding box of the area: [West, South, East, North]. The grid covers it, and the distance
+        around it.
+        :param points: a np array of shape (n, 2) holding the coordinates (lat, lon) of the points.
+        :param distance: the cells within this distance (meters) of one of the points are set.
+        :param cell_meters: the side of a cell (meters).
+        :return: a ProximityRaster. If none of the points is inside the grid, its mask is empty (nothing is set).
+        """
+        south, west, lat_step, lon_step, shape = ProximityRaster.get_grid(box, distance, cell_meters)
+        margin = math.ceil(distance / cell_meters)
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        rows = np.floor((points[:, 0] - south) / lat_step).astype(np.int64)
+        columns = np.floor((points[:, 1] - west) / lon_step).astype(np.int64)
+        inside = (rows >= 0) & (rows < shape[0]) & (columns >= 0) & (columns < shape[1])
+        if not inside.any():
+            mask = np.zeros((0, 0), dtype=bool)
+        else:
+            rows, columns = rows[inside], columns[inside]
+            empty = np.ones(shape, dtype=bool)
+            empty[rows, columns] = False
+            # Every band of rows is computed with the rows within the distance around it, and its own cells width:
+            mask = np.zeros(shape, dtype=bool)
+            band_rows = max(1, math.floor(BAND_DEGREES / lat_step))
+            for first_row in range(0, shape[0], band_rows):
+                last_row = min(first_row + band_rows, shape[0])
+                from_row, to_row = max(first_row - margin, 0), min(last_row + margin, shape[0])
+                band_lat = south + (first_row + last_row) / 2 * lat_step
+                cell_width = lon_step * METERS_PER_DEGREE * math.cos(math.radians(band_lat))
+                near = (rows >= from_row) & (rows < to_row)
+                row_offsets, column_offsets = get_disk_offsets(distance, cell_meters, cell_width)
+                if near.sum() * len(row_offsets) < (to_row - from_row) * shape[1]:
+                    # few points: the cells within the distance of every point are set directly.
+                    disk_rows = (rows[near][:, None] + row_offsets).ravel()
+                    disk_columns = (columns[near][:, None] + column_offsets).ravel()
+                    valid = (disk_rows >= first_row) & (disk_rows < last_row) & (disk_columns >= 0) & \
+                            (disk_columns < shape[1])
+                    mask[disk_rows[valid], disk_columns[valid]] = True
+                else:
+                    # The distance (meters) of every cell from the nearest cell holding a point:
+                    distances = ndimage.distance_transform_edt(empty[from_row:to_row],
+                                                               sampling=(cell_meters, cell_width))
+                    mask[first_row:last_row] = distances[first_row - from_row:last_row - from_row] <= distance
+        return ProximityRaster(mask, south, west, lat_step, lon_step, distance,
+                               ProximityRaster.get_points_hash(box, points, distance, cell_meters))
+
+    def contains(self, coordinates: np.ndarray) -> np.ndarray:
+        """
+        :param coordinates: a np array of shape (n, 2) holding coordinates (lat, lon).
+        :return: a bool np array of length n: True for the coordinates within the distance of one of the points (the
+        coordinates outside of the grid are False).
+        """
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        rows = np.floor((coordinates[:, 0] - self.south) / self.lat_step).astype(np.int64)
+        columns = np.floor((coordinates[:, 1] - self.west) / self.lon_step).astype(np.int64)
+        inside = (rows >= 0) & (rows < self.mask.shape[0]) & (columns >= 0) & (columns < self.mask.shape[1])
+        result = np.zeros(len(coordinates), dtype=bool)
+        result[inside] = self.mask[rows[inside], columns[inside]]
+        return result
+
+    def any_close(self, coordinates: np.ndarray) -> bool:
+        """
+        :param coordinates: a np array of shape (n, 2) holding the coordinates (lat, lon) of a track.
+        :return: True if one of the coordinates is within the distance of one of the points.
+        """
+        return bool(self.contains(coordinates).any())
+
+    def save(self, path: str):
+        """
+        Saves the raster into a (compressed) npz file, replacing the file only once it's complete.
+        """
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, mask=np.packbits(self.mask, axis=None), shape=np.array(self.mask.shape),
+                                grid=np.array([self.south, self.west, self.lat_step, self.lon_step, self.distance]),
+                                points_hash=np.array(self.points_hash))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str):
+        """
+        :return: the ProximityRaster saved in the given path (see save).
+        """
+        with np.load(path) as data:
+            shape = tuple(data['shape'])
+            mask = np.unpackbits(data['mask'], count=shape[0] * shape[1]).reshape(shape).astype(bool)
+            south, west, lat_step, lon_step, distance = data['grid']
+            return ProximityRaster(mask, south, west, lat_step, lon_step, distance, str(data['points_hash']))
+
+
+class AreaRasters:
+    """
+    The proximity rasters of an area, per tile of the grid of TiledAreaDb (TILE_DEGREES x TILE_DEGREES): a raster per
+    tag for every tile, covering the tile and the distance around it. The rasters of a tile are built the first time a
+    track has points in it (so only the tiles that hold tracks are built), saved in its directory (<rasters dir>\\<tile
+    key>\\<tag>.npz) and reused while its interest points don't change. Only the rasters of the last cached_tiles tiles
+    used are kept in memory, so the memory they take doesn't grow with the size of the area.
+    """
+
+    def __init__(self, rasters_dir: str, interest_points_dict=None, distance=DISTANCE_METERS, cell_meters=CELL_METERS,
+                 tile_degrees=TILE_DEGREES, cached_tiles=CACHED_TILES, profiler=None):
+        """
+        :param rasters_dir: the directory the rasters of the area are saved in.
+        :param interest_points_dict: the interest points of the area by tag (np arrays of shape (n, 2): (lat, lon),
+        sorted by their latitude, see OsmDataCollector.split_interest_points). If None, only the saved rasters are read
+        (the tiles that weren't built are skipped).
+        :param distance: the distance (meters) the rasters are computed for.
+        :param cell_meters: the side of a cell (meters).
+        :param tile_degrees: the side of a tile.
+        :param cached_tiles: the number of tiles whose rasters are kept in memory.
+        :param profiler: the BuildProfiler the building of the rasters is recorded in (see Instrumentation).
+        """
+        self.rasters_dir = rasters_dir
+        self.interest_points_dict = interest_points_dict
+        self.distance = distance
+        self.cell_meters = cell_meters
+        self.tile_degrees = tile_degrees
+        self.cached_tiles = cached_tiles
+        self.profiler = profiler if profiler is not None else BuildProfiler()
+        self._tiles = OrderedDict()  # The rasters of the tiles used last, least recently used first: {tile key: {tag:
+        # ProximityRaster}}
+
+    def _get_tile_box(self, row: int, column: int) -> list:
+        return [column * self.tile_degrees, row * self.tile_degrees, (column + 1) * self.tile_degrees,
+                (row + 1) * self.tile_degrees]
+
+    def _get_tile_points(self, points: np.ndarray, tile_box: list) -> np.ndarray:
+        """
+        :param points: the interest points of a tag, sorted by their latitude.
+        :return: the points inside the grid of the given tile's rasters.
+        """
+        south, west, lat_step, lon_step, shape = ProximityRaster.get_grid(tile_box, self.distance, self.cell_meters)
+        first, last = np.searchsorted(points[:, 0], [south, south + shape[0] * lat_step])
+        points = points[first:last]
+        return points[(west <= points[:, 1]) & (points[:, 1] < west + shape[1] * lon_step)]
+
+    def _load_tile(self, row: int, column: int):
+        """
+        :return: the rasters of the given tile ({tag: ProximityRaster}): the saved ones whose interest points didn't
+        change are loaded, and the others are built (and saved). None if the tile wasn't built, and there are no
+        interest points to build it of.
+        """
+        tile_dir = os.path.join(self.rasters_dir, get_tile_key(row, column))
+        if self.interest_points_dict is None:
+            if not os.path.isdir(tile_dir):
+                return None
+            return {tag: ProximityRaster.load(get_raster_path(tile_dir, tag)) for tag in PointTag
+                    if os.path.exists(get_raster_path(tile_dir, tag))}
+
+        tile_box = self._get_tile_box(row, column)
+        os.makedirs(tile_dir, exist_ok=True)
+        rasters = {}
+        for tag, interest_points in self.interest_points_dict.items():
+            points = self._get_tile_points(interest_points, tile_box)
+            path = get_raster_path(tile_dir, tag)
+            if os.path.exists(path):
+                raster = ProximityRaster.load(path)
+                if raster.points_hash == ProximityRaster.get_points_hash(tile_box, points, self.distance,
+                                                                         self.cell_meters):
+                    rasters[tag] = raster
+                    continue
+            with self.profiler.stage('proximity_rasters', items=1):
+                rasters[tag] = ProximityRaster.build(tile_box, points, self.distance, self.cell_meters)
+                rasters[tag].save(path)
+        return rasters
+
+    def get_tile_rasters(self, row: int, column: int):
+        """
+        :return: the rasters of the given tile: {tag: ProximityRaster}, or None if the tile wasn't built (and can't be).
+        """
+        tile_key = get_tile_key(row, column)
+        if tile_key in self._tiles:
+            self._tiles.move_to_end(tile_key)
+            return self._tiles[tile_key]
+        rasters = self._load_tile(row, column)
+        if rasters is not None:
+            self._tiles[tile_key] = rasters
+            if len(self._tiles) > self.cached_tiles:
+                self._tiles.popitem(last=False)
+        return rasters
+
+    def get_track_tags(self, coordinates: np.ndarray) -> set:
+        """
+        :param coordinates: a np array of shape (n, 2) holding the coordinates (lat, lon) of a track.
+        :return: the set of the tags that have an interest point near the track: the points in every tile are looked
+        up in the tile's rasters.
+        """
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 2)
+        tiles = np.floor(coordinates / self.tile_degrees).astype(np.int64)
+        tags = set()
+        for row, column in np.unique(tiles, axis=0):
+            rasters = self.get_tile_rasters(int(row), int(column))
+            if not rasters:
+                continue
+            tile_coordinates = coordinates[(tiles[:, 0] == row) & (tiles[:, 1] == column)]
+            tags.update(tag for tag, raster in rasters.items()
+                        if tag not in tags and raster.any_close(tile_coordinates))
+        return tags
+
+
+def get_raster_path(tile_dir: str, tag: PointTag) -> str:
+    """
+    :return: the path the raster of the given tag is saved in.
+    """
+    return os.path.join(tile_dir, tag.name.lower() + '.npz')
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Prints the interest points tags of a gps track, by the proximity '
+                                                     'rasters of an area.')
+    arg_parser.add_argument("area_dir", help="the data base directory of the area.")
+    arg_parser.add_argument("gpx", help="a gpx file of the track.")
+    command_line_args = arg_parser.parse_args()
+    with open(command_line_args.gpx, 'r', encoding='utf8') as gpx_file:
+        gpx = gpxpy.parse(gpx_file)
+    track_coordinates = np.array([[p.latitude, p.longitude] for track in gpx.tracks for seg in track.segments
+                                  for p in seg.points]).reshape(-1, 2)
+    area_rasters = AreaRasters(os.path.join(command_line_args.area_dir, RASTERS_DIR_NAME))
+    for track_tag in sorted(area_rasters.get_track_tags(track_coordinates), key=lambda t: t.name):
+        print(track_tag.value)
@@ -0,0 +1,223 @@
+"""
+An SQLite storage backend for the osm data base of an area, used instead of the area's json file and geometry store.
+The data base file holds:
+ (1) table tracks: the id of every track, its attributes as a bitmask (see ATTRIBUTES) and its boundaries.
+ (2) virtual table tracks_rtree: an R*Tree over the boundaries of the tracks, for indexed bounding box queries.
+ (3) table geometry: the gps points of every track, at full resolution and at every simplification level (see
+     GeometryStore), as compact blobs (see GeometryCodec).
+Only python's standard library sqlite3 module is needed.
+"""
+
+import json
+import os
+import sqlite3
+import urllib.request
+import numpy as np
+import pandas as pd
+import slopeMap as sm
+import GeometryCodec as gc
+from GeometryStore import gps_points_to_array, choose_tolerance, FULL_RES, SIMPLIFY_TOLERANCES
+from PointTag import PointTag
+from TrackDifficulty import TrackDifficulty
+from TrackLength import TrackLength
+from TrackShape import TrackShape
+
+DB_FILE_SUFFIX = '_db.sqlite'
+GEOMETRY_EXPONENTS = [gc.COORDINATE_EXPONENT, gc.COORDINATE_EXPONENT, gc.TIME_EXPONENT]  # (lat, lon, time)
+RTREE_SLACK = 1e-4  # (degrees) The R*Tree limits are widened by this much, to make up for its 32 bit rounding.
+
+# Every attribute a track may have is a bit in the tracks' attributes bitmask:
+ATTRIBUTES = [tag.value for tag in PointTag] + [difficulty.value for difficulty in TrackDifficulty] + \
+             [shape.value for shape in TrackShape] + [length.value for length in TrackLength]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS tracks (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    attributes INTEGER NOT NULL,
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    north REAL NOT NULL, south REAL NOT NULL, east REAL NOT NULL, west REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_rtree USING rtree(rowid, min_lat, max_lat, min_lon, max_lon);
+CREATE TABLE IF NOT EXISTS geometry (
+    track_rowid INTEGER NOT NULL,
+    tolerance REAL NOT NULL,
+    points BLOB NOT NULL,
+    PRIMARY KEY (track_rowid, tolerance)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteAreaDb:
+    """
+    Reads and writes the SQLite data base of an area. Writes are made inside transactions: use the object as a context
+    manager (with SqliteAreaDb(path) as db: ...) to commit all of the writes of a run at once.
+    """
+
+    def __init__(self, path: str, read_only=False):
+        """
+        :param path: the path of the data base file (created if it doesn't exist, unless read_only).
+        :param read_only: if True, the data base is opened for queries only, and must exist.
+        """
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError('no SQLite data base at ' + path + ' (build it with OsmDbGenerator.py '
+                                        '--backend sqlite)')
+            self._connection = sqlite3.connect('file:' + urllib.request.pathname2url(os.path.abspath(path)) +
+                                               '?mode=ro', uri=True)
+            try:
+                meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+            except sqlite3.DatabaseError as e:
+                self._connection.close()
+                raise ValueError(path + ' is not an area data base: ' + str(e))
+            self._attributes = json.loads(meta['attributes'])
+            self.tolerances = json.loads(meta['tolerances'])
+            return
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(SCHEMA)
+        if 'duplicates' not in [column[1] for column in self._connection.execute("PRAGMA table_info(tracks)")]:
+            # a data base created before near-duplicate tracks were collapsed:
+            self._connection.execute("ALTER TABLE tracks ADD COLUMN duplicates INTEGER NOT NULL DEFAULT 0")
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'attributes'").fetchone()
+        if row is None:  # a new data base:
+            self._connection.execute("INSERT INTO meta VALUES ('attributes', ?)", (json.dumps(ATTRIBUTES),))
+            self._connection.execute("INSERT INTO meta VALUES ('tolerances', ?)", (json.dumps(SIMPLIFY_TOLERANCES),))
+            self._connection.commit()
+            self._attributes = ATTRIBUTES
+        else:
+            self._attributes = json.loads(row[0])
+        self.tolerances = json.loads(
+            self._connection.execute("SELECT value FROM meta WHERE key = 'tolerances'").fetchone()[0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self._connection.commit()
+        else:
+            self._connection.rollback()
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def attributes_to_mask(self, attributes) -> int:
+        """
+        :param attributes: an iterable of attributes values (for example: ['Waterfall', 'loop'])
+        :return: the bitmask representing the given attributes.
+        """
+        mask = 0
+        for attribute in attributes:
+            mask |= 1 << self._attributes.index(attribute)
+        return mask
+
+    def mask_to_attributes(self, mask: int) -> list:
+        """
+        :param mask: an attributes bitmask.
+        :return: the list of attributes values the bitmask represents.
+        """
+        return [attribute for bit, attribute in enumerate(self._attributes) if mask & (1 << bit)]
+
+    def add_track(self, track_id, dict_repr: dict, gps_points: pd.DataFrame):
+        """
+        Adds a track to the data base (replacing a track with the same id, if there is one).
+        :param track_id: the id of the track.
+        :param dict_repr: the representation of the track, as returned by OsmTrack.get_dict_repr.
+        :param gps_points: a pandas df (lat, lon, time) containing the gps points of the track.
+        """
+        boundaries = dict_repr['boundaries']
+        old_row = self._connection.execute("SELECT rowid FROM tracks WHERE id = ?", (str(track_id),)).fetchone()
+        if old_row is not None:
+            self._delete_rowid(old_row[0])
+
+        cursor = self._connection.execute(
+            "INSERT INTO tracks (id, attributes, duplicates, north, south, east, west) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (str(track_id), self.attributes_to_mask(dict_repr['attributes']), dict_repr.get('duplicates', 0),
+             boundaries['north'], boundaries['south'], boundaries['east'], boundaries['west']))
+        rowid = cursor.lastrowid
+        self._connection.execute("INSERT INTO tracks_rtree VALUES (?, ?, ?, ?, ?)",
+                                 (rowid, boundaries['south'], boundaries['north'], boundaries['west'],
+                                  boundaries['east']))
+
+        rows = gps_points_to_array(gps_points)
+        levels = [(FULL_RES, rows)] + [(tolerance, rows[sm.simplify_track(rows[:, :2], tolerance)])
+                                       for tolerance in self.tolerances]
+        self._connection.executemany("INSERT INTO geometry VALUES (?, ?, ?)",
+                                     [(rowid, tolerance, gc.encode(level_rows, GEOMETRY_EXPONENTS))
+                                      for tolerance, level_rows in levels])
+
+    def _delete_rowid(self, rowid: int):
+        """
+        Deletes the track in the given row from all of the tables.
+        """
+        self._connection.execute("DELETE FROM tracks WHERE rowid = ?", (rowid,))
+        self._connection.execute("DELETE FROM tracks_rtree WHERE rowid = ?", (rowid,))
+        self._connection.execute("DELETE FROM geometry WHERE track_rowid = ?", (rowid,))
+
+    def get_tracks(self, north=None, south=None, east=None, west=None, required_attributes=None) -> dict:
+        """
+        Returns the tracks that lie inside the given limits (see Main.in_geo_limits), and have all of the required
+        attributes. Limits that are not given are not checked.
+        :param required_attributes: an iterable of attributes values the tracks must have.
+        :return: a dictionary of the form {track id: {'attributes': [...], 'boundaries': {...}, 'duplicates': d}}, like
+        the 'tracks' dictionary of the area's json file.
+        """
+        # The R*Tree keeps 32 bit boundaries rounded outwards, so it's queried with slightly wider limits, and the
+        # exact boundaries are checked as well:
+        conditions = []
+        params = []
+        for column, rtree_column, limit, operator, slack in [('north', 'max_lat', north, '<=', RTREE_SLACK),
+                                                             ('south', 'min_lat', south, '>=', -RTREE_SLACK),
+                                                             ('east', 'max_lon', east, '<=', RTREE_SLACK),
+                                                             ('west', 'min_lon', west, '>=', -RTREE_SLACK)]:
+            if limit is not None:
+                conditions.append('r.' + rtree_column + ' ' + operator + ' ? AND t.' + column + ' ' + operator + ' ?')
+                params += [limit + slack, limit]
+        if required_attributes:
+            mask = self.attributes_to_mask(required_attributes)
+            conditions.append('(t.attributes & ?) = ?')
+            params += [mask, mask]
+
+        query = "SELECT t.id, t.attributes, t.duplicates, t.north, t.south, t.east, t.west " \
+                "FROM tracks_rtree r JOIN tracks t ON t.rowid = r.rowid"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        tracks = {}
+        for track_id, mask, duplicates, t_north, t_south, t_east, t_west in self._connection.execute(query, params):
+            tracks[track_id] = {'attributes': self.mask_to_attributes(mask),
+                                'boundaries': {'north': t_north, 'south': t_south, 'east': t_east, 'west': t_west},
+                                'duplicates': duplicates}
+        return tracks
+
+    def get_points(self, track_id, tolerance=FULL_RES) -> np.ndarray:
+        """
+        Returns the gps points of the track with the given id.
+        :param track_id: the id of the track.
+        :param tolerance: the simplification level to read (FULL_RES, or one of self.tolerances).
+        :return: a np array of shape (n, 3) holding the track's points: (lat, lon, time).
+        """
+        row = self._connection.execute(
+            "SELECT g.points FROM geometry g JOIN tracks t ON t.rowid = g.track_rowid "
+            "WHERE t.id = ? AND g.tolerance = ?", (str(track_id), tolerance)).fetchone()
+        if row is None:
+            raise KeyError(track_id)
+        return gc.decode(row[0])
+
+    def get_coordinates(self, track_id, tolerance=FULL_RES) -> np.ndarray:
+        """
+        Returns the coordinates of the track with the given id.
+        :param track_id: the id of the track.
+        :param tolerance: the simplification level to read (FULL_RES, or one of self.tolerances).
+        :return: a np array of shape (n, 2) holding the track's coordinates: (lat, lon).
+        """
+        return self.get_points(track_id, tolerance)[:, :2]
+
+    def choose_tolerance(self, pixel_meters: float) -> float:
+        """
+        :param pixel_meters: the ground distance covered by one pixel of the map (see GeometryStore.meters_per_pixel).
+        :return: the coarsest level of this data base that looks the same as the full resolution track on the map.
+        """
+        return choose_tolerance(pixel_meters, self.tolerances)
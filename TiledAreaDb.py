@@ -0,0 +1,229 @@
+"""
+A tiled storage backend for the osm data base of an area (the 'tiled' backend), for areas too large to be read whole
+(a country, for example). The tracks of the area are partitioned into the tiles of a fixed grid of TILE_DEGREES x
+TILE_DEGREES: a track belongs to the tile of the south west corner of its boundaries. Every tile is a directory
+(tiles\\<row>_<column>) holding the tracks json file of its tracks (of the same form as the area's json file) and their
+geometry store (see GeometryStore). The tiles index (tiles_index.json) lists the tiles that hold tracks.
+
+A track that lies inside some limits has its south west corner inside them, so a query reads only the tiles that
+intersect its limits: its cost depends on the size of the limits, not on the size of the area.
+"""
+
+import json
+import math
+import os
+import pandas as pd
+from GeometryStore import GeometryStore, GeometryStoreWriter, FULL_RES, SIMPLIFY_TOLERANCES, choose_tolerance
+
+TILES_DIR_NAME = 'tiles'
+INDEX_FILE_NAME = 'tiles_index.json'
+TRACKS_FILE_NAME = 'tracks.json'
+TILE_DEGREES = 0.25  # The side of a tile.
+MAX_PENDING_POINTS = 1000000  # The added tracks are kept in memory until they have that many points, then saved.
+
+
+def get_tile(lat: float, lon: float, tile_degrees=TILE_DEGREES) -> tuple:
+    """
+    :return: the (row, column) of the tile of the given coordinates.
+    """
+    return math.floor(lat / tile_degrees), math.floor(lon / tile_degrees)
+
+
+def get_tile_key(row: int, column: int) -> str:
+    """
+    :return: the name of the tile in the given row and column (the name of its directory).
+    """
+    return str(row) + '_' + str(column)
+
+
+def in_limits(boundaries: dict, north=None, south=None, east=None, west=None) -> bool:
+    """
+    :return: True if the given boundaries lie inside the given limits (see Main.in_geo_limits). Limits that are not
+    given are not checked.
+    """
+    return (north is None or boundaries['north'] <= north) and (south is None or boundaries['south'] >= south) and \
+           (east is None or boundaries['east'] <= east) and (west is None or boundaries['west'] >= west)
+
+
+class TiledAreaDb:
+    """
+    Reads and writes the tiled data base of an area. The added tracks are kept in memory, and saved tile by tile once
+    they are many enough (see MAX_PENDING_POINTS), so every tile is opened once per batch of tracks, whatever order
+    the tracks are added in. The rest are saved when the data base is closed: use the object as a context manager
+    (with TiledAreaDb(path) as db: ...).
+    """
+
+    def __init__(self, dir_path: str, tile_degrees=TILE_DEGREES, read_only=False):
+        """
+        :param dir_path: the directory of the tiles (created when the first track is added).
+        :param tile_degrees: the side of a tile, for a new data base (an existing one keeps its own).
+        :param read_only: if True, the data base is opened for queries only, and its tiles index must exist.
+        """
+        self.dir_path = dir_path
+        self._index_path = os.path.join(dir_path, INDEX_FILE_NAME)
+        self._index = {'tile_degrees': tile_degrees, 'tolerances': SIMPLIFY_TOLERANCES, 'tiles': {}}
+        if read_only and not os.path.exists(self._index_path):
+            raise FileNotFoundError('no tiled data base at ' + dir_path + ' (build it with OsmDbGenerator.py '
+                                    '--backend tiled)')
+        self.read_only = read_only
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r') as f:
+                self._index = json.load(f)
+        self.tile_degrees = self._index['tile_degrees']
+        self.tolerances = self._index['tolerances']
+        self._pending = {}  # The added tracks that were not saved yet: {tile key: [(id, dict repr, gps points), ...]}
+        self._pending_points = 0
+        self._stores = {}  # The geometry stores of the tiles read so far.
+        self._track_tiles = {}  # The tile of every track get_tracks returned.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_tile_dir(self, tile_key: str) -> str:
+        return os.path.join(self.dir_path, tile_key)
+
+    def _read_tile(self, tile_key: str) -> dict:
+        """
+        :return: the tracks dictionary of the given tile (empty if the tile has no tracks yet).
+        """
+        path = os.path.join(self._get_tile_dir(tile_key), TRACKS_FILE_NAME)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)['tracks']
+
+    def _save_tile(self, tile_key: str, tracks: list):
+        """
+        Adds the given tracks to the tracks file and the geometry store of the given tile.
+        :param tracks: a list of (id, dict repr, gps points) of tracks of the tile.
+        """
+        tile_dir = self._get_tile_dir(tile_key)
+        os.makedirs(tile_dir, exist_ok=True)
+        tracks_dict = self._read_tile(tile_key)
+        with GeometryStoreWriter(tile_dir, self.tolerances) as geometry_writer:
+            for track_id, dict_repr, gps_points in tracks:
+                tracks_dict[str(track_id)] = dict_repr
+                geometry_writer.add(track_id, gps_points)
+        path = os.path.join(tile_dir, TRACKS_FILE_NAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'tracks': tracks_dict}, f)
+        os.replace(path + '.tmp', path)
+        row, column = [int(number) for number in tile_key.split('_')]
+        self._index['tiles'][tile_key] = {
+            'box': [column * self.tile_degrees, row * self.tile_degrees, (column + 1) * self.tile_degrees,
+                    (row + 1) * self.tile_degrees], 'tracks': len(tracks_dict)}
+
+    def flush(self):
+        """
+        Saves the added tracks, tile by tile, and the tiles index.
+        """
+        if not self._pending:
+            return
+        for tile_key, tracks in self._pending.items():
+            self._save_tile(tile_key, tracks)
+        self._pending = {}
+        self._pending_points = 0
+        if self._index['tiles']:
+            with open(self._index_path + '.tmp', 'w') as f:
+                json.dump(self._index, f, indent=4)
+            os.replace(self._index_path + '.tmp', self._index_path)
+
+    def add_track(self, track_id, dict_repr: dict, gps_points: pd.DataFrame):
+        """
+        Adds a track to the tile it belongs to (replacing a track with the same id in that tile, if there is one).
+        :param track_id: the id of the track.
+        :param dict_repr: the representation of the track, as returned by OsmTrack.get_dict_repr.
+        :param gps_points: a pandas df (lat, lon, time) containing the gps points of the track.
+        """
+        if self.read_only:
+            raise ValueError('the tiled data base at ' + self.dir_path + ' was opened read-only')
+        row, column = get_tile(dict_repr['boundaries']['south'], dict_repr['boundaries']['west'], self.tile_degrees)
+        self._pending.setdefault(get_tile_key(row, column), []).append((track_id, dict_repr, gps_points))
+        self._pending_points += len(gps_points)
+        if self._pending_points >= MAX_PENDING_POINTS:
+            self.flush()
+
+    def close(self):
+        """
+        Saves the tracks that were not saved yet, and releases the geometry stores read.
+        """
+        self.flush()
+        for geometry_store in self._stores.values():
+            geometry_store.close()
+        self._stores = {}
+
+    def get_tile_keys(self, north=None, south=None, east=None, west=None) -> list:
+        """
+        :return: the keys of the tiles (that hold tracks) whose tracks may lie inside the given limits. If all of the
+        limits are given, only the tiles intersecting them are checked. Limits that are not given are not checked.
+        """
+        if None in [north, south, east, west]:
+            tile_keys = []
+            for tile_key, tile in self._index['tiles'].items():
+                tile_west, tile_south, tile_east, tile_north = tile['box']
+                if (north is None or tile_south <= north) and (south is None or tile_north >= south) and \
+                        (east is None or tile_west <= east) and (west is None or tile_east >= west):
+                    tile_keys.append(tile_key)
+            return tile_keys
+        first_row, first_column = get_tile(south, west, self.tile_degrees)
+        last_row, last_column = get_tile(north, east, self.tile_degrees)
+        return [get_tile_key(row, column) for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)
+                if get_tile_key(row, column) in self._index['tiles']]
+
+    def get_tile_tracks(self, tile_key: str) -> dict:
+        """
+        :return: all of the tracks of the given tile, of the same form as the 'tracks' dictionary of the area's json
+        file.
+        """
+        tracks_dict = self._read_tile(tile_key)
+        for track_id in tracks_dict:
+            self._track_tiles[track_id] = tile_key
+        return tracks_dict
+
+    def get_tracks(self, north=None, south=None, east=None, west=None, required_attributes=None) -> dict:
+        """
+        Returns the tracks that lie inside the given limits (see Main.in_geo_limits), and have all of the required
+        attributes. Limits that are not given are not checked. Only the tiles intersecting the limits are read.
+        :param required_attributes: an iterable of attributes values the tracks must have.
+        :return: a dictionary of the form {track id: {'attributes': [...], 'boundaries': {...}, 'duplicates': d}}, like
+        the 'tracks' dictionary of the area's json file.
+        """
+        required_attributes = set(required_attributes) if required_attributes else set()
+        tracks = {}
+        for tile_key in self.get_tile_keys(north, south, east, west):
+            for track_id, track_data in self.get_tile_tracks(tile_key).items():
+                if in_limits(track_data['boundaries'], north, south, east, west) and \
+                        required_attributes.issubset(track_data['attributes']):
+                    tracks[track_id] = track_data
+        return tracks
+
+    def get_points(self, track_id, tolerance=FULL_RES):
+        """
+        Returns the gps points of the track with the given id. The track must be one of the tracks of a tile read
+        before (by get_tracks or get_tile_tracks).
+        :param track_id: the id of the track.
+        :param tolerance: the simplification level to read (FULL_RES, or one of self.tolerances).
+        :return: a read-only np array of shape (n, 3) holding the track's points: (lat, lon, time).
+        """
+        tile_key = self._track_tiles[str(track_id)]
+        if tile_key not in self._stores:
+            self._stores[tile_key] = GeometryStore(self._get_tile_dir(tile_key))
+        return self._stores[tile_key].get_points(track_id, tolerance)
+
+    def get_coordinates(self, track_id, tolerance=FULL_RES):
+        """
+        Returns the coordinates of the track with the given id (see get_points).
+        :return: a read-only np array of shape (n, 2) holding the track's coordinates: (lat, lon).
+        """
+        return self.get_points(track_id, tolerance)[:, :2]
+
+    def choose_tolerance(self, pixel_meters: float) -> float:
+        """
+        :param pixel_meters: the ground distance covered by one pixel of the map (see GeometryStore.meters_per_pixel).
+        :return: the coarsest level of this data base that looks the same as the full resolution track on the map.
+        """
+        return choose_tolerance(pixel_meters, self.tolerances)
@@ -4,23 +4,45 @@ the request.
 
 Command-Line Arguments Example:
 baiersbronn 48.6 48.52 8.4 8.3 0 0 0 0 0 1 0 1 1 2 2
+
+The module can also answer many requests in one run (batch mode): each line of a JSONL file (or of stdin) holds one
+request, with the positional command-line arguments as fields, and an optional id. For example:
+{"id": "q1", "search_area": "baiersbronn", "north_lim": 48.6, "south_lim": 48.52, "east_lim": 8.4, "west_lim": 8.3,
+ "waterfall": 0, "birding": 0, "river": 0, "cave": 0, "lake": 0, "spring": 1, "geo": 0, "historic": 1, "length": 1,
+ "difficulty": 2, "shape": 2}
+Batch Mode Example:
+--batch requests.jsonl --workers 4
 """
 
 import argparse
+import itertools
 import json
 import os
-import folium
-import pandas as pd
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from datasketch import MinHash, MinHashLSH
 from PointTag import PointTag
 from TrackLength import TrackLength
 from TrackDifficulty import TrackDifficulty
 from TrackShape import TrackShape
+from AreaRegistry import load_areas, get_area_db_path
 
-areas_paths = {'baiersbronn':  # Other areas in the future :)
-                   os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
-                                                'areas_databases\\baiersbronn\\baiersbronn_db.json'))}
+# The data bases of the supported search areas (see AreaRegistry):
+areas_paths = {area_name: get_area_db_path(area_name) for area_name in load_areas()}
 SIMILARITY_THRESH = 0.7
+BATCH_CHUNK_SIZE = 256  # The number of batch requests handed to the workers at a time.
+
+# The fields of a batch request, and their types (the positional command-line arguments):
+REQUEST_FIELDS = {'search_area': str, 'north_lim': float, 'south_lim': float, 'east_lim': float, 'west_lim': float,
+                  'waterfall': int, 'birding': int, 'river': int, 'cave': int, 'lake': int, 'spring': int, 'geo': int,
+                  'historic': int, 'length': int, 'difficulty': int, 'shape': int}
+
+# Caches the loaded areas of a batch run: {(area, backend): (tracks dict, LSH of all its tracks)}, and the loaded tiles
+# of the tiled areas: {(area, 'tiled', tile key): (tracks dict, LSH of all of the tile's tracks)}
+_area_indexes = {}
+_tiled_dbs = {}  # The opened tiled data bases of a batch run, by area.
+_lsh_params = []  # The bands and rows of the LSHs, computed once (by the first LSH created).
+BACKENDS = ['json', 'sqlite', 'tiled']
 
 
 def add_limits_args(parser: argparse.ArgumentParser):
@@ -61,7 +83,7 @@ def init_arg_parser():
     """
     parser = argparse.ArgumentParser(description='Gets arguments from the user.')
     parser.add_argument("search_area", help="The general geographic area to search tracks in.",
-                        choices=['baiersbronn'])  # Other areas options in the future :)
+                        choices=sorted(areas_paths))
 
     add_limits_args(parser)
     add_interest_points_args(parser)
@@ -70,10 +92,49 @@ def init_arg_parser():
     parser.add_argument("difficulty", help="1 for an easy track, 2 for intermediate, 3 for difficult and 4 for very "
                                            "difficult", type=int)
     parser.add_argument("shape", help="1 for a loop and 2 for out and back", type=int)
+    parser.add_argument("--full-res", help="draw the tracks on the map with all of their gps points, instead of a "
+                                           "simplified version fitting the map's zoom.", action='store_true')
+    parser.add_argument("--no-map", help="only print the results, without creating the interactive map.",
+                        action='store_true')
+    add_storage_args(parser)
+    add_batch_args(parser)
 
     return parser
 
 
+def add_storage_args(parser: argparse.ArgumentParser):
+    """
+    Adds to the parser the arguments choosing how the areas data bases are read.
+    :param parser: command-line arguments parser.
+    """
+    parser.add_argument("--backend", help="the storage backend of the area data base (see OsmDbGenerator).",
+                        choices=BACKENDS, default='json')
+
+
+def add_batch_args(parser: argparse.ArgumentParser):
+    """
+    Adds to the parser the arguments of the batch mode.
+    :param parser: command-line arguments parser.
+    """
+    parser.add_argument("--batch", help="answer the requests in the given JSONL file ('-' for stdin) instead of the "
+                                        "positional arguments, and print one JSON result per request.")
+    parser.add_argument("--workers", help="the number of processes answering the batch requests.", type=int,
+                        default=1)
+    parser.add_argument("--maps", help="save a map for every batch request: recommended_tracks_<id>.html",
+                        action='store_true')
+
+
+def init_batch_arg_parser():
+    """
+    Creates a command-line arguments parser for the batch mode arguments only.
+    :return: a command-line arguments parser.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_storage_args(parser)
+    add_batch_args(parser)
+    return parser
+
+
 def add_interest_points_shingles(shing_set: set, args: argparse.Namespace):
     """
     Adds interest points shingles shingles to shing_set.
@@ -129,6 +190,19 @@ def add_shape_shing(shing_set: set, args: argparse.Namespace):
     shing_set.add(TrackShape.LOOP.value) if args.shape == 1 else shing_set.add(TrackShape.CURVE.value)
 
 
+def create_lsh() -> MinHashLSH:
+    """
+    Creates an empty LSH for the min-hashes of tracks. Choosing the LSH's bands and rows is slow (about 40ms), and they
+    only depend on SIMILARITY_THRESH, so they are chosen once: the tiled backend creates an LSH per tile.
+    :return: a MinHashLSH.
+    """
+    if not _lsh_params:
+        lsh = MinHashLSH(threshold=SIMILARITY_THRESH, num_perm=128)
+        _lsh_params.append((lsh.b, lsh.r))
+        return lsh
+    return MinHashLSH(threshold=SIMILARITY_THRESH, num_perm=128, params=_lsh_params[0])
+
+
 def get_min_hash(shingles: set) -> MinHash:
     """
     given a set of shingles, creates a MinHash object updated with those shingles.
@@ -166,6 +240,65 @@ def get_osm_tracks(area_path: str) -> dict:
     return osm_tracks_dict['tracks']
 
 
+def get_sqlite_path(area_name: str) -> str:
+    """
+    :return: the path of the SQLite data base of the given area (kept next to its json file).
+    """
+    return os.path.splitext(areas_paths[area_name])[0] + '.sqlite'
+
+
+def get_tiles_path(area_name: str) -> str:
+    """
+    :return: the path of the tiles directory of the given area (see TiledAreaDb), kept next to its json file.
+    """
+    from TiledAreaDb import TILES_DIR_NAME
+    return os.path.join(os.path.dirname(areas_paths[area_name]), TILES_DIR_NAME)
+
+
+def get_tracks_in_limits(args: argparse.Namespace) -> dict:
+    """
+    Reads the data of the tracks that lie inside the geographic limits the user had given.
+    With the sqlite backend, only those tracks are read (using the data base's spatial index), and with the tiled
+    backend only the tiles intersecting the limits are read.
+    :param args: command lines arguments.
+    :return: a dictionary with data on the tracks in the limits, of the same form as get_osm_tracks's.
+    """
+    if args.backend == 'tiled':
+        from TiledAreaDb import TiledAreaDb
+        return TiledAreaDb(get_tiles_path(args.search_area), read_only=True).get_tracks(
+            args.north_lim, args.south_lim, args.east_lim, args.west_lim)
+
+    if args.backend == 'sqlite':
+        from SqliteAreaDb import SqliteAreaDb
+        area_db = SqliteAreaDb(get_sqlite_path(args.search_area), read_only=True)
+        try:
+            return area_db.get_tracks(args.north_lim, args.south_lim, args.east_lim, args.west_lim)
+        finally:
+            area_db.close()
+
+    tracks_dict = get_osm_tracks(areas_paths[args.search_area])
+    return {track_id: track_data for track_id, track_data in tracks_dict.items() if in_geo_limits(args, track_data)}
+
+
+def open_geometry(args: argparse.Namespace):
+    """
+    Opens the gps points of the tracks of the requested area.
+    :param args: command lines arguments.
+    :return: a GeometryStore, an SqliteAreaDb or a TiledAreaDb (all have get_coordinates, choose_tolerance and close).
+    """
+    if args.backend == 'tiled':
+        from TiledAreaDb import TiledAreaDb
+        area_db = TiledAreaDb(get_tiles_path(args.search_area), read_only=True)
+        # (reads the tiles of the limits, so the data base knows which tile each of the results is in)
+        area_db.get_tracks(args.north_lim, args.south_lim, args.east_lim, args.west_lim)
+        return area_db
+    if args.backend == 'sqlite':
+        from SqliteAreaDb import SqliteAreaDb
+        return SqliteAreaDb(get_sqlite_path(args.search_area), read_only=True)
+    from GeometryStore import GeometryStore
+    return GeometryStore(os.path.dirname(areas_paths[args.search_area]))
+
+
 def in_geo_limits(args: argparse.Namespace, track_data: dict) -> bool:
     """
     Checks if the given track is in the geographic limits the user had given.
@@ -206,17 +339,23 @@ def pretty_print_results(user_shingles: set, tracks_dict: dict, given_args, resu
         print('\t South: ' + str(tracks_dict[t_id]['boundaries']['south']))
         print('\t East: ' + str(tracks_dict[t_id]['boundaries']['east']))
         print('\t West: ' + str(tracks_dict[t_id]['boundaries']['west']))
+        print('Similar recordings: ' + str(tracks_dict[t_id].get('duplicates', 0)))
         print('\n')
 
 
-def plot_output(args, results: list, tracks_data: dict):
+def plot_output(args, results: list, tracks_data: dict, output_path='recommended_tracks.html'):
     """
-    Plots the similar tracks found and their attributes on an interactive map (kept in the file fol.html)
+    Plots the similar tracks found and their attributes on an interactive map (kept in the file output_path)
     :param args: the command-line arguments we got from the user.
     :param results: a list containing the ids of the osm-tracks the program decided were similar enough to the
     user's request.
     :param tracks_data: a dictionary containing the data we collected over the osm-tracks in the requested area.
+    :param output_path: the path of the html file the map is saved in.
     """
+    # The map dependencies are imported here, so requests that don't ask for a map don't pay for them:
+    import folium
+    from GeometryStore import FULL_RES, meters_per_pixel, zoom_for_box
+
     colors_list = [
         'red', 'green', 'orange', 'lightred', 'pink', 'black', 'blue', 'darkpurple',
         'darkred', 'cadetblue', 'darkblue', 'darkgreen', 'purple', 'gray'
@@ -225,23 +364,187 @@ def plot_output(args, results: list, tracks_data: dict):
     # Calculate the center coordinate of the search area and create a map object in this area:
     location_x = (args.north_lim + args.south_lim) / 2
     location_y = (args.west_lim + args.east_lim) / 2
-    output_map = folium.Map(location=[location_x, location_y], zoom_start=13)
+    zoom = zoom_for_box(args.north_lim, args.south_lim, args.east_lim, args.west_lim)
+    output_map = folium.Map(location=[location_x, location_y], zoom_start=zoom)
+
+    # Draw the tracks with the coarsest simplification level that can't be told apart from the full track:
+    geometry_store = open_geometry(args)
+    try:
+        tolerance = FULL_RES if args.full_res else geometry_store.choose_tolerance(meters_per_pixel(location_x, zoom))
 
-    # Present the similar tracks on the map:
-    for result_id in results:
-        coors_rel_path = 'areas_databases\\' + args.search_area + '\\tracks_gps_points\\' + result_id
-        df = pd.read_csv(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', coors_rel_path)))
-        points = [(row[0], row[1]) for row in df[['lat', 'lon']].values]
+        # Present the similar tracks on the map:
+        for result_idx, result_id in enumerate(results):
+            points = geometry_store.get_coordinates(result_id, tolerance).tolist()
 
-        folium.PolyLine(points, color=colors_list[int(result_id) % len(colors_list)], opacity=1).add_to(output_map)
+            folium.PolyLine(points, color=colors_list[result_idx % len(colors_list)], opacity=1).add_to(output_map)
 
-        folium.Marker(
-            location=[points[0][0], points[0][1]],
-            popup='track ' + result_id + '\n' + str(tracks_data[result_id]['attributes']),
-            icon=folium.Icon(color=colors_list[int(result_id) % len(colors_list)], icon='info-sign')
-        ).add_to(output_map)
+            folium.Marker(
+                location=[points[0][0], points[0][1]],
+                popup='track ' + result_id + '\n' + str(tracks_data[result_id]['attributes']),
+                icon=folium.Icon(color=colors_list[result_idx % len(colors_list)], icon='info-sign')
+            ).add_to(output_map)
+    finally:
+        geometry_store.close()
 
-    output_map.save('recommended_tracks.html')
+    output_map.save(output_path)
+
+
+def get_area_index(area_name: str, backend='json') -> tuple:
+    """
+    Loads the data of the given area once per process, and indexes all of its tracks in an LSH.
+    :param area_name: one of the supported search areas.
+    :param backend: the storage backend of the area data base.
+    :return: (tracks dict, MinHashLSH containing the min-hashes of all of the area's tracks)
+    """
+    if (area_name, backend) not in _area_indexes:
+        if backend == 'sqlite':
+            from SqliteAreaDb import SqliteAreaDb
+            area_db = SqliteAreaDb(get_sqlite_path(area_name), read_only=True)
+            tracks_dict = area_db.get_tracks()
+            area_db.close()
+        else:
+            tracks_dict = get_osm_tracks(areas_paths[area_name])
+        lsh = create_lsh()
+        for track_id in tracks_dict:
+            lsh.insert(track_id, get_min_hash(set(tracks_dict[track_id]['attributes'])))
+        _area_indexes[(area_name, backend)] = tracks_dict, lsh
+    return _area_indexes[(area_name, backend)]
+
+
+def get_tile_indexes(area_name: str, north: float, south: float, east: float, west: float) -> list:
+    """
+    Loads the tiles of the given tiled area that intersect the given limits (each tile once per process), and indexes
+    the tracks of every tile in an LSH.
+    :return: a list of (tracks dict, MinHashLSH containing the min-hashes of all of the tile's tracks), one per tile.
+    """
+    if area_name not in _tiled_dbs:
+        from TiledAreaDb import TiledAreaDb
+        _tiled_dbs[area_name] = TiledAreaDb(get_tiles_path(area_name), read_only=True)
+    area_db = _tiled_dbs[area_name]
+    indexes = []
+    for tile_key in area_db.get_tile_keys(north, south, east, west):
+        if (area_name, 'tiled', tile_key) not in _area_indexes:
+            tracks_dict = area_db.get_tile_tracks(tile_key)
+            lsh = create_lsh()
+            for track_id in tracks_dict:
+                lsh.insert(track_id, get_min_hash(set(tracks_dict[track_id]['attributes'])))
+            _area_indexes[(area_name, 'tiled', tile_key)] = tracks_dict, lsh
+        indexes.append(_area_indexes[(area_name, 'tiled', tile_key)])
+    return indexes
+
+
+def request_to_args(request: dict, backend='json') -> argparse.Namespace:
+    """
+    Converts a batch request into the arguments the single-request functions expect.
+    :param request: a dictionary holding the REQUEST_FIELDS (and optionally 'full_res').
+    :param backend: the storage backend of the areas data bases.
+    :return: the request's arguments, as if they were given in the command-line.
+    """
+    args = argparse.Namespace(full_res=bool(request.get('full_res', False)), backend=backend)
+    for field, field_type in REQUEST_FIELDS.items():
+        if field not in request:
+            raise ValueError('missing field: ' + field)
+        setattr(args, field, field_type(request[field]))
+    if args.search_area not in areas_paths:
+        raise ValueError('unsupported search area: ' + args.search_area)
+    return args
+
+
+def answer_request(request: dict, plot_maps=False, backend='json') -> dict:
+    """
+    Finds the tracks similar to a single batch request.
+    The area's LSH holds all of its tracks (or, with the tiled backend, the LSH of every tile intersecting the limits
+    holds all of the tile's tracks), so its candidates are filtered by the request's limits afterwards (the same tracks
+    are found as in the single request mode, where only the tracks inside the limits are indexed).
+    :param request: a dictionary holding the request's id and its REQUEST_FIELDS.
+    :param plot_maps: if True, the request's results are also plotted on a map.
+    :param backend: the storage backend of the areas data bases.
+    :return: a dictionary of the form {'id': request id, 'tracks': [{'id': track id, 'score': jaccard}, ...]}, sorted
+    by descending score, or {'id': request id, 'error': message} if the request is invalid or its area's data base
+    can't be loaded.
+    """
+    request_id = request.get('id')
+    if 'error' in request:  # a line read_requests couldn't parse.
+        return {'id': request_id, 'error': request['error']}
+    try:
+        args = request_to_args(request, backend)
+    except (ValueError, TypeError) as e:
+        return {'id': request_id, 'error': str(e)}
+
+    try:
+        if backend == 'tiled':
+            indexes = get_tile_indexes(args.search_area, args.north_lim, args.south_lim, args.east_lim, args.west_lim)
+        else:
+            indexes = [get_area_index(args.search_area, backend)]
+    except (OSError, ValueError) as e:  # the area's data base wasn't built (for this backend), or can't be read.
+        return {'id': request_id, 'error': 'cannot load the ' + args.search_area + ' data base: ' + str(e)}
+    user_shingles = create_user_shingles(args)
+    user_min_hash = get_min_hash(user_shingles)
+    similar_tracks = []
+    tracks_dict = {}  # The data of the similar tracks.
+    for index_tracks, lsh in indexes:
+        for track_id in lsh.query(user_min_hash):
+            if in_geo_limits(args, index_tracks[track_id]):
+                similar_tracks.append(track_id)
+                tracks_dict[track_id] = index_tracks[track_id]
+
+    scores = []
+    for track_id in similar_tracks:
+        track_shingles = set(tracks_dict[track_id]['attributes'])
+        scores.append(len(user_shingles & track_shingles) / len(user_shingles | track_shingles))
+    results = sorted(zip(similar_tracks, scores), key=lambda result: result[1], reverse=True)
+
+    if plot_maps and similar_tracks:
+        plot_output(args, similar_tracks, tracks_dict, 'recommended_tracks_' + str(request_id) + '.html')
+    return {'id': request_id, 'tracks': [{'id': track_id, 'score': score} for track_id, score in results]}
+
+
+def read_requests(requests_file) -> iter:
+    """
+    Reads the batch requests lazily.
+    :param requests_file: an open JSONL file, one request per line.
+    :return: a generator of the requests (dictionaries). A request without an id gets its line number as id. A line
+    that isn't a JSON object is yielded as {'id': line number, 'error': message}, so it doesn't abort the batch.
+    """
+    for line_num, line in enumerate(requests_file):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            request.setdefault('id', line_num)
+        except (ValueError, AttributeError) as e:
+            request = {'id': line_num, 'error': 'invalid request line: ' + str(e)}
+        yield request
+
+
+def run_batch(batch_path: str, workers=1, plot_maps=False, backend='json'):
+    """
+    Answers all of the requests in the given JSONL file, and prints one JSON result per line (in the requests order).
+    Each area is loaded once per worker process.
+    :param batch_path: the path of the requests file ('-' for stdin).
+    :param workers: the number of processes answering the requests.
+    :param plot_maps: if True, a map is saved for every request.
+    :param backend: the storage backend of the areas data bases.
+    """
+    requests_file = sys.stdin if batch_path == '-' else open(batch_path, 'r')
+    requests = read_requests(requests_file)
+    try:
+        if workers <= 1:
+            for request in requests:
+                print(json.dumps(answer_request(request, plot_maps, backend)), flush=True)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                chunk = list(itertools.islice(requests, BATCH_CHUNK_SIZE))
+                if not chunk:
+                    break
+                for result in executor.map(answer_request, chunk, itertools.repeat(plot_maps),
+                                           itertools.repeat(backend)):
+                    print(json.dumps(result), flush=True)
+    finally:
+        if requests_file is not sys.stdin:
+            requests_file.close()
 
 
 if __name__ == '__main__':
@@ -250,19 +553,24 @@ if __name__ == '__main__':
     (in the future) presents the results to the user.
     Usage Example: baiersbronn 48.6 48.52 8.4 8.3 0 0 0 0 0 1 0 1 1 2 2
     """
+    batch_args, _ = init_batch_arg_parser().parse_known_args()
+    if batch_args.batch is not None:
+        run_batch(batch_args.batch, batch_args.workers, batch_args.maps, batch_args.backend)
+        sys.exit()
+
     arg_parser = init_arg_parser()
     command_line_args = arg_parser.parse_args()
 
     user_shing = create_user_shingles(command_line_args)
-    lsh = MinHashLSH(threshold=SIMILARITY_THRESH, num_perm=128)
+    lsh = create_lsh()
     user_min_hash = get_min_hash(user_shing)
 
-    tracks_dict = get_osm_tracks(areas_paths[command_line_args.search_area])
+    tracks_dict = get_tracks_in_limits(command_line_args)
     for track_id in tracks_dict:
-        if in_geo_limits(command_line_args, tracks_dict[track_id]):
-            min_hash = get_min_hash(set(tracks_dict[track_id]['attributes']))
-            lsh.insert(track_id, min_hash)
+        min_hash = get_min_hash(set(tracks_dict[track_id]['attributes']))
+        lsh.insert(track_id, min_hash)
 
     similar_tracks = lsh.query(user_min_hash)
-    plot_output(command_line_args, similar_tracks, tracks_dict)
+    if not command_line_args.no_map:
+        plot_output(command_line_args, similar_tracks, tracks_dict)
     pretty_print_results(user_shing, tracks_dict, command_line_args, similar_tracks)
@@ -0,0 +1,87 @@
+"""
+Rebuilds the HikingProject tracks corpus (hp\\tracks) offline, from the gpx files and the labels (progress.json) the
+crawler already saved under hp\\gpx\\<country>. No browser and no network are needed, so a change to how the tracks are
+processed (for example the tick or the length buckets of slopeMap) only requires running:
+    python hprebuild.py [--gpx-dir DIR] [--tracks-dir DIR] [--workers N]
+The tracks are processed by a pool of worker processes (with the crawler's own process_track_file). The new corpus is
+built in a fresh directory next to the old one, which it replaces only once it's complete. The tracks are saved in a
+fixed order (by country, then by track index), so rebuilding the same files always gives the same corpus.
+"""
+
+import argparse
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from CrawlJournal import CrawlJournal
+from HpTrackStore import HpTrackStore
+from hpcrawler import HpCrawler, process_track_file
+
+PROGRESS_FILENAME = 'progress.json'
+CHUNK_SIZE = 16  # The number of tracks sent to a worker at a time.
+
+
+def get_collected_tracks(gpx_dir: str) -> list:
+    """
+    :param gpx_dir: the directory of the countries directories the crawler saved (see HpCrawler).
+    :return: the tracks whose data and gpx file were collected: [(gpx path, track name, track difficulty), ...],
+    sorted by country and then by track index.
+    """
+    tracks = []
+    for country in sorted(os.listdir(gpx_dir)):
+        country_dir = os.path.join(gpx_dir, country)
+        if not os.path.exists(os.path.join(country_dir, PROGRESS_FILENAME)):
+            continue
+        # The progress file may have changes journaled after its last snapshot (see CrawlJournal):
+        progress = CrawlJournal(os.path.join(country_dir, PROGRESS_FILENAME)).state
+        for track_idx in sorted(progress, key=int):
+            gpx_path = os.path.join(country_dir, track_idx + '.gpx')
+            if os.path.exists(gpx_path):
+                tracks.append((gpx_path, country + '_' + track_idx, progress[track_idx][1]))
+    return tracks
+
+
+def rebuild_tracks(gpx_dir=HpCrawler.gpx_dir_path, tracks_dir=HpCrawler.tracks_dir_path, workers=None) -> int:
+    """
+    Processes all of the collected tracks again, into a new tracks corpus that replaces the one in tracks_dir.
+    :param gpx_dir: the directory of the countries directories the crawler saved.
+    :param tracks_dir: the directory of the tracks corpus (see HpTrackStore).
+    :param workers: the number of worker processes (None for the number of cpus).
+    :return: the number of tracks saved to the new corpus.
+    """
+    start = time.time()
+    tracks = get_collected_tracks(gpx_dir)
+    print('rebuilding', len(tracks), 'tracks...')
+
+    new_dir = tracks_dir.rstrip('\\/') + '.rebuild'
+    if os.path.exists(new_dir):  # left by a rebuild that was interrupted.
+        shutil.rmtree(new_dir)
+    store = HpTrackStore(new_dir, compact_every=len(tracks) + 1)  # every bucket is compacted once, at the end.
+    saved = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(process_track_file, *zip(*tracks), chunksize=CHUNK_SIZE) if tracks else []
+        for track_data in results:
+            if track_data is not None:  # the track is long enough
+                store.append(track_data[0], track_data[1])
+                saved += 1
+    store.compact_all()
+
+    if not os.path.exists(new_dir):  # no track was long enough.
+        os.makedirs(new_dir)
+    if os.path.exists(tracks_dir):
+        shutil.rmtree(tracks_dir)
+    os.replace(new_dir, tracks_dir)
+    print('saved', saved, 'tracks to', tracks_dir, 'in', round(time.time() - start, 1), 'seconds')
+    return saved
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Rebuilds the HikingProject tracks from the downloaded gpx files.')
+    arg_parser.add_argument("--gpx-dir", help="the directory of the countries directories the crawler saved.",
+                            default=HpCrawler.gpx_dir_path)
+    arg_parser.add_argument("--tracks-dir", help="the directory of the tracks corpus to rebuild.",
+                            default=HpCrawler.tracks_dir_path)
+    arg_parser.add_argument("--workers", help="the number of tracks processed concurrently.", type=int,
+                            default=os.cpu_count())
+    command_line_args = arg_parser.parse_args()
+    rebuild_tracks(command_line_args.gpx_dir, command_line_args.tracks_dir, command_line_args.workers)
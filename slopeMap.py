@@ -1,11 +1,11 @@
 import os
 import math
 import numpy as np
-import matplotlib.pyplot as plt
 from geopy.distance import distance
 
 LEN_SPACING = 5  # size of the "buckets" of the length_tag
 TICK = 0.125  # in kms
+EARTH_RADIUS = 6371008.8  # in meters
 
 
 def get_tick(track_len):
@@ -95,12 +95,65 @@ def compute_track_km(points):
     return np.asarray(kms)
 
 
+def compute_step_kms(points):
+    """
+    computes the (haversine) distances between consecutive points of a track, vectorized. It's a cheaper approximation of
+    the geodesic distances of compute_track_km.
+    :param points: 2-dim np array of the track's points: (lat, lon).
+    :return: a np array of the n - 1 distances, in km.
+    """
+    lat, lon = np.radians(np.asarray(points, dtype=np.float64)).T
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1))) / 1000
+
+
+def simplify_track(points, tolerance):
+    """
+    simplifies the track with the Douglas-Peucker algorithm: a point is kept only if dropping it would move the track
+    by more than <tolerance> meters. distances are measured on a local equirectangular projection of the track.
+    :param points: 2-dim np array of the track's points: (lat, lon).
+    :param tolerance: the maximal allowed deviation of the simplified track from the original one (meters).
+    :return: a boolean np array of length n, True for the points kept in the simplified track.
+    """
+    points = np.asarray(points, dtype=float)
+    keep = np.ones(len(points), dtype=bool)
+    if len(points) < 3 or tolerance <= 0:
+        return keep
+
+    # project the points to meters around the track's mean latitude:
+    mean_lat = math.radians(np.mean(points[:, 0]))
+    xy = np.column_stack([np.radians(points[:, 1]) * math.cos(mean_lat), np.radians(points[:, 0])]) * EARTH_RADIUS
+
+    keep[1:-1] = False
+    sections = [(0, len(points) - 1)]
+    while sections:
+        start, end = sections.pop()
+        if end - start < 2:
+            continue
+        chord = xy[end] - xy[start]
+        rel = xy[start + 1:end] - xy[start]
+        chord_len = np.hypot(chord[0], chord[1])
+        if chord_len == 0:  # a closed section (a loop): measure the distance from its end points.
+            dists = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dists = np.abs(chord[0] * rel[:, 1] - chord[1] * rel[:, 0]) / chord_len
+        farthest = int(np.argmax(dists))
+        if dists[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            sections.append((start, split))
+            sections.append((split, end))
+    return keep
+
+
 def plot_dist_elevation(kms, elevations):
     """
     plots the change in elevation(in meters) over distance(in km).
     :param kms: np array of length n, holding the track points, in every round km.
     :param elevations: np array of length n, holding the elevations at kms.
     """
+    import matplotlib.pyplot as plt  # imported here, so modules using slopeMap don't pay for it.
+
     fig, ax = plt.subplots()
     ax.plot(kms, elevations)
 